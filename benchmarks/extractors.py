@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import multiprocessing
+import resource
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from crawling.io.fixture_server import FixtureServer, fixture_instagram_ids
+from crawling.parsers import embedded_json
+
+N_RANKING_PAGES = 10
+ROWS_PER_RANKING_PAGE = 20
+
+
+def percentile(values: List[float], q: float) -> float:
+
+    """
+    Nearest-rank percentile
+    """
+
+    values = sorted(values)
+    return values[max(1, math.ceil(q / 100 * len(values))) - 1]
+
+
+def timed(function: Callable, *args) -> float:
+
+    time_start = perf_counter()
+    function(*args)
+    return perf_counter() - time_start
+
+
+# Every benchmark gets the base url of the fixture server and the number of repetitions, and returns the extraction
+# latency of every page in seconds. Page loads are not part of the latency, except for the end-to-end crawl.
+
+def bench_ranking(base_url: str, repeat: int) -> List[float]:
+
+    from crawling.models.influencer import Influencer
+
+    crawler = Influencer(backend='http', main_url=f"{base_url}/app/us/influencer/ranking")
+    latencies = []
+    for i in range(repeat):
+        crawler.connector.patient_page_load(f"{crawler.main_url}?page={i % N_RANKING_PAGES + 1}")
+        latencies.append(timed(crawler.get_top_n_influencers, ROWS_PER_RANKING_PAGE))
+    crawler.connector.close()
+
+    return latencies
+
+
+def bench_bs4_page_html(base_url: str, repeat: int) -> List[float]:
+
+    from crawling.models.connector import Connector
+
+    connector = Connector(backend='http')
+    latencies = []
+    pages = [('profile', '/fixture_1/'), ('post', '/p/fixture_1_1/'), ('ranking', '/app/us/influencer/ranking')]
+    for page_type, path in pages:
+        connector.patient_page_load(f"{base_url}{path}")
+        latencies.extend(timed(connector.get_bs4_page_html, page_type) for _ in range(repeat))
+    connector.close()
+
+    return latencies
+
+
+def bench_embedded_json(base_url: str, repeat: int) -> List[float]:
+
+    from crawling.models.connector import Connector
+
+    connector = Connector(backend='http')
+    profile = connector.fetch_page_source(f"{base_url}/json_1/")
+    post = connector.fetch_page_source(f"{base_url}/p/json_json_1_1/")
+    connector.close()
+
+    latencies = []
+    for _ in range(repeat):
+        latencies.append(timed(lambda: embedded_json.profile_metadata(embedded_json.extract_profile(profile))))
+        latencies.append(timed(lambda: embedded_json.post_data(embedded_json.extract_post(post))))
+
+    return latencies
+
+
+def _instagram(base_url: str):
+
+    from crawling.models.instagram import Instagram
+
+    return Instagram(headless=True, base_url=base_url, login=False)
+
+
+def bench_get_metadata(base_url: str, repeat: int) -> List[float]:
+
+    crawler = _instagram(base_url)
+    latencies = []
+    for instagram_id in fixture_instagram_ids(repeat):
+        crawler.access_influencer_account(instagram_id)
+        latencies.append(timed(lambda: (crawler.account_verification(), crawler.get_metadata())))
+    crawler.connector.close()
+
+    return latencies
+
+
+def bench_number_of_comments(base_url: str, repeat: int) -> List[float]:
+
+    crawler = _instagram(base_url)
+    crawler.access_influencer_account('@fixture_1')
+    hrefs = crawler.get_post_hrefs()
+    latencies = [timed(crawler.number_of_comments, hrefs[i % len(hrefs)]) for i in range(repeat)]
+    crawler.connector.close()
+
+    return latencies
+
+
+def bench_get_post_data(base_url: str, repeat: int) -> List[float]:
+
+    crawler = _instagram(base_url)
+    latencies = []
+    for i in range(repeat):
+        # video DOM, image DOM and json posts in turn; the page load is timed as well, since the DOM path waits on
+        # elements appearing during the load
+        href = ['/p/fixture_1_1/', '/p/image_1_1/', '/p/json_1_1/'][i % 3]
+        latencies.append(timed(crawler.get_post_data, href))
+    crawler.connector.close()
+
+    return latencies
+
+
+def bench_crawl(base_url: str, repeat: int) -> List[float]:
+
+    from crawling.crawl import crawl_influencer
+    from crawling.models.driver_pool import DriverPool
+
+    latencies = []
+
+    def crawl(session, instagram_id):
+        latencies.append(timed(crawl_influencer, *session, instagram_id))
+
+    with DriverPool(1, lambda: (_instagram(base_url), _instagram(base_url)),
+                    lambda session: [crawler.connector.close() for crawler in session]) as pool:
+        pool.map(crawl, fixture_instagram_ids(repeat))
+
+    return latencies
+
+
+BENCHMARKS = {
+    'Influencer.get_top_n_influencers (page)': (bench_ranking, False),
+    'Connector.get_bs4_page_html': (bench_bs4_page_html, False),
+    'embedded_json profile/post': (bench_embedded_json, False),
+    'Instagram.get_metadata': (bench_get_metadata, True),
+    'Instagram.number_of_comments': (bench_number_of_comments, True),
+    'Instagram.get_post_data': (bench_get_post_data, True),
+    'crawl_influencer (end-to-end)': (bench_crawl, True),
+}
+
+
+def run_benchmark(name: str, repeat: int, latency: float) -> Dict:
+
+    """
+    Run one benchmark against a fresh fixture server. Meant to run in its own process, so that the peak RSS
+    belongs to this benchmark only
+
+    Returns:
+        pages/s, p50 and p95 latency in ms, peak RSS of the process and of its children (Chrome) in MiB
+    """
+
+    benchmark, _ = BENCHMARKS[name]
+
+    with FixtureServer(latency=latency) as server:
+        time_start = perf_counter()
+        latencies = benchmark(server.base_url, repeat)
+        elapsed = perf_counter() - time_start
+
+    return {'extractor': name,
+            'pages': len(latencies),
+            'pages_per_s': len(latencies) / sum(latencies),
+            'wall_s': elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_rss_children_mib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Offline benchmark of the extractors against the fixture corpus")
+    parser.add_argument('--repeat', type=int, default=30, help='pages per extractor')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fixture server waits per request')
+    parser.add_argument('--browser', action='store_true',
+                        help='also run the extractors which need Chrome, and the end-to-end crawl')
+    parser.add_argument('--only', default=None, help='run the benchmarks whose name contains this string')
+    parser.add_argument('--output', default=None, help='also write the results as json lines to this file')
+    args = parser.parse_args()
+
+    names = [name for name, (_, needs_browser) in BENCHMARKS.items()
+             if (args.browser or not needs_browser) and (args.only is None or args.only in name)]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    print(f"{'extractor':<42}{'pages':>6}{'pages/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'RSS MiB':>9}{'child MiB':>10}")
+    for name in names:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_benchmark, (name, args.repeat, args.latency))
+        results.append(result)
+        print(f"{result['extractor']:<42}{result['pages']:>6}{result['pages_per_s']:>10.1f}{result['p50_ms']:>9.2f}"
+              f"{result['p95_ms']:>9.2f}{result['peak_rss_mib']:>9.1f}{result['peak_rss_children_mib']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,50 @@
+import argparse
+import timeit
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from crawling.io.fixture_server import FixtureServer
+from crawling.parsers import html as html_parser
+
+# page type -> (fixture path, selector read from the page)
+PAGES = {
+    'ranking': ('/app/us/influencer/ranking?page=1', 'ranking_rows'),
+    'profile': ('/fixture_1/', 'profile_grid_links'),
+    'post': ('/p/fixture_1_1/', 'post_time'),
+}
+
+
+def peak_memory(parse) -> int:
+
+    tracemalloc.start()
+    parse()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the html parsing per page type")
+    parser.add_argument('--number', type=int, default=50, help='parses per measurement')
+    args = parser.parse_args()
+
+    with FixtureServer() as server:
+        pages = {page_type: server.render(path).decode('utf-8') for page_type, (path, _) in PAGES.items()}
+
+    variants = {
+        'html.parser, whole page': lambda html, page_type: BeautifulSoup(html, 'html.parser'),
+        f'{html_parser.PARSER}, whole page': lambda html, page_type: html_parser.parse(html),
+        f'{html_parser.PARSER}, subtrees': lambda html, page_type: html_parser.parse(html, page_type),
+    }
+
+    print(f"{'page type':<10}{'variant':<28}{'ms/page':>10}{'peak KiB':>10}{'matches':>9}")
+    for page_type, (_, selector) in PAGES.items():
+        html = pages[page_type]
+        for name, parse in variants.items():
+            seconds = min(timeit.repeat(lambda: parse(html, page_type), number=args.number, repeat=3)) / args.number
+            peak = peak_memory(lambda: parse(html, page_type))
+            matches = len(html_parser.select(parse(html, page_type), selector))
+            print(f"{page_type:<10}{name:<28}{seconds * 1000:>10.3f}{peak / 1024:>10.0f}{matches:>9}")
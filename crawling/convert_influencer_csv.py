@@ -0,0 +1,46 @@
+import argparse
+import glob
+import os
+
+import pandas as pd
+
+from crawling.io.path_definition import get_file
+from crawling.io.result_store import ResultStore
+from crawling.io.schema import split_wide_info
+
+
+def convert_influencer_csv(csv_folder: str, store: ResultStore) -> int:
+
+    """
+    Move the per-influencer csv files written by former versions of run.py into the result store
+
+    Args:
+        csv_folder: folder of the {instagram_id}.csv files
+        store: the result store
+    Returns:
+        number of converted influencers
+    """
+
+    files = sorted(glob.glob(os.path.join(csv_folder, "*.csv")))
+
+    for file in files:
+        # the files are the transposed wide info: one column named by the instagram id, indexed by the keys
+        influencer_df = pd.read_csv(file, sep=';', index_col=0)
+        instagram_id = influencer_df.columns[0]
+        info = influencer_df[instagram_id].dropna().to_dict()
+        store.save(instagram_id, *split_wide_info(info), crawled_at=os.path.getmtime(file))
+
+    return len(files)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convert the per-influencer csv files into the result store")
+    parser.add_argument('--csv-folder', default=get_file('data/influencer'))
+    parser.add_argument('--store', default=get_file('data/influencer.sqlite'))
+    args = parser.parse_args()
+
+    with ResultStore(args.store) as result_store:
+        n_converted = convert_influencer_csv(args.csv_folder, result_store)
+
+    print(f"converted {n_converted} influencers into {args.store}")
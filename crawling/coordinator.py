@@ -0,0 +1,91 @@
+import argparse
+import time
+from typing import List
+
+import pandas as pd
+
+from crawling.io.fixture_server import fixture_instagram_ids
+from crawling.io.path_definition import get_file
+from crawling.io.result_store import ResultStore
+from crawling.io.work_queue import FAILED, LEASED, PENDING, WorkQueue
+
+
+def coordinate(work_queue: WorkQueue, store: ResultStore, instagram_ids: List[str],
+               poll_seconds: float = 5.0) -> int:
+
+    """
+    Hand the influencers to the workers of the work queue and store their results as they come in, until every
+    influencer is crawled or given up. Workers may join and leave at any time, the items of a worker which stops
+    sending heartbeats go to the others once its leases expire.
+
+    Args:
+        work_queue: the queue shared with the workers, see run.py --queue
+        store: where the results go
+        instagram_ids: the influencers to crawl. Those stored already and those in the queue already are skipped
+        poll_seconds: seconds between two collections of the results
+    Returns:
+        number of stored influencers
+    """
+
+    completed_ids = store.completed_ids()
+    n_new = work_queue.enqueue(instagram_id for instagram_id in instagram_ids if instagram_id not in completed_ids)
+    print(f"enqueued {n_new} influencers, {work_queue.counts()}")
+
+    n_stored = 0
+    time_start = time.time()
+
+    while True:
+        drained = work_queue.is_drained()
+
+        # results are marked collected once stored, a failed save leaves them to the next collection
+        while True:
+            results = work_queue.collect(limit=1000)
+            if not results:
+                break
+            for instagram_id, (influencer, posts) in results:
+                store.save(instagram_id, influencer, posts)
+                n_stored += 1
+            work_queue.mark_collected([instagram_id for instagram_id, _ in results])
+
+        if drained:
+            break
+
+        counts = work_queue.counts()
+        elapsed = time.time() - time_start
+        print(f"{n_stored} stored ({n_stored / elapsed if elapsed > 0 else 0:.2f} influencers/s), "
+              f"{counts[PENDING]} pending, {counts[LEASED]} leased, {counts[FAILED]} given up, "
+              f"{len(work_queue.workers())} workers alive")
+        time.sleep(poll_seconds)
+
+    for instagram_id, reason in work_queue.failures().items():
+        store.mark_failed(instagram_id, reason)
+
+    return n_stored
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Coordinate crawl workers on several hosts through a work queue. "
+                                                 "Start the workers with: python run.py --queue <queue file>")
+    parser.add_argument('--queue', default=get_file('data/work_queue.sqlite'),
+                        help='work queue file, on a volume shared by all hosts')
+    parser.add_argument('--influencers', default='data/influencer_dataframe.csv',
+                        help='csv file created by crawling.get_influencer_list_as_dataframe')
+    parser.add_argument('--fixture', action='store_true',
+                        help='enqueue the influencers of the fixture server, for workers started with --fixture')
+    parser.add_argument('--limit', type=int, default=None, help='crawl only the first n influencers')
+    parser.add_argument('--store', default=get_file('data/influencer.sqlite'), help='SQLite file of the results')
+    parser.add_argument('--lease-seconds', type=float, default=120.0,
+                        help='how long a lease lasts without heartbeat, the workers must use the same value')
+    parser.add_argument('--poll-seconds', type=float, default=5.0, help='seconds between two collections')
+    args = parser.parse_args()
+
+    if args.fixture:
+        ids = fixture_instagram_ids(args.limit or 100)
+    else:
+        ids = list(pd.read_csv(args.influencers, sep=';', index_col=0)['instagram_id'].values[:args.limit])
+
+    with WorkQueue(args.queue, lease_seconds=args.lease_seconds) as queue, ResultStore(args.store) as result_store:
+        n_influencers = coordinate(queue, result_store, ids, poll_seconds=args.poll_seconds)
+
+    print(f"stored {n_influencers} influencers in {args.store}")
@@ -0,0 +1,126 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from crawling.io.schema import aggregate_posts, fingerprint
+from crawling.io.work_queue import WorkQueue
+from crawling.models.instagram import Instagram
+from crawling.models.metrics import DEFAULT_METRICS
+from crawling.models.retry_policy import CircuitBreaker, CrawlFailed, PageLoadFailed
+
+
+def crawl_influencer(connector_front: Instagram, connector_post: Instagram, instagram_id: str,
+                     n_posts: int = 10, circuit_breaker: Optional[CircuitBreaker] = None,
+                     previous: Optional[Tuple[Dict, List[Dict]]] = None) -> Optional[Tuple[Dict, List[Dict]]]:
+
+    '''
+    Crawl the front page and the first posts of one influencer. Posts are read from the front page and the
+    following pages of its timeline where possible, connector_post only opens the posts whose data they lack.
+
+    Given the result of an earlier crawl, only the front page is read if its fingerprint (number of posts, latest
+    post) is unchanged. Otherwise only the posts not crawled before are read, the others are taken over.
+
+    Args:
+        connector_front: Instagram session used for the influencer's front page
+        connector_post: Instagram session used for the single post pages
+        instagram_id: the influencer's id, e.g. @therock
+        n_posts: number of posts to visit, may be hundreds
+        circuit_breaker: gives up on the influencer after too many failed page loads
+        previous: the influencer columns and the posts of an earlier crawl, see ResultStore.load_influencer
+    Returns:
+        the influencer columns and one dict per post (see crawling.io.schema), or None if the front page cannot
+        be read. previous itself if the profile is unchanged
+    Raises:
+        CrawlFailed: if the front page cannot be loaded or the circuit breaker gives up on the influencer
+    '''
+
+    with DEFAULT_METRICS.influencer(instagram_id):
+        return _crawl_influencer(connector_front, connector_post, instagram_id, n_posts, circuit_breaker, previous)
+
+
+def _crawl_influencer(connector_front: Instagram, connector_post: Instagram, instagram_id: str, n_posts: int,
+                      circuit_breaker: Optional[CircuitBreaker],
+                      previous: Optional[Tuple[Dict, List[Dict]]]) -> Optional[Tuple[Dict, List[Dict]]]:
+
+    try:
+        connector_front.access_influencer_account(instagram_id)
+    except PageLoadFailed as e:
+        raise CrawlFailed(f"{instagram_id}: {e}") from e
+
+    influencer = {}
+    influencer.update(connector_front.account_verification())
+    metadata = connector_front.get_metadata()
+    if not metadata:
+        return None
+    influencer.update(metadata)
+
+    previous_posts = {}
+    if previous is not None:
+        latest = [{'shortcode': _shortcode(href)} for href in connector_front.get_post_hrefs()[:1]]
+        if fingerprint(influencer, latest) == fingerprint(*previous):
+            return previous
+        # the timeline is streamed once, the posts crawled before are taken over where they show up in it
+        previous_posts = {post['shortcode']: post for post in previous[1]}
+
+    posts = connector_front.get_top_posts(n_posts, post_connector=connector_post,
+                                          circuit_breaker=circuit_breaker or CircuitBreaker(),
+                                          previous_posts=previous_posts)
+
+    for post in posts:
+        post['shortcode'] = _shortcode(post.pop('href'))
+
+    for post_index, post in enumerate(posts):
+        post['post_index'] = post_index
+
+    influencer.update(aggregate_posts(posts))
+
+    return influencer, posts
+
+
+def _shortcode(href: str) -> str:
+
+    return href.strip('/').split('/')[-1]
+
+
+def crawl_from_queue(work_queue: WorkQueue, worker: str, session: Tuple[Instagram, Instagram],
+                     circuit_breaker: Optional[CircuitBreaker] = None, idle_seconds: float = 5.0,
+                     n_posts: int = 10) -> int:
+
+    '''
+    Crawl influencers leased from a work queue with one session until the queue is drained, submitting every
+    result to the queue. The caller keeps the leases alive, see WorkQueue.keep_alive
+
+    Args:
+        work_queue: the queue shared with the coordinator and the other workers
+        worker: the id of the worker, unique across the hosts
+        session: the front page and the post connector, see crawl_influencer
+        circuit_breaker: gives up on an influencer after too many failed page loads
+        idle_seconds: how long to wait for work while other workers hold the remaining leases
+        n_posts: number of posts to visit per influencer
+    Returns:
+        number of influencers crawled
+    '''
+
+    n_done = 0
+
+    while True:
+        items = work_queue.lease(worker)
+        if not items:
+            if work_queue.is_drained():
+                return n_done
+            # the leases of a dead worker expire sooner or later
+            time.sleep(idle_seconds)
+            continue
+
+        instagram_id = items[0]
+        try:
+            result = crawl_influencer(*session, instagram_id, n_posts=n_posts, circuit_breaker=circuit_breaker)
+        except Exception as e:
+            print(f"give up {instagram_id} for now: {e}")
+            work_queue.fail(instagram_id, worker, str(e))
+            continue
+        if result is None:
+            work_queue.fail(instagram_id, worker, "the front page cannot be read")
+            continue
+
+        work_queue.complete(instagram_id, worker, result)
+        n_done += 1
@@ -0,0 +1,135 @@
+import argparse
+import os
+import tempfile
+from time import perf_counter
+from typing import Optional
+
+from crawling.io.comment_store import CommentStore
+from crawling.io.fixture_server import FixtureServer
+from crawling.io.path_definition import get_file
+from crawling.io.result_store import ResultStore
+from crawling.models.driver_pool import DriverPool
+from crawling.models.instagram import Instagram
+from crawling.models.metrics import DEFAULT_METRICS
+from crawling.models.retry_policy import PageLoadFailed
+
+
+def crawl_comments(session: Instagram, store: CommentStore, post_href: str, end_cursor: Optional[str] = None,
+                   chunk_size: int = 500, max_comments: Optional[int] = None) -> int:
+
+    """
+    Stream the comments of one post into the comment store, chunk by chunk. At most one chunk and one page of
+    comments are held in memory, whatever the number of comments of the post
+
+    Args:
+        session: Instagram session used to open the post
+        store: where the comments go
+        post_href: href of the post, e.g. /p/CXixCI9Ll0E/
+        end_cursor: resume after the page this cursor ends, see CommentStore.cursors
+        chunk_size: number of comments written at once
+        max_comments: stop after this many comments, the post can be continued later. All comments if not given
+    Returns:
+        number of comments read
+    Raises:
+        PageLoadFailed: if a page cannot be loaded, the chunks written before are kept
+    """
+
+    shortcode = post_href.strip('/').split('/')[-1]
+    chunk = []
+    n_comments = 0
+    time_start = perf_counter()
+
+    for comments, end_cursor in session.iter_comments(post_href, end_cursor=end_cursor):
+        chunk.extend(comments)
+        n_comments += len(comments)
+        if end_cursor is None or len(chunk) >= chunk_size:
+            store.write(shortcode, chunk, end_cursor)
+            chunk = []
+        if max_comments is not None and n_comments >= max_comments:
+            break
+
+    if chunk:
+        store.write(shortcode, chunk, end_cursor)
+
+    elapsed = perf_counter() - time_start
+    print(f"{shortcode}: {n_comments} comments in {elapsed:.1f} s "
+          f"({n_comments / elapsed if elapsed > 0 else 0:.0f} comments/s)")
+
+    return n_comments
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Crawl the comments of the crawled posts")
+    parser.add_argument('--n-drivers', type=int, default=1, help='number of parallel sessions')
+    parser.add_argument('--store', default=get_file('data/influencer.sqlite'),
+                        help='SQLite file of the results of run.py, its posts are crawled')
+    parser.add_argument('--comments', default=None,
+                        help='SQLite file of the comments, data/comment.sqlite by default')
+    parser.add_argument('--headless', action='store_true', help='run Chrome in headless mode')
+    parser.add_argument('--profile', choices=['default', 'crawl'], default='default',
+                        help="Chrome profile, 'crawl' blocks images, media, fonts and trackers")
+    parser.add_argument('--fixture', action='store_true',
+                        help='crawl the posts of a local fixture server instead of Instagram')
+    parser.add_argument('--fixture-latency', type=float, default=0.0,
+                        help='seconds the fixture server waits before answering each request')
+    parser.add_argument('--limit', type=int, default=None, help='crawl only the first n posts')
+    parser.add_argument('--chunk-size', type=int, default=500, help='number of comments written at once')
+    parser.add_argument('--max-comments', type=int, default=None,
+                        help='comments per post and run, a later run continues the post')
+    parser.add_argument('--metrics', action='store_true', help='time every crawl stage and print a report')
+    args = parser.parse_args()
+
+    if args.metrics:
+        DEFAULT_METRICS.enable()
+
+    fixture_server = None
+    base_url = "https://www.instagram.com"
+
+    if args.fixture:
+        fixture_server = FixtureServer(latency=args.fixture_latency)
+        base_url = fixture_server.start()
+        comment_file = args.comments or os.path.join(tempfile.mkdtemp(prefix='fixture_comment_'), 'comment.sqlite')
+        # posts carrying their comments as json, the comments of the others are expanded in the page
+        shortcodes = [f"json_post_{i}" for i in range(args.limit or 20)]
+    else:
+        comment_file = args.comments or get_file('data/comment.sqlite')
+        with ResultStore(args.store) as result_store:
+            shortcodes = list(result_store.load_posts()['shortcode'].dropna().unique()[:args.limit])
+
+    comment_store = CommentStore(comment_file)
+    finished_shortcodes = comment_store.finished_shortcodes()
+    # rendered comments leave an empty cursor, they restart from the first
+    cursors = comment_store.cursors()
+    shortcodes = [shortcode for shortcode in shortcodes if shortcode not in finished_shortcodes]
+
+    def start_session():
+        return Instagram(headless=args.headless, base_url=base_url, login=not args.fixture, profile=args.profile)
+
+    def close_session(session):
+        session.connector.close()
+
+    def crawl_and_save(session, shortcode):
+        try:
+            return crawl_comments(session, comment_store, f"/p/{shortcode}/", end_cursor=cursors.get(shortcode),
+                                  chunk_size=args.chunk_size, max_comments=args.max_comments)
+        except PageLoadFailed as e:
+            print(f"give up the comments of {shortcode} for now: {e}")
+            return None
+
+    with DriverPool(args.n_drivers, start_session, close_session) as pool:
+        time_start = perf_counter()
+        results = pool.map(crawl_and_save, shortcodes)
+        elapsed = perf_counter() - time_start
+
+    n_comments = sum(filter(None, results.values()))
+    print(f"crawled {n_comments} comments of {sum(result is not None for result in results.values())}/"
+          f"{len(shortcodes)} posts with {args.n_drivers} sessions in {elapsed:.1f} s "
+          f"({n_comments / elapsed if elapsed > 0 else 0:.0f} comments/s), results in {comment_file}")
+    if DEFAULT_METRICS.enabled:
+        print(DEFAULT_METRICS.summary())
+        DEFAULT_METRICS.disable()
+
+    comment_store.close()
+    if fixture_server is not None:
+        fixture_server.stop()
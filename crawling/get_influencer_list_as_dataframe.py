@@ -1,17 +1,16 @@
 import os
 
-import pandas as pd
-
+from crawling.io.schema import influencer_list_frame
 from crawling.models.influencer import Influencer
 from crawling.io.path_definition import get_project_dir
 
 if __name__ == "__main__":
 
-    crawler = Influencer()
+    crawler = Influencer(backend='http')
 
     list_of_influencer = crawler.get_top_n_influencers(1000)
 
-    df_influencer = pd.DataFrame(list_of_influencer)
+    df_influencer = influencer_list_frame(list_of_influencer)
 
     dir_result = f"{get_project_dir()}/data"
 
@@ -20,4 +19,4 @@ if __name__ == "__main__":
 
     df_influencer.to_csv(f"{dir_result}/influencer_dataframe.csv", sep=";")
 
-    crawler.driver.close()
\ No newline at end of file
+    crawler.connector.close()
\ No newline at end of file
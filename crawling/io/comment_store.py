@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+import pandas as pd
+
+from crawling.io.path_definition import get_file
+from crawling.io.schema import COMMENT_DTYPES, comment_frame
+
+
+class CommentStore:
+
+    """Append-only store of the comments of the crawled posts in a single SQLite database.
+
+    Comments arrive in chunks while a post is paged through. Every chunk is written in one transaction together
+    with the cursor of the page it ends at, so that a crawl interrupted after any chunk resumes from that page, and
+    a post with 100k comments never has to be held in memory. The database runs in WAL mode like ResultStore.
+
+    Attributes:
+        file: path to the database
+
+    Methods:
+        write: store a chunk of comments of a post and the cursor to continue from
+        cursors: where the unfinished posts continue
+        finished_shortcodes: posts whose comments are all stored
+        n_comments: number of stored comments per post
+        iter_comments: the typed comment table in chunks
+        load_comments: the typed comment table
+    """
+
+    def __init__(self, file: str = get_file("data/comment.sqlite")):
+
+        """
+        Args:
+            file: path to the database, created if missing
+        """
+
+        directory = os.path.dirname(file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file = file
+        self.__lock = threading.Lock()
+        # the connection is shared by the workers of a DriverPool, every access holds the lock
+        self.__connection = sqlite3.connect(file, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS comment ("
+                                      "shortcode TEXT NOT NULL, comment_id TEXT NOT NULL, username TEXT, text TEXT, "
+                                      "created_at INTEGER, PRIMARY KEY (shortcode, comment_id))")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS comment_crawl ("
+                                      "shortcode TEXT PRIMARY KEY, end_cursor TEXT, finished INTEGER NOT NULL, "
+                                      "updated_at REAL NOT NULL)")
+
+    def write(self, shortcode: str, comments: List[Dict], end_cursor: Optional[str]):
+
+        '''
+        Store a chunk of comments of a post. Comments stored before, e.g. by an interrupted crawl, are kept
+
+        Args:
+            shortcode: the post, e.g. CXixCI9Ll0E
+            comments: one dict per comment, see COMMENT_DTYPES
+            end_cursor: cursor of the page following the chunk, None if the chunk ends the post
+        '''
+
+        rows = [(shortcode, str(comment['comment_id']), comment.get('username'), comment.get('text'),
+                 comment.get('created_at')) for comment in comments if comment.get('comment_id') is not None]
+
+        with self.__lock, self.__connection:
+            self.__connection.executemany("INSERT OR IGNORE INTO comment VALUES (?, ?, ?, ?, ?)", rows)
+            self.__connection.execute("INSERT OR REPLACE INTO comment_crawl VALUES (?, ?, ?, ?)",
+                                      (shortcode, end_cursor, int(end_cursor is None), time.time()))
+
+    def cursors(self) -> Dict[str, str]:
+
+        '''
+        Returns:
+            shortcode to the cursor its comments continue from, for the posts started but not finished
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT shortcode, end_cursor FROM comment_crawl WHERE finished = 0").fetchall()
+
+        return dict(rows)
+
+    def finished_shortcodes(self) -> Set[str]:
+
+        '''
+        Returns:
+            the posts whose comments are all stored
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute("SELECT shortcode FROM comment_crawl WHERE finished = 1").fetchall()
+
+        return {shortcode for shortcode, in rows}
+
+    def n_comments(self) -> Dict[str, int]:
+
+        '''
+        Returns:
+            shortcode to its number of stored comments
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute("SELECT shortcode, COUNT(*) FROM comment GROUP BY shortcode").fetchall()
+
+        return dict(rows)
+
+    def iter_comments(self, shortcode: Optional[str] = None, chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+
+        '''
+        Read the comments chunk by chunk, for tables too large for the memory
+
+        Args:
+            shortcode: only the comments of this post, all comments if not given
+            chunk_size: rows per chunk
+        Yields:
+            the typed comment table of chunk_size comments, see comment_frame
+        '''
+
+        last = ('', '')
+        while True:
+            with self.__lock:
+                # keyset pagination, the primary key index makes every chunk as cheap as the first
+                if shortcode is None:
+                    rows = self.__connection.execute(
+                        "SELECT * FROM comment WHERE (shortcode, comment_id) > (?, ?) "
+                        "ORDER BY shortcode, comment_id LIMIT ?", (*last, chunk_size)).fetchall()
+                else:
+                    rows = self.__connection.execute(
+                        "SELECT * FROM comment WHERE shortcode = ? AND comment_id > ? ORDER BY comment_id LIMIT ?",
+                        (shortcode, last[1], chunk_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][:2]
+            yield comment_frame([dict(zip(['shortcode'] + list(COMMENT_DTYPES), row)) for row in rows])
+
+    def load_comments(self, shortcode: Optional[str] = None) -> pd.DataFrame:
+
+        '''
+        Args:
+            shortcode: only the comments of this post, all comments if not given
+        Returns:
+            the typed comment table, one row per comment
+        '''
+
+        chunks = list(self.iter_comments(shortcode))
+        if not chunks:
+            return comment_frame([])
+
+        df = pd.concat(chunks, ignore_index=True)
+        # the chunks have categories of their own
+        df['shortcode'] = df['shortcode'].astype('category')
+
+        return df
+
+    def close(self):
+
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
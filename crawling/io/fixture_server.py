@@ -0,0 +1,315 @@
+import argparse
+import json
+import mimetypes
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from crawling.io.path_definition import get_file
+
+# (path pattern, fixture file relative to the fixture root, default values). Named groups and query parameters
+# are substituted into the $placeholders of the fixture file name and of the fixture file.
+#
+# The corpus covers every page variant the extractors handle:
+#   /app/us/influencer/ranking?page=1..10   starngage ranking, 20 rows per page
+#   /fixture_<n>/, /p/<shortcode>/           verified profile and video post with comments rendered as DOM
+#   /unverified_<n>/, /p/image_<shortcode>/  unverified profile and image post rendered as DOM
+#   /json_<n>/, /p/json_<shortcode>/         profile and post carrying their data as embedded json
+#   /media/<name>                            images and videos, bytes generated from the name, with Range support.
+#                                            /media/repost_<any> all have the same content
+#   /graphql/query/?variables={"after": ..}  the timeline pages following the posts of a json profile, and the
+#                                            comment pages following the comments of a json post
+DEFAULT_ROUTES = [
+    (r"^/graphql/query/?$", "instagram/timeline_$after.json", {}),
+    (r"^/graphql/query/?$", "instagram/comments_$after.json", {}),
+    (r"^/app/us/influencer/ranking/?$", "starngage/ranking_$page.html", {'page': '1'}),
+    (r"^/accounts/login/?$", "instagram/login.html", {}),
+    (r"^/p/(?P<shortcode>json_[\w-]+)/?$", "instagram/post_json.html", {}),
+    (r"^/p/(?P<shortcode>image_[\w-]+)/?$", "instagram/post_image.html", {}),
+    (r"^/p/(?P<shortcode>[\w-]+)/?$", "instagram/post.html", {}),
+    (r"^/(?P<username>json_[\w.]+)/?$", "instagram/profile_json.html", {}),
+    (r"^/(?P<username>unverified_[\w.]+)/?$", "instagram/profile_unverified.html", {}),
+    (r"^/(?P<username>[\w.]+)/?$", "instagram/profile.html", {}),
+]
+
+FIXTURE_ACCOUNT_KINDS = ('fixture', 'json', 'unverified')
+
+RANGE_REGEX = re.compile(r'^bytes=(\d+)-$')
+
+
+def fixture_instagram_ids(n: int) -> List[str]:
+
+    """
+    Get instagram ids served by the fixture server, cycling through the profile variants
+
+    Args:
+        n: number of ids
+    """
+
+    return [f"@{FIXTURE_ACCOUNT_KINDS[i % len(FIXTURE_ACCOUNT_KINDS)]}_{i}" for i in range(n)]
+
+
+class FixtureServer:
+
+    """A local HTTP server serving saved pages, so that the crawler can run without the network.
+
+    Delays and errors can be injected to see how the crawler copes with a slow or flaky site.
+
+    Attributes:
+        root: directory of the fixture files
+        latency: seconds to wait before answering each request
+        jitter: up to this many seconds are added to the latency at random
+        stall_probability: probability that a request stalls for stall_seconds on top of the latency
+        stall_seconds: duration of a stall
+        error_rate: probability that a request is answered with 503
+        base_url: url of the running server, e.g. http://127.0.0.1:50123
+
+    Methods:
+        start: start serving in a background thread
+        stop: shut the server down
+    """
+
+    def __init__(self, root: str = get_file("fixtures"), host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, stall_probability: float = 0.0,
+                 stall_seconds: float = 30.0, error_rate: float = 0.0, seed: Optional[int] = None,
+                 routes: Optional[List[Tuple[str, str, Dict[str, str]]]] = None):
+
+        """
+        Args:
+            root: directory of the fixture files
+            host: interface to bind
+            port: port to bind, 0 picks a free one
+            latency: seconds to wait before answering each request
+            jitter: up to this many seconds are added to the latency at random
+            stall_probability: probability that a request stalls for stall_seconds on top of the latency
+            stall_seconds: duration of a stall
+            error_rate: probability that a request is answered with 503
+            seed: seed of the injected randomness
+            routes: list of (path regex, fixture file, default values)
+        """
+
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        self.stall_probability = stall_probability
+        self.stall_seconds = stall_seconds
+        self.error_rate = error_rate
+        self.__rng = random.Random(seed)
+        self.__rng_lock = threading.Lock()
+        self.__routes = [(re.compile(pattern), file, defaults)
+                         for pattern, file, defaults in (routes or DEFAULT_ROUTES)]
+        self.__httpd = ThreadingHTTPServer((host, port), self.__handler_class())
+        self.__httpd.daemon_threads = True
+        self.__thread = None
+
+        host, port = self.__httpd.server_address[:2]
+        self.base_url = f"http://{host}:{port}"
+
+    def __handler_class(self):
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up waiting, e.g. after an injected stall
+                    pass
+
+            def do_GET(self):
+                delay, fail = server.inject()
+                if delay > 0:
+                    time.sleep(delay)
+                if fail:
+                    self.send_error(503)
+                    return
+
+                if urlsplit(self.path).path.startswith('/media/'):
+                    self.send_media()
+                    return
+
+                body = server.render(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", server.content_type(self.path))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_media(self):
+                body = server.media(self.path)
+                start = 0
+                match = RANGE_REGEX.match(self.headers.get('Range', ''))
+                if match is not None:
+                    start = int(match.group(1))
+                    if start >= len(body):
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", mimetypes.guess_type(urlsplit(self.path).path)[0] or
+                                 "application/octet-stream")
+                self.send_header("Content-Length", str(len(body) - start))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                self.wfile.write(body[start:])
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def inject(self) -> Tuple[float, bool]:
+
+        '''
+        Draw the delay and the failure of a request
+
+        Returns:
+            seconds to wait, and if the request fails
+        '''
+
+        with self.__rng_lock:
+            delay = self.latency + self.__rng.uniform(0, self.jitter)
+            if self.__rng.random() < self.stall_probability:
+                delay += self.stall_seconds
+            fail = self.__rng.random() < self.error_rate
+
+        return delay, fail
+
+    def __route(self, path: str) -> Optional[Tuple[str, Dict[str, str]]]:
+
+        url = urlsplit(path)
+        for pattern, file, defaults in self.__routes:
+            match = pattern.match(url.path)
+            if match is None:
+                continue
+            values = dict(defaults)
+            values.update(parse_qsl(url.query))
+            # GraphQL queries carry their parameters as a json object
+            try:
+                variables = json.loads(values.get('variables', ''))
+            except ValueError:
+                variables = None
+            if isinstance(variables, dict):
+                values.update((key, str(value)) for key, value in variables.items())
+            values.update(match.groupdict())
+            values['base_url'] = self.base_url
+            file = os.path.normpath(os.path.join(self.root, Template(file).safe_substitute(values)))
+            if not file.startswith(os.path.normpath(self.root)) or not os.path.isfile(file):
+                # e.g. a GraphQL cursor of another query, try the next route
+                continue
+            return file, values
+
+        return None
+
+    def render(self, path: str) -> Optional[bytes]:
+
+        '''
+        Render the fixture page registered for a request path
+
+        Args:
+            path: request path including the query string
+        Returns:
+            the page as bytes, or None if no route matches
+        '''
+
+        route = self.__route(path)
+        if route is None:
+            return None
+
+        file, values = route
+        with open(file, 'r', encoding='utf-8') as f:
+            template = Template(f.read())
+
+        return template.safe_substitute(values).encode('utf-8')
+
+    def media(self, path: str) -> bytes:
+
+        '''
+        Generate the bytes of a media file, the same for the same name
+
+        Args:
+            path: request path of the file, e.g. /media/CXixCI9Ll0E.jpg
+        Returns:
+            between 16 and 256 kB
+        '''
+
+        name = os.path.basename(urlsplit(path).path)
+        if name.startswith('repost_'):
+            # the same picture posted under several names
+            name = 'repost'
+        rng = random.Random(name)
+        size = rng.randint(16, 256) * 1024
+
+        return rng.getrandbits(8 * size).to_bytes(size, 'little')
+
+    def content_type(self, path: str) -> str:
+
+        '''
+        Args:
+            path: request path including the query string
+        Returns:
+            the content type of the fixture file registered for the path, html if none is
+        '''
+
+        route = self.__route(path)
+        content_type = mimetypes.guess_type(route[0])[0] if route is not None else None
+
+        return f"{content_type or 'text/html'}; charset=utf-8"
+
+    def start(self) -> str:
+
+        '''
+        Serve in a background thread
+
+        Returns:
+            the base url of the server
+        '''
+
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self.base_url
+
+    def stop(self):
+
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve the saved pages locally")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--stall-probability', type=float, default=0.0)
+    parser.add_argument('--stall-seconds', type=float, default=30.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FixtureServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                       stall_probability=args.stall_probability, stall_seconds=args.stall_seconds,
+                       error_rate=args.error_rate) as server:
+        print(f"serving {server.root} on {server.base_url}")
+        while True:
+            time.sleep(3600)
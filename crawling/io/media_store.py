@@ -0,0 +1,197 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+from crawling.io.path_definition import get_file
+
+
+def _url_key(url: str) -> str:
+
+    # media urls are signed with query parameters which change from crawl to crawl, the path names the file
+    url = urlsplit(url)
+
+    return hashlib.sha256(f"{url.netloc}{url.path}".encode('utf-8')).hexdigest()[:32]
+
+
+class MediaStore:
+
+    """Content-addressed store of the images and videos of the posts.
+
+    Every file is stored once, under the sha256 of its content (objects/<2 hex>/<64 hex>), so that reposts and
+    carousel items seen in several posts take the space of one file. A download goes to a .part file named after its
+    url, which a later attempt continues from. A SQLite index maps every post to the hashes of its media, in carousel
+    order, and every url to the hash of its content, so that known urls are not downloaded again.
+
+    Attributes:
+        directory: root of the store
+
+    Methods:
+        known_hash: the hash of a url downloaded before
+        part_file: where a url is downloaded to
+        commit: move a finished download into the store
+        add_post: record the media of a post
+        post_media: the hashes of the media of a post
+        shortcodes: the posts whose media are stored
+        path: the file of a hash
+        summary: number of files and bytes stored
+    """
+
+    def __init__(self, directory: str = get_file("data/media")):
+
+        """
+        Args:
+            directory: root of the store, created if missing
+        """
+
+        self.directory = directory
+        for subdirectory in ('objects', 'partial'):
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+        self.__lock = threading.Lock()
+        # the connection is shared by the download threads, every access holds the lock
+        self.__connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS media ("
+                                      "hash TEXT PRIMARY KEY, size INTEGER NOT NULL, extension TEXT, "
+                                      "stored_at REAL NOT NULL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS url ("
+                                      "url_key TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS post_media ("
+                                      "shortcode TEXT NOT NULL, position INTEGER NOT NULL, hash TEXT NOT NULL, "
+                                      "PRIMARY KEY (shortcode, position))")
+
+    def path(self, digest: str) -> str:
+
+        '''
+        Args:
+            digest: sha256 of the content, in hex
+        Returns:
+            the file of the content
+        '''
+
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def part_file(self, url: str) -> str:
+
+        '''
+        Returns:
+            the file a url is downloaded to until it is complete
+        '''
+
+        return os.path.join(self.directory, 'partial', f"{_url_key(url)}.part")
+
+    def known_hash(self, url: str) -> Optional[str]:
+
+        '''
+        Returns:
+            the hash of the content of a url downloaded before, None if it is not in the store
+        '''
+
+        with self.__lock:
+            row = self.__connection.execute("SELECT hash FROM url WHERE url_key = ?", (_url_key(url),)).fetchone()
+
+        if row is None or not os.path.isfile(self.path(row[0])):
+            return None
+
+        return row[0]
+
+    def commit(self, url: str, part_file: str, digest: str) -> bool:
+
+        '''
+        Move a finished download into the store, or drop it if the store has its content already
+
+        Args:
+            url: the url downloaded
+            part_file: the downloaded file
+            digest: sha256 of its content, in hex
+        Returns:
+            True if the content is new to the store
+        '''
+
+        target = self.path(digest)
+        size = os.path.getsize(part_file)
+
+        with self.__lock:
+            new = not os.path.isfile(target)
+            if new:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(part_file, target)
+            else:
+                os.remove(part_file)
+            with self.__connection:
+                self.__connection.execute("INSERT OR IGNORE INTO media VALUES (?, ?, ?, ?)",
+                                          (digest, size, os.path.splitext(urlsplit(url).path)[1], time.time()))
+                self.__connection.execute("INSERT OR REPLACE INTO url VALUES (?, ?)", (_url_key(url), digest))
+
+        return new
+
+    def add_post(self, shortcode: str, digests: List[str]):
+
+        '''
+        Record the media of a post, replacing an earlier record
+
+        Args:
+            shortcode: the post, e.g. CXixCI9Ll0E
+            digests: the hashes of its media, in carousel order
+        '''
+
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM post_media WHERE shortcode = ?", (shortcode,))
+            self.__connection.executemany("INSERT INTO post_media VALUES (?, ?, ?)",
+                                          [(shortcode, position, digest) for position, digest in enumerate(digests)])
+
+    def post_media(self, shortcode: str) -> List[str]:
+
+        '''
+        Returns:
+            the hashes of the media of a post in carousel order, see path. Empty if they are not stored
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute("SELECT hash FROM post_media WHERE shortcode = ? ORDER BY position",
+                                             (shortcode,)).fetchall()
+
+        return [digest for digest, in rows]
+
+    def shortcodes(self) -> Set[str]:
+
+        '''
+        Returns:
+            the posts whose media are stored
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute("SELECT DISTINCT shortcode FROM post_media").fetchall()
+
+        return {shortcode for shortcode, in rows}
+
+    def summary(self) -> Dict[str, int]:
+
+        '''
+        Returns:
+            number of posts, of stored files and of their bytes
+        '''
+
+        with self.__lock:
+            n_posts, = self.__connection.execute("SELECT COUNT(DISTINCT shortcode) FROM post_media").fetchone()
+            n_files, n_bytes = self.__connection.execute("SELECT COUNT(*), SUM(size) FROM media").fetchone()
+
+        return {'posts': n_posts, 'files': n_files, 'bytes': n_bytes or 0}
+
+    def close(self):
+
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from crawling.io.path_definition import get_file
+from crawling.io.schema import INFLUENCER_DTYPES, POST_DTYPES, influencer_frame, post_frame
+
+SQL_TYPES = {'object': 'TEXT', 'float32': 'REAL'}
+
+
+def _columns_sql(dtypes: Dict[str, str]) -> str:
+
+    return ", ".join(f"{column} {SQL_TYPES.get(dtype, 'INTEGER')}" for column, dtype in dtypes.items())
+
+
+class ResultStore:
+
+    """Store of the latest crawl results in a single SQLite database.
+
+    The results are normalized into a table influencer, one row per influencer with the pre-aggregated post
+    statistics, and a table post, one row per crawled post. Saving an influencer again replaces its row and its
+    posts, the store keeps no history of earlier crawls. The database runs in WAL mode, so readers (e.g. an
+    analysis notebook) do not block the crawler. Every influencer is written in its own transaction: after a crash
+    an influencer is either complete or absent.
+
+    Attributes:
+        file: path to the database
+
+    Methods:
+        save: store the info of one influencer
+        mark_failed: record an influencer which could not be crawled
+        completed_ids: instagram ids already stored
+        crawl_states: crawl time and profile fingerprint of the stored influencers
+        load_influencer: the stored info of one influencer
+        load_results: the typed influencer table
+        load_posts: the typed post table
+    """
+
+    def __init__(self, file: str = get_file("data/influencer.sqlite")):
+
+        """
+        Args:
+            file: path to the database, created if missing
+        """
+
+        directory = os.path.dirname(file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file = file
+        self.__lock = threading.Lock()
+        # the connection is shared by the workers of a DriverPool, every access holds the lock
+        self.__connection = sqlite3.connect(file, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.__connection:
+            self.__connection.execute(f"CREATE TABLE IF NOT EXISTS influencer ("
+                                      f"instagram_id TEXT PRIMARY KEY, crawled_at REAL NOT NULL, "
+                                      f"{_columns_sql(INFLUENCER_DTYPES)})")
+            self.__connection.execute(f"CREATE TABLE IF NOT EXISTS post ("
+                                      f"instagram_id TEXT NOT NULL, {_columns_sql(POST_DTYPES)}, "
+                                      f"PRIMARY KEY (instagram_id, post_index))")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS failure ("
+                                      "instagram_id TEXT PRIMARY KEY, failed_at REAL NOT NULL, "
+                                      "n_failures INTEGER NOT NULL, reason TEXT)")
+
+    def save(self, instagram_id: str, influencer: Dict, posts: List[Dict], crawled_at: Optional[float] = None):
+
+        '''
+        Store one influencer and its posts, replacing an earlier result
+
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+            influencer: the influencer columns, see INFLUENCER_DTYPES
+            posts: one dict per post, see POST_DTYPES
+            crawled_at: unix time of the crawl, now if not given
+        '''
+
+        influencer_row = [instagram_id, crawled_at or time.time()] + \
+                         [_sql_value(influencer.get(column)) for column in INFLUENCER_DTYPES]
+        post_rows = [[instagram_id] + [_sql_value(post.get(column)) for column in POST_DTYPES] for post in posts]
+
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM failure WHERE instagram_id = ?", (instagram_id,))
+            self.__connection.execute("DELETE FROM post WHERE instagram_id = ?", (instagram_id,))
+            self.__connection.execute(f"INSERT OR REPLACE INTO influencer VALUES "
+                                      f"({', '.join('?' * len(influencer_row))})", influencer_row)
+            self.__connection.executemany(f"INSERT INTO post VALUES ({', '.join('?' * (len(POST_DTYPES) + 1))})",
+                                          post_rows)
+
+    def mark_failed(self, instagram_id: str, reason: str):
+
+        '''
+        Record that an influencer could not be crawled. Failed influencers are not completed, a later run retries them
+
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+            reason: the error message
+        '''
+
+        with self.__lock, self.__connection:
+            self.__connection.execute("INSERT INTO failure (instagram_id, failed_at, n_failures, reason) "
+                                      "VALUES (?, ?, 1, ?) ON CONFLICT (instagram_id) DO UPDATE SET "
+                                      "failed_at = excluded.failed_at, n_failures = n_failures + 1, "
+                                      "reason = excluded.reason", (instagram_id, time.time(), reason))
+
+    def load_failures(self) -> pd.DataFrame:
+
+        '''
+        Returns:
+            the influencers which could not be crawled, indexed by instagram id
+        '''
+
+        df = pd.DataFrame.from_records(self.__read("failure"),
+                                       columns=['instagram_id', 'failed_at', 'n_failures', 'reason'])
+        df['failed_at'] = pd.to_datetime(df['failed_at'], unit='s')
+
+        return df.set_index('instagram_id')
+
+    def completed_ids(self) -> Set[str]:
+
+        '''
+        Returns:
+            the instagram ids already stored
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute("SELECT instagram_id FROM influencer").fetchall()
+
+        return {instagram_id for instagram_id, in rows}
+
+    def crawl_states(self) -> Dict[str, Tuple[float, Tuple[Optional[int], Optional[str]]]]:
+
+        '''
+        Returns:
+            instagram id to the time of its crawl and the fingerprint of its profile, see schema.fingerprint
+        '''
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT influencer.instagram_id, crawled_at, number_of_post, shortcode FROM influencer "
+                "LEFT JOIN post ON post.instagram_id = influencer.instagram_id AND post_index = 0").fetchall()
+
+        return {instagram_id: (crawled_at, (number_of_post, shortcode))
+                for instagram_id, crawled_at, number_of_post, shortcode in rows}
+
+    def load_influencer(self, instagram_id: str) -> Optional[Tuple[Dict, List[Dict]]]:
+
+        '''
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+        Returns:
+            the influencer columns and one dict per post as given to save, None if the influencer is not stored
+        '''
+
+        influencers = self.__read("influencer", instagram_id)
+        if not influencers:
+            return None
+
+        influencer = {column: influencers[0][column] for column in INFLUENCER_DTYPES}
+        posts = [{column: post[column] for column in POST_DTYPES}
+                 for post in sorted(self.__read("post", instagram_id), key=lambda post: post['post_index'])]
+
+        return influencer, posts
+
+    def load_results(self) -> pd.DataFrame:
+
+        '''
+        Returns:
+            the typed influencer table, one row per influencer, indexed by instagram id
+        '''
+
+        return influencer_frame(self.__read("influencer"))
+
+    def load_posts(self) -> pd.DataFrame:
+
+        '''
+        Returns:
+            the typed post table, one row per post
+        '''
+
+        return post_frame(self.__read("post"))
+
+    def __read(self, table: str, instagram_id: Optional[str] = None) -> List[Dict]:
+
+        with self.__lock:
+            if instagram_id is None:
+                cursor = self.__connection.execute(f"SELECT * FROM {table}")
+            else:
+                cursor = self.__connection.execute(f"SELECT * FROM {table} WHERE instagram_id = ?", (instagram_id,))
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _sql_value(value):
+
+    # numpy scalars are not understood by sqlite3
+    return value.item() if hasattr(value, 'item') else value
+
+
+def load_results(file: str = get_file("data/influencer.sqlite")) -> pd.DataFrame:
+
+    """
+    Load the influencer table
+
+    Args:
+        file: path to the database
+    Returns:
+        one row per influencer, indexed by instagram id
+    """
+
+    with ResultStore(file) as store:
+        return store.load_results()
+
+
+def load_posts(file: str = get_file("data/influencer.sqlite")) -> pd.DataFrame:
+
+    """
+    Load the post table
+
+    Args:
+        file: path to the database
+    Returns:
+        one row per post
+    """
+
+    with ResultStore(file) as store:
+        return store.load_posts()
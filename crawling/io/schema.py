@@ -0,0 +1,208 @@
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from crawling.parsers.numbers import parse_numbers
+
+# Typed, normalized layout of the crawl results: one row per influencer and one row per post.
+INFLUENCER_DTYPES = {
+    'verified': 'UInt8',
+    'number_of_post': 'Int32',
+    'number_of_follower': 'Int32',
+    'number_of_follows': 'Int32',
+    'n_posts': 'UInt16',
+    'average_likes': 'float32',
+    'average_comments': 'float32',
+    'median_likes': 'float32',
+    'median_comments': 'float32',
+    'video_ratio': 'float32',
+    'tracking_ratio': 'float32',
+}
+
+POST_DTYPES = {
+    'post_index': 'uint16',
+    'shortcode': 'object',
+    'number_of_likes': 'Int32',
+    'number_of_comments': 'Int32',
+    'post_time_weekday': 'UInt8',
+    'post_time_hour': 'UInt8',
+    'is_video': 'UInt8',
+    'if_tracking_others': 'UInt8',
+}
+
+# one row per comment, created_at in unix seconds
+COMMENT_DTYPES = {
+    'comment_id': 'object',
+    'username': 'object',
+    'text': 'object',
+    'created_at': 'Int64',
+}
+
+# the influencer list collected from starngage
+INFLUENCER_LIST_DTYPES = {
+    'name': 'object',
+    'instagram_id': 'object',
+    'topics': 'object',
+    'followers_starngage': 'Int64',
+    'engagement_rate_starngage': 'float32',
+}
+
+POST_FIELDS = [field for field in POST_DTYPES if field not in ('post_index', 'shortcode')]
+
+WIDE_POST_KEY_REGEX = re.compile(r'^(?P<field>{})_(?P<post_index>\d+)$'.format('|'.join(POST_FIELDS)))
+
+
+def aggregate_posts(posts: List[Dict]) -> Dict:
+
+    """
+    Pre-aggregate the statistics of the crawled posts of one influencer
+
+    Args:
+        posts: one dict per post with the keys of POST_FIELDS
+    Returns:
+        the aggregated columns of INFLUENCER_DTYPES
+    """
+
+    def column(field):
+        return np.array([post[field] for post in posts if post.get(field) is not None], dtype=float)
+
+    def statistic(function, values):
+        return float(function(values)) if len(values) else None
+
+    likes, comments = column('number_of_likes'), column('number_of_comments')
+
+    return {'n_posts': len(posts),
+            'average_likes': statistic(np.mean, likes),
+            'average_comments': statistic(np.mean, comments),
+            'median_likes': statistic(np.median, likes),
+            'median_comments': statistic(np.median, comments),
+            'video_ratio': statistic(np.mean, column('is_video')),
+            'tracking_ratio': statistic(np.mean, column('if_tracking_others'))}
+
+
+def fingerprint(influencer: Dict, posts: List[Dict]) -> Tuple[Optional[int], Optional[str]]:
+
+    """
+    Cheap fingerprint of a profile: a new or deleted post changes it
+
+    Args:
+        influencer: the influencer columns
+        posts: one dict per post, newest first
+    Returns:
+        the number of posts and the shortcode of the latest post
+    """
+
+    return influencer.get('number_of_post'), posts[0].get('shortcode') if posts else None
+
+
+def split_wide_info(info: Dict) -> Tuple[Dict, List[Dict]]:
+
+    """
+    Split the wide info of the former output, with keys like number_of_likes_{post_index}, into the influencer
+    columns and one dict per post
+
+    Args:
+        info: the wide info of one influencer
+    Returns:
+        the influencer columns and the posts
+    """
+
+    influencer, posts = {}, {}
+
+    for key, value in info.items():
+        match = WIDE_POST_KEY_REGEX.match(key)
+        if match is None:
+            influencer[key] = value
+        else:
+            post_index = int(match.group('post_index'))
+            posts.setdefault(post_index, {'post_index': post_index, 'shortcode': None})[match.group('field')] = value
+
+    posts = [posts[post_index] for post_index in sorted(posts)]
+    influencer = {key: value for key, value in influencer.items() if key in INFLUENCER_DTYPES}
+    influencer.update(aggregate_posts(posts))
+
+    return influencer, posts
+
+
+def _to_numeric(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+
+    for column, dtype in dtypes.items():
+        if column not in df:
+            df[column] = None
+        if dtype == 'object':
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        if dtype[0] in 'IU':
+            # nullable integer columns may only receive whole numbers
+            values = values.round()
+        df[column] = values.astype(dtype)
+
+    return df
+
+
+def influencer_list_frame(records: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+
+    """
+    Args:
+        records: one dict per influencer of the starngage ranking, or a frame of them, e.g. an influencer list saved
+            by a former version with followers like 12.3m and engagement rates like 3.4% as strings
+    Returns:
+        the typed influencer list, in rank order
+    """
+
+    df = pd.DataFrame(records, columns=list(INFLUENCER_LIST_DTYPES))
+    for column in ('followers_starngage', 'engagement_rate_starngage'):
+        df[column] = parse_numbers(df[column])
+
+    return _to_numeric(df, INFLUENCER_LIST_DTYPES)
+
+
+def influencer_frame(records: List[Dict]) -> pd.DataFrame:
+
+    """
+    Args:
+        records: one dict per influencer with instagram_id, crawled_at and the columns of INFLUENCER_DTYPES
+    Returns:
+        the typed influencer table, indexed by instagram id
+    """
+
+    df = pd.DataFrame.from_records(records, columns=['instagram_id', 'crawled_at'] + list(INFLUENCER_DTYPES))
+    df = _to_numeric(df, INFLUENCER_DTYPES)
+    df['crawled_at'] = pd.to_datetime(df['crawled_at'], unit='s')
+
+    return df.set_index('instagram_id')
+
+
+def post_frame(records: List[Dict]) -> pd.DataFrame:
+
+    """
+    Args:
+        records: one dict per post with instagram_id and the columns of POST_DTYPES
+    Returns:
+        the typed long-format post table
+    """
+
+    df = pd.DataFrame.from_records(records, columns=['instagram_id'] + list(POST_DTYPES))
+    df = _to_numeric(df, POST_DTYPES)
+    df['instagram_id'] = df['instagram_id'].astype('category')
+
+    return df
+
+
+def comment_frame(records: List[Dict]) -> pd.DataFrame:
+
+    """
+    Args:
+        records: one dict per comment with shortcode and the columns of COMMENT_DTYPES
+    Returns:
+        the typed comment table, created_at as datetime
+    """
+
+    df = pd.DataFrame.from_records(records, columns=['shortcode'] + list(COMMENT_DTYPES))
+    df = _to_numeric(df, COMMENT_DTYPES)
+    df['shortcode'] = df['shortcode'].astype('category')
+    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
+
+    return df
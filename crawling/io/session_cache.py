@@ -0,0 +1,142 @@
+import json
+import os
+import time
+from typing import Dict, List
+
+from crawling.io.path_definition import get_file
+
+
+def get_session_file(username: str) -> str:
+
+    """
+    Get the full path to the cached session of an account
+
+    Args:
+        username: the Instagram username
+    """
+
+    return get_file(f"data/session/{username}.json")
+
+
+def capture_session(driver) -> Dict:
+
+    """
+    Read the cookies and the local storage of the current site, e.g. to move them into another browser
+
+    Args:
+        driver: a Selenium webdriver showing a page of the site
+    Returns:
+        a dict with saved_at, cookies and local_storage, see restore_session
+    """
+
+    return {'saved_at': time.time(),
+            'cookies': driver.get_cookies(),
+            'local_storage': driver.execute_script("return Object.assign({}, window.localStorage);")}
+
+
+def save_session(driver, file: str):
+
+    """
+    Save the cookies and the local storage of the current site to disk. The file is replaced atomically, so
+    several browsers logged in with the same account may save at the same time. It holds the session cookie of the
+    account and is only readable by its owner.
+
+    Args:
+        driver: a logged-in Selenium webdriver
+        file: where to save the session
+    """
+
+    session = capture_session(driver)
+
+    directory = os.path.dirname(file)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_file = f"{file}.{os.getpid()}.{id(driver)}.tmp"
+    with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(session, f)
+    os.replace(tmp_file, file)
+
+
+def load_session(file: str) -> Dict:
+
+    """
+    Load a saved session
+
+    Returns:
+        a dict with cookies and local_storage, empty if there is no usable session
+    """
+
+    if not os.path.isfile(file):
+        return {}
+
+    try:
+        with open(file, 'r') as f:
+            session = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Unable to read the session cache {file}: {e}")
+        return {}
+
+    if not isinstance(session, dict) or not isinstance(session.get('cookies'), list):
+        print(f"The session cache {file} has no cookies")
+        return {}
+    session.setdefault('local_storage', {})
+
+    if _is_expired(session['cookies']):
+        return {}
+
+    return session
+
+
+def restore_session(driver, session: Dict):
+
+    """
+    Put a saved session into the browser. Cookies can only be set for the visited domain, so the browser must show
+    a page of the domain the cookies belong to
+
+    Args:
+        driver: a Selenium webdriver
+        session: a session returned by load_session
+    """
+
+    for cookie in session['cookies']:
+        cookie = {key: value for key, value in cookie.items()
+                  if key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'expiry')}
+        if 'expiry' in cookie:
+            cookie['expiry'] = int(cookie['expiry'])
+        driver.add_cookie(cookie)
+
+    driver.execute_script("for (const [key, value] of Object.entries(arguments[0])) {"
+                          "window.localStorage.setItem(key, value);}", session['local_storage'])
+
+
+def storage_state(session: Dict, origin: str = "https://www.instagram.com") -> Dict:
+
+    """
+    Convert a saved session into the storage state of a Playwright browser context, see AsyncConnector
+
+    Args:
+        session: a session returned by load_session
+        origin: the site the local storage belongs to
+    """
+
+    cookies = []
+    for cookie in session['cookies']:
+        cookie = {key: value for key, value in cookie.items()
+                  if key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'expiry')}
+        cookie['expires'] = float(cookie.pop('expiry', -1))
+        cookie.setdefault('path', '/')
+        cookies.append(cookie)
+
+    local_storage = [{'name': key, 'value': value} for key, value in session['local_storage'].items()]
+
+    return {'cookies': cookies, 'origins': [{'origin': origin, 'localStorage': local_storage}]}
+
+
+def _is_expired(cookies: List[Dict], auth_cookie: str = 'sessionid') -> bool:
+
+    for cookie in cookies:
+        if cookie.get('name') == auth_cookie:
+            return cookie.get('expiry', float('inf')) < time.time()
+
+    return True
@@ -0,0 +1,368 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from crawling.io.path_definition import get_file
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+COLLECTED = 'collected'
+
+
+class WorkQueue:
+
+    """Work queue with leases in a SQLite file, shared by a coordinator and crawl workers on several hosts.
+
+    A worker leases items for lease_seconds and keeps the leases alive with heartbeats. The leases of a worker
+    which stops sending heartbeats expire, and the items go to the next worker asking for work. Every item is
+    enqueued once, and only the first result submitted for it is kept, so retried submissions and late results of
+    a worker presumed dead do no harm. The coordinator collects the results into the result store.
+
+    All hosts must reach the file, e.g. on a shared volume with working file locks (NFS with lockd, SMB). The
+    database uses a rollback journal rather than WAL, which only works for processes of one host. Every method is a
+    short transaction, many workers can share the file.
+
+    Attributes:
+        file: path to the database
+        lease_seconds: how long a lease lasts without heartbeat
+        max_attempts: leases of an item before it is given up
+
+    Methods:
+        enqueue: add items, ignoring those already known
+        lease: take items to work on
+        heartbeat: extend the leases of a worker
+        keep_alive: send heartbeats from a background thread
+        complete: submit the result of an item
+        fail: give an item back, or give it up after max_attempts
+        collect: read the submitted results
+        mark_collected: drop results from the collection once they are stored
+        counts: number of items per state
+    """
+
+    def __init__(self, file: str = get_file("data/work_queue.sqlite"), lease_seconds: float = 120.0,
+                 max_attempts: int = 3):
+
+        """
+        Args:
+            file: path to the database, created if missing
+            lease_seconds: how long a lease lasts without heartbeat
+            max_attempts: leases of an item before it is given up
+        """
+
+        directory = os.path.dirname(file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file = file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.__lock = threading.Lock()
+        # transactions are started explicitly, BEGIN IMMEDIATE takes the write lock before reading the leases
+        self.__connection = sqlite3.connect(file, timeout=30, isolation_level=None, check_same_thread=False)
+        # unlike WAL, the rollback journal needs only file locks, no memory shared between the hosts, so the file
+        # may be on a network volume. It also turns a file left in WAL mode by an older version back
+        self.__connection.execute("PRAGMA journal_mode=DELETE")
+
+        with self.__transaction() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS task ("
+                           "item TEXT PRIMARY KEY, state TEXT NOT NULL, worker TEXT, lease_until REAL, "
+                           "attempts INTEGER NOT NULL DEFAULT 0, enqueued_at REAL NOT NULL, done_at REAL, "
+                           "result TEXT, reason TEXT)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS task_state ON task (state, lease_until)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS worker ("
+                           "worker TEXT PRIMARY KEY, last_seen REAL NOT NULL, n_done INTEGER NOT NULL DEFAULT 0)")
+
+    def __transaction(self):
+
+        return _Transaction(self.__connection, self.__lock)
+
+    def enqueue(self, items: Iterable[str]) -> int:
+
+        '''
+        Args:
+            items: the work items, e.g. instagram ids
+        Returns:
+            number of items added, items known already are left as they are
+        '''
+
+        now = time.time()
+
+        with self.__transaction() as cursor:
+            n_before = self.__connection.total_changes
+            cursor.executemany("INSERT OR IGNORE INTO task (item, state, enqueued_at) VALUES (?, ?, ?)",
+                               [(item, PENDING, now) for item in items])
+            return self.__connection.total_changes - n_before
+
+    def lease(self, worker: str, n: int = 1) -> List[str]:
+
+        '''
+        Lease pending items and items whose lease expired, in the order they were enqueued. An item whose lease
+        expired max_attempts times is given up
+
+        Args:
+            worker: the id of the worker, unique across the hosts
+            n: maximal number of items
+        Returns:
+            the leased items, empty if there is no work at the moment
+        '''
+
+        now = time.time()
+
+        with self.__transaction() as cursor:
+            # an item whose workers keep dying is given up like an item which keeps failing
+            cursor.execute("UPDATE task SET state = ?, reason = 'lease expired' WHERE state = ? AND lease_until < ? "
+                           "AND attempts >= ?", (FAILED, LEASED, now, self.max_attempts))
+            items = [item for item, in cursor.execute(
+                "SELECT item FROM task WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY rowid LIMIT ?",
+                (PENDING, LEASED, now, n))]
+            cursor.executemany("UPDATE task SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 "
+                               "WHERE item = ?", [(LEASED, worker, now + self.lease_seconds, item) for item in items])
+            self.__seen(cursor, worker, now)
+
+        return items
+
+    def heartbeat(self, worker: str) -> int:
+
+        '''
+        Extend all leases of a worker. Workers call it more often than every lease_seconds
+
+        Returns:
+            number of leases the worker holds
+        '''
+
+        now = time.time()
+
+        with self.__transaction() as cursor:
+            cursor.execute("UPDATE task SET lease_until = ? WHERE state = ? AND worker = ?",
+                           (now + self.lease_seconds, LEASED, worker))
+            n_leases = cursor.execute("SELECT changes()").fetchone()[0]
+            self.__seen(cursor, worker, now)
+
+        return n_leases
+
+    def complete(self, item: str, worker: str, result) -> bool:
+
+        '''
+        Submit the result of an item. Idempotent: the first result of an item is kept, later ones are ignored
+
+        Args:
+            item: the work item
+            worker: the worker submitting the result
+            result: json-serializable result
+        Returns:
+            True if the result was taken
+        '''
+
+        now = time.time()
+        payload = json.dumps(result, default=_json_value)
+
+        with self.__transaction() as cursor:
+            cursor.execute("UPDATE task SET state = ?, worker = ?, done_at = ?, result = ?, lease_until = NULL "
+                           "WHERE item = ? AND state IN (?, ?, ?)", (DONE, worker, now, payload, item, PENDING,
+                                                                      LEASED, FAILED))
+            taken = cursor.execute("SELECT changes()").fetchone()[0] > 0
+            if taken:
+                cursor.execute("UPDATE worker SET n_done = n_done + 1 WHERE worker = ?", (worker,))
+            self.__seen(cursor, worker, now)
+
+        return taken
+
+    def fail(self, item: str, worker: str, reason: str):
+
+        '''
+        Give an item back after a failed attempt. It is given up after max_attempts
+
+        Args:
+            item: the work item
+            worker: the worker holding the lease. A worker whose lease was taken over cannot fail the item
+            reason: the error message
+        '''
+
+        with self.__transaction() as cursor:
+            cursor.execute("UPDATE task SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL, "
+                           "reason = ? WHERE item = ? AND state = ? AND worker = ?",
+                           (self.max_attempts, FAILED, PENDING, reason, item, LEASED, worker))
+            self.__seen(cursor, worker, time.time())
+
+    def collect(self, limit: int = 100) -> List[Tuple[str, object]]:
+
+        '''
+        Read the submitted results which are not collected yet. They are returned again by the next call until they
+        are marked collected, so a result is not lost if storing it fails. Meant for a single coordinator
+
+        Args:
+            limit: maximal number of results returned
+        Returns:
+            (item, result) per completed item, oldest first
+        '''
+
+        with self.__transaction() as cursor:
+            rows = cursor.execute("SELECT item, result FROM task WHERE state = ? ORDER BY done_at LIMIT ?",
+                                  (DONE, limit)).fetchall()
+
+        return [(item, json.loads(result)) for item, result in rows]
+
+    def mark_collected(self, items: List[str]):
+
+        '''
+        Drop results from the collection, once they are stored
+
+        Args:
+            items: items returned by collect
+        '''
+
+        with self.__transaction() as cursor:
+            cursor.executemany("UPDATE task SET state = ? WHERE item = ? AND state = ?",
+                               [(COLLECTED, item, DONE) for item in items])
+
+    def failures(self) -> Dict[str, str]:
+
+        '''
+        Returns:
+            the given up items and the last error message
+        '''
+
+        with self.__transaction() as cursor:
+            return dict(cursor.execute("SELECT item, reason FROM task WHERE state = ?", (FAILED,)).fetchall())
+
+    def counts(self) -> Dict[str, int]:
+
+        '''
+        Returns:
+            number of items per state. Leased items whose lease expired count as pending
+        '''
+
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, COLLECTED: 0, FAILED: 0}
+
+        with self.__transaction() as cursor:
+            rows = cursor.execute("SELECT CASE WHEN state = ? AND lease_until < ? THEN ? ELSE state END, COUNT(*) "
+                                  "FROM task GROUP BY 1", (LEASED, time.time(), PENDING)).fetchall()
+        counts.update(rows)
+
+        return counts
+
+    def is_drained(self) -> bool:
+
+        '''
+        Returns:
+            True if no item is pending or leased
+        '''
+
+        counts = self.counts()
+
+        return counts[PENDING] + counts[LEASED] == 0
+
+    def workers(self, alive_seconds: Optional[float] = None) -> Dict[str, Tuple[float, int]]:
+
+        '''
+        Args:
+            alive_seconds: only the workers seen within this many seconds, lease_seconds by default
+        Returns:
+            worker to the time it was last seen and its number of completed items
+        '''
+
+        seen_after = time.time() - (alive_seconds or self.lease_seconds)
+
+        with self.__transaction() as cursor:
+            rows = cursor.execute("SELECT worker, last_seen, n_done FROM worker WHERE last_seen >= ?",
+                                  (seen_after,)).fetchall()
+
+        return {worker: (last_seen, n_done) for worker, last_seen, n_done in rows}
+
+    def keep_alive(self, worker: str, interval: Optional[float] = None) -> '_KeepAlive':
+
+        '''
+        Context manager sending heartbeats for the worker from a background thread
+
+        Args:
+            worker: the id of the worker
+            interval: seconds between heartbeats, a third of lease_seconds by default
+        '''
+
+        return _KeepAlive(self, worker, interval or self.lease_seconds / 3)
+
+    @staticmethod
+    def __seen(cursor, worker: str, now: float):
+
+        cursor.execute("INSERT INTO worker (worker, last_seen) VALUES (?, ?) "
+                       "ON CONFLICT (worker) DO UPDATE SET last_seen = excluded.last_seen", (worker, now))
+
+    def close(self):
+
+        with self.__lock:
+            self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _KeepAlive:
+
+    def __init__(self, work_queue: WorkQueue, worker: str, interval: float):
+
+        self.work_queue = work_queue
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__beat, daemon=True)
+
+    def __beat(self):
+
+        while not self.stopped.wait(self.interval):
+            try:
+                self.work_queue.heartbeat(self.worker)
+            except sqlite3.Error as e:
+                # a missed heartbeat is harmless as long as the next one comes before the leases expire
+                print(f"heartbeat of {self.worker} failed: {e}")
+
+    def __enter__(self):
+
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.stopped.set()
+        self.thread.join()
+
+
+class _Transaction:
+
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on an exception"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock):
+
+        self.connection = connection
+        self.lock = lock
+        self.cursor = None
+
+    def __enter__(self) -> sqlite3.Cursor:
+
+        self.lock.acquire()
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        try:
+            self.cursor.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
+
+
+def _json_value(value):
+
+    # numpy scalars are not understood by json
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not json serializable")
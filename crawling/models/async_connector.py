@@ -0,0 +1,196 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from user_agent import generate_user_agent
+
+from crawling.models.browser_profile import PROFILES, is_blocked
+from crawling.models.metrics import stage
+from crawling.models.retry_policy import DEFAULT_RETRY_POLICY, PageNotAvailable, RetryPolicy, is_permanent_status
+from crawling.models.scheduler import DEFAULT_SCHEDULER, PRIORITY_PAGE, RequestScheduler
+
+
+class AsyncConnector:
+
+    """Asyncio counterpart of Connector: a single Chromium process driven over the DevTools protocol by Playwright.
+
+    Every page load gets its own tab of one browser context, so dozens of loads run concurrently from one event
+    loop, sharing the cookies of the context. Waits are awaited instead of polled, and the rate limits of the
+    scheduler and the retry policy apply as for Connector.
+
+    Playwright is an optional dependency: pip install playwright && playwright install chromium
+
+    Attributes:
+        headless: if runs Chromium in headless mode
+        profile: the Chrome profile, 'crawl' also blocks the requests Connector's 'crawl' profile blocks
+        max_tabs: maximal number of tabs open at the same time
+        retry_policy: timeouts and retries of the page loads
+        scheduler: rate limiter and priority queue of the requests
+        account: the account the context is logged in with
+        browser: the Playwright browser, None until started
+        context: the Playwright browser context, None until started
+
+    Methods:
+        start / close: launch and release the browser, or use async with
+        tab: async context manager lending a tab
+        load: load a url into a tab
+        page_source: load a url into a fresh tab and return its source code
+        fetch_page_source: download a server-rendered page through the context, without a tab
+    """
+
+    def __init__(self, headless: bool = True, profile: str = 'default', max_tabs: int = 16,
+                 retry_policy: Optional[RetryPolicy] = None, scheduler: Optional[RequestScheduler] = None,
+                 account: Optional[str] = None, storage_state: Optional[Dict] = None):
+
+        """
+        Args:
+            headless: if runs Chromium in headless mode
+            profile: Chrome profile, 'default' or 'crawl', see Connector
+            max_tabs: maximal number of tabs open at the same time
+            retry_policy: timeouts and retries of the page loads. The policy shared by all connectors if not given
+            scheduler: rate limiter of the requests. The scheduler shared by all connectors if not given
+            account: the account the context is logged in with, rate limited on its own
+            storage_state: cookies and local storage of a logged-in session, see session_cache.storage_state
+        """
+
+        if profile not in PROFILES:
+            raise ValueError(f"profile must be one of {tuple(PROFILES)}, got {profile}")
+
+        self.headless = headless
+        self.profile = profile
+        self.max_tabs = max_tabs
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+        self.account = account
+        self.browser = None
+        self.context = None
+        self.__storage_state = storage_state
+        self.__playwright = None
+        self.__tabs = None
+
+    async def start(self) -> 'AsyncConnector':
+
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError as e:
+            raise ImportError("the asyncio crawler needs playwright: "
+                              "pip install playwright && playwright install chromium") from e
+
+        self.__tabs = asyncio.Semaphore(self.max_tabs)
+        self.__playwright = await async_playwright().start()
+        self.browser = await self.__playwright.chromium.launch(headless=self.headless,
+                                                               args=PROFILES[self.profile]['arguments'])
+        self.context = await self.browser.new_context(user_agent=generate_user_agent(os='mac', navigator='chrome'),
+                                                      storage_state=self.__storage_state)
+        if self.profile == 'crawl':
+            await self.context.route('**/*', self.__route)
+
+        return self
+
+    @staticmethod
+    async def __route(route):
+
+        if is_blocked(route.request.url, route.request.headers):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def close(self):
+
+        if self.browser is not None:
+            await self.browser.close()
+        if self.__playwright is not None:
+            await self.__playwright.stop()
+        self.browser = self.context = self.__playwright = None
+
+    async def __aenter__(self) -> 'AsyncConnector':
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @asynccontextmanager
+    async def tab(self):
+
+        '''
+        Lend a new tab, waiting while max_tabs tabs are open. The tab is closed afterwards
+        '''
+
+        async with self.__tabs:
+            page = await self.context.new_page()
+            try:
+                yield page
+            finally:
+                await page.close()
+
+    async def wait_for_turn(self, url: str, priority: int = PRIORITY_PAGE):
+
+        '''
+        Wait until the scheduler lets a request to url go, without blocking the event loop
+        '''
+
+        await self.scheduler.acquire_async(url, account=self.account, priority=priority)
+
+    async def load(self, page, url: str, priority: int = PRIORITY_PAGE, wait_for: Optional[str] = None):
+
+        '''
+        Load a url into a tab. Timeouts and retries follow the retry policy
+
+        Args:
+            page: a tab lent by tab()
+            url: a web url
+            priority: see crawling.models.scheduler
+            wait_for: css selector of an element the load waits for, e.g. the rendered post
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        from playwright.async_api import Error as PlaywrightError
+
+        async def load(timeout):
+            await page.goto(url, timeout=timeout * 1000, wait_until='domcontentloaded')
+            if wait_for is not None:
+                await page.wait_for_selector(wait_for, state='attached', timeout=timeout * 1000)
+
+        with stage('async_connector.page_load'):
+            await self.retry_policy.call_async(load, url, retry_on=(PlaywrightError,),
+                                               before_attempt=lambda: self.wait_for_turn(url, priority))
+
+    async def page_source(self, url: str, priority: int = PRIORITY_PAGE, wait_for: Optional[str] = None) -> str:
+
+        '''
+        Load a url into a fresh tab, see load
+
+        Returns:
+            the source code of the rendered page
+        '''
+
+        async with self.tab() as page:
+            await self.load(page, url, priority=priority, wait_for=wait_for)
+            return await page.content()
+
+    async def fetch_page_source(self, url: str, priority: int = PRIORITY_PAGE) -> str:
+
+        '''
+        Download a server-rendered page with the cookies of the context, without opening a tab
+
+        Returns:
+            the html of the page
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+            PageNotAvailable: at once, if the server answers with a client error such as 404
+        '''
+
+        from playwright.async_api import Error as PlaywrightError
+
+        async def load(timeout):
+            response = await self.context.request.get(url, timeout=timeout * 1000)
+            if is_permanent_status(response.status):
+                raise PageNotAvailable(f"{url}: HTTP {response.status}")
+            if not response.ok:
+                raise PlaywrightError(f"HTTP {response.status}")
+            return await response.text()
+
+        with stage('async_connector.fetch'):
+            return await self.retry_policy.call_async(load, url, retry_on=(PlaywrightError,),
+                                                      before_attempt=lambda: self.wait_for_turn(url, priority))
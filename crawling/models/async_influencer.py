@@ -0,0 +1,80 @@
+import asyncio
+import math
+from typing import Dict, List
+
+from crawling.models.async_connector import AsyncConnector
+from crawling.parsers import html as html_parser
+from crawling.parsers import starngage
+
+
+class AsyncInfluencer:
+
+    """Asyncio counterpart of Influencer. The ranking pages are server-rendered, they are downloaded through the
+    browser context of an AsyncConnector without opening tabs.
+
+    Attributes:
+        connector: the browser
+        main_url: a url to the ranking
+
+    Methods:
+        get_top_n_influencers: the top n influencers shown on starngage
+    """
+
+    def __init__(self, connector: AsyncConnector, main_url: str = "https://starngage.com/app/us/influencer/ranking"):
+
+        """
+        Args:
+            connector: a started AsyncConnector
+            main_url: a url to the ranking. Point it to a local fixture server to crawl without the network
+        """
+
+        self.connector = connector
+        self.main_url = main_url
+
+    async def __fetch_page(self, url: str) -> List[Dict]:
+
+        page_source = await self.connector.fetch_page_source(url)
+
+        return starngage.ranking_influencers(html_parser.parse(page_source, 'ranking'))
+
+    async def get_top_n_influencers(self, n: int, max_in_flight: int = 8) -> List[Dict]:
+
+        '''
+        Get top n influencers shown on starngage. The first page tells how the page urls look like, the remaining
+        pages are fetched concurrently
+
+        Args:
+            n: number of influencers you need
+            max_in_flight: maximal number of pages fetched at the same time
+        Returns:
+            A list of dict containing influencer's info, in rank order.
+        '''
+
+        plp_html = html_parser.parse(await self.connector.fetch_page_source(self.main_url), 'ranking')
+        all_influencer = starngage.ranking_influencers(plp_html)
+        next_page_url = starngage.next_page_url(plp_html)
+
+        page_url_template = starngage.page_url_template(next_page_url) if next_page_url is not None else None
+
+        if len(all_influencer) < n and next_page_url is not None and page_url_template is None:
+            # unknown url pattern, fall back to following the "next" links
+            while len(all_influencer) < n and next_page_url is not None:
+                plp_html = html_parser.parse(await self.connector.fetch_page_source(next_page_url), 'ranking')
+                all_influencer.extend(starngage.ranking_influencers(plp_html))
+                next_page_url = starngage.next_page_url(plp_html)
+        elif len(all_influencer) < n and next_page_url is not None:
+            in_flight = asyncio.Semaphore(max_in_flight)
+
+            async def fetch(page):
+                async with in_flight:
+                    return await self.__fetch_page(page_url_template.format(page=page))
+
+            n_pages = math.ceil(n / len(all_influencer))
+            for page_influencer in await asyncio.gather(*[fetch(page) for page in range(2, n_pages + 1)]):
+                all_influencer.extend(page_influencer)
+
+        all_influencer = all_influencer[:n]
+
+        assert len(all_influencer) == n, 'number does not match'
+
+        return all_influencer
@@ -0,0 +1,218 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from crawling.io.schema import POST_FIELDS, aggregate_posts
+from crawling.models.async_connector import AsyncConnector
+from crawling.models.instagram import Instagram
+from crawling.models.retry_policy import CrawlFailed, PageLoadFailed
+from crawling.models.scheduler import PRIORITY_POST, PRIORITY_PROFILE
+from crawling.parsers import embedded_json
+from crawling.parsers import instagram as instagram_parser
+
+
+class AsyncInstagram:
+
+    """Asyncio counterpart of Instagram, reading profile and post pages in tabs of an AsyncConnector.
+
+    Pages are read through the parsers shared with Instagram: the embedded json where the page has it, the rendered
+    markup otherwise. Each read waits once for the element which marks the page as rendered, there are no polling
+    loops. The fields of a post are read from its timeline node where the profile has the timeline json, as Instagram
+    does. Grid hovers are not available, the fields still missing are read from the post pages, concurrently.
+
+    Attributes:
+        connector: the browser
+        base_url: a url to Instagram, or to a local fixture server
+
+    Methods:
+        get_metadata: verification and counters of a profile
+        get_post_hrefs: the posts shown on a profile
+        get_post_data: likes, post time, media type and tagging of a post
+        crawl_influencer: all of the above for one influencer, like crawling.crawl.crawl_influencer
+    """
+
+    # elements marking a profile and a post as rendered
+    PROFILE_READY = 'main header'
+    POST_READY = 'article time'
+
+    def __init__(self, connector: AsyncConnector, base_url: str = "https://www.instagram.com"):
+
+        """
+        Args:
+            connector: a started AsyncConnector, logged in through its storage_state if needed
+            base_url: a url to Instagram. Point it to a local fixture server to crawl without the network
+        """
+
+        self.connector = connector
+        self.base_url = base_url
+
+    async def __read(self, url: str, priority: int, ready: str, parse):
+
+        async with self.connector.tab() as page:
+            await self.connector.load(page, url, priority=priority)
+            result = parse(await page.content())
+            if result is None:
+                # not json and not rendered yet
+                try:
+                    await page.wait_for_selector(ready, state='attached',
+                                                 timeout=self.connector.retry_policy.timeout() * 1000)
+                except Exception as e:
+                    print(f"{url} is not rendered: {e}")
+                    return None
+                result = parse(await page.content())
+
+        return result
+
+    async def get_profile(self, instagram_id: str) -> Optional[Tuple[Dict, List[str]]]:
+
+        '''
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+        Returns:
+            verification and counters, and the post hrefs shown on the profile. None if the profile cannot be read
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        profile = await self.__read_profile(instagram_id)
+
+        return profile[:2] if profile is not None else None
+
+    async def __read_profile(self, instagram_id: str) -> Optional[Tuple[Dict, List[str], Optional[Dict]]]:
+
+        def parse(page_source):
+            metadata = instagram_parser.profile_fields(page_source)
+            if metadata is None:
+                return None
+            return (metadata, instagram_parser.profile_post_hrefs(page_source),
+                    embedded_json.extract_profile(page_source))
+
+        return await self.__read(instagram_id.replace("@", f"{self.base_url}/"), PRIORITY_PROFILE,
+                                 self.PROFILE_READY, parse)
+
+    async def __timeline(self, hrefs: List[str], user: Optional[Dict], n_posts: int,
+                         page_size: int = 12) -> List[Tuple[str, Optional[Dict]]]:
+
+        '''
+        The first n_posts posts of the timeline embedded in the profile page and of its next pages, paged as
+        Instagram.iter_post_shortcodes pages them, followed by the posts shown on the profile which the timeline
+        does not have
+
+        Args:
+            hrefs: the hrefs shown on the profile
+            user: the GraphQL user object embedded in the profile page, None if the page has none
+            n_posts: number of posts
+            page_size: posts per timeline page
+        Returns:
+            at most n_posts hrefs with their timeline node, None if the post is only shown on the profile. Newest
+            first, fewer if the profile has no more posts or its timeline cannot be paged
+        '''
+
+        nodes = {}
+        media = (user or {}).get('edge_owner_to_timeline_media')
+        while media is not None:
+            for edge in media.get('edges', []):
+                nodes.setdefault(f"/p/{edge['node']['shortcode']}/", edge['node'])
+
+            variables = embedded_json.next_timeline_variables(media, user.get('id'), page_size)
+            if len(nodes) >= n_posts or variables is None:
+                break
+
+            url = embedded_json.graphql_url(self.base_url, Instagram.TIMELINE_QUERY_HASH, variables)
+            try:
+                media = embedded_json.timeline_page(await self.connector.fetch_page_source(url, PRIORITY_PROFILE))
+            except PageLoadFailed as e:
+                print(f"the timeline of {user.get('username')} ends at {len(nodes)} posts: {e}")
+                break
+
+        for href in hrefs:
+            nodes.setdefault(href, None)
+
+        return list(nodes.items())[:n_posts]
+
+    async def get_metadata(self, instagram_id: str) -> Optional[Dict]:
+
+        '''
+        Returns:
+            verified, number of posts, number of followers, and number of follows, None if they cannot be read
+        '''
+
+        profile = await self.get_profile(instagram_id)
+
+        return profile[0] if profile is not None else None
+
+    async def get_post_hrefs(self, instagram_id: str) -> List[str]:
+
+        profile = await self.get_profile(instagram_id)
+
+        return profile[1] if profile is not None else []
+
+    async def get_post_data(self, post_href: str) -> Optional[Dict]:
+
+        '''
+        Args:
+            post_href: href of the post, e.g. /p/CXixCI9Ll0E/
+        Returns:
+            likes, post time, media type and tagging, and the number of comments if the page has it as json. None if
+            the post cannot be read
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        return await self.__read(f"{self.base_url}{post_href}", PRIORITY_POST, self.POST_READY,
+                                 instagram_parser.post_fields)
+
+    async def crawl_influencer(self, instagram_id: str, n_posts: int = 10,
+                               max_failures: int = 3) -> Optional[Tuple[Dict, List[Dict]]]:
+
+        '''
+        Read the front page and the first posts of one influencer. The fields of a post come from its timeline node,
+        the post pages are only opened, concurrently, for the fields the node does not have
+
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+            n_posts: number of posts to visit. The posts beyond those shown on the profile are paged from its
+                timeline
+            max_failures: failed post pages after which the influencer is given up
+        Returns:
+            the influencer columns and one dict per post (see crawling.io.schema), or None if the front page cannot
+            be read
+        Raises:
+            CrawlFailed: if the front page cannot be loaded or too many post pages fail
+        '''
+
+        try:
+            profile = await self.__read_profile(instagram_id)
+        except PageLoadFailed as e:
+            raise CrawlFailed(f"{instagram_id}: {e}") from e
+        if profile is None:
+            return None
+
+        influencer, hrefs, user = profile
+
+        posts = []
+        for post_index, (href, node) in enumerate(await self.__timeline(hrefs, user, n_posts)):
+            post = embedded_json.post_data(node) if node is not None else {}
+            post.update(post_index=post_index, shortcode=href.strip('/').split('/')[-1])
+            posts.append(post)
+
+        incomplete = [post for post in posts if any(post.get(field) is None for field in POST_FIELDS)]
+        post_results = await asyncio.gather(*[self.get_post_data(f"/p/{post['shortcode']}/") for post in incomplete],
+                                            return_exceptions=True)
+        failures = [result for result in post_results if isinstance(result, PageLoadFailed)]
+        if len(failures) >= max_failures:
+            raise CrawlFailed(f"{instagram_id} failed {len(failures)} times, last error: {failures[-1]}")
+        for result in post_results:
+            if isinstance(result, Exception) and not isinstance(result, PageLoadFailed):
+                raise result
+
+        for post, post_data in zip(incomplete, post_results):
+            if not isinstance(post_data, dict):
+                continue
+            for field in POST_FIELDS:
+                if post.get(field) is None:
+                    post[field] = post_data.get(field)
+
+        influencer = dict(influencer)
+        influencer.update(aggregate_posts(posts))
+
+        return influencer, posts
@@ -0,0 +1,113 @@
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+
+# Chrome options of the profiles. 'crawl' keeps JavaScript, which Instagram needs to render, but drops everything
+# a crawler does not read.
+PROFILES = {
+    'default': {
+        'arguments': ['--start-maximized', '--window-size=1920,1080'],
+        'prefs': {},
+    },
+    'crawl': {
+        'arguments': ['--window-size=800,600', '--disable-gpu', '--disable-extensions', '--mute-audio',
+                      '--disable-background-networking', '--disk-cache-size=33554432',
+                      '--media-cache-size=1', '--blink-settings=imagesEnabled=false'],
+        'prefs': {'profile.managed_default_content_settings.images': 2},
+    },
+}
+
+# Sec-Fetch-Dest values of the requests blocked by the 'crawl' profile
+BLOCKED_DESTINATIONS = ('image', 'video', 'audio', 'track', 'font')
+BLOCKED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.svg', '.ico', '.mp4', '.m4v', '.webm',
+                      '.mp3', '.woff', '.woff2', '.ttf', '.otf', '.eot')
+BLOCKED_DOMAINS = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+                   'connect.facebook.net', 'scorecardresearch.com', 'hotjar.com', 'adservice.google.com',
+                   'quantserve.com', 'criteo.com')
+
+
+def is_blocked(url: str, headers: Dict[str, str]) -> bool:
+
+    """
+    Decide if the 'crawl' profile drops a request: images, media, fonts and known analytics domains
+
+    Args:
+        url: the requested url
+        headers: the request headers
+    """
+
+    url_parts = urlsplit(url)
+    host = url_parts.hostname or ''
+    if any(host == domain or host.endswith(f".{domain}") for domain in BLOCKED_DOMAINS):
+        return True
+
+    if (headers.get('Sec-Fetch-Dest') or headers.get('sec-fetch-dest')) in BLOCKED_DESTINATIONS:
+        return True
+
+    return url_parts.path.lower().endswith(BLOCKED_EXTENSIONS)
+
+
+class TransferMeter:
+
+    """Count the requests and the bytes a browser transfers, by request interception with selenium-wire.
+
+    Attributes:
+        current: requests, blocked requests and bytes since the last reset
+        total: the same, since the browser started
+
+    Methods:
+        install: hook the meter into a selenium-wire driver
+        reset: start counting a new page
+    """
+
+    def __init__(self, block: bool):
+
+        """
+        Args:
+            block: if drop the requests is_blocked selects
+        """
+
+        self.__block = block
+        self.__lock = threading.Lock()
+        self.current = {'requests': 0, 'blocked': 0, 'bytes': 0}
+        self.total = dict(self.current)
+
+    def __count(self, key: str, value: int):
+
+        with self.__lock:
+            self.current[key] += value
+            self.total[key] += value
+
+    def request_interceptor(self, request):
+
+        if self.__block and is_blocked(request.url, request.headers):
+            self.__count('blocked', 1)
+            request.abort()
+            return
+        self.__count('requests', 1)
+        self.__count('bytes', len(request.body or b''))
+
+    def response_interceptor(self, request, response):
+
+        # the body is kept as sent over the wire, i.e. still compressed
+        self.__count('bytes', len(response.body or b'') + sum(len(k) + len(v) for k, v in response.headers.items()))
+
+    def install(self, driver):
+
+        driver.request_interceptor = self.request_interceptor
+        driver.response_interceptor = self.response_interceptor
+
+    def reset(self) -> Dict[str, int]:
+
+        '''
+        Start counting a new page
+
+        Returns:
+            the counts of the previous page
+        '''
+
+        with self.__lock:
+            previous = self.current
+            self.current = {'requests': 0, 'blocked': 0, 'bytes': 0}
+
+        return previous
@@ -1,104 +1,333 @@
-import sys
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlsplit
 
 import bs4
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+import requests
+from selenium.common.exceptions import WebDriverException
 from user_agent import generate_user_agent
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+
+from crawling.io import session_cache
+from crawling.models.browser_profile import PROFILES, TransferMeter
+from crawling.models.driver_factory import DEFAULT_DRIVER_FACTORY, DriverFactory, browser_memory, driver_spec
+from crawling.models.http_client import HttpClient
+from crawling.models.metrics import timed
+from crawling.models.retry_policy import DEFAULT_RETRY_POLICY, PageNotAvailable, RetryPolicy, is_permanent_status
+from crawling.models.scheduler import DEFAULT_SCHEDULER, PRIORITY_PAGE, RequestScheduler
+from crawling.parsers import html as html_parser
+
+BACKENDS = ('selenium', 'http')
 
 
 class Connector:
 
     """Class Connector can be considered as the crawling engine instance initialization.
     Attributes:
-        driver: the interactive web crawling engine. Can be either from package Selenium or SeleniumWire
+        backend: how pages are fetched. 'selenium' drives a Chrome instance, 'http' downloads server-rendered pages
+            with a keep-alive HTTP client and needs no browser
+        driver: the interactive web crawling engine. Can be either from package Selenium or SeleniumWire. None for
+            the 'http' backend. It is replaced when the browser is recycled, read it from the connector every time
+        driver_factory: launches the browsers and keeps spare ones warm
+        max_pages: pages after which the browser is recycled, None to keep it
+        max_rss_mb: resident memory of the browser in MB past which it is recycled, None to not measure it
+        n_recycled: number of browsers recycled
+        user_agent: the user agent of all browsers of the connector
+        http: the HTTP client of the 'http' backend
+        retry_policy: timeouts and retries of the page loads
+        scheduler: rate limiter and priority queue of the requests, shared by all sessions
+        account: the account the browser is logged in with
+        profile: the Chrome profile
+        transfer_meter: counts requests and bytes of the browser, None if not measured
+        page_transfers: requests, blocked requests and bytes of the recently loaded pages, if measured
 
     Methods:
         get_product_content_page_from_url: Entrance point of parsing an html page source code by BeautifulSoup into an html DOM
         get_bs4_page_content_tags: Parse the webpage currently visited by driver into an HTML DOM by BeautifulSoup
+        recycle: replace the browser with a fresh one, keeping the session of the visited site
     """
 
-    def __init__(self, headless: bool = False, turn_off_image: bool = False):
+    # the memory of the browser is measured every this many pages
+    MEMORY_CHECK_PAGES = 20
+    # a spare browser is launched this many pages before the browser is recycled
+    PREFETCH_PAGES = 5
+
+    def __init__(self, headless: bool = False, turn_off_image: bool = False, backend: str = 'selenium',
+                 retry_policy: Optional[RetryPolicy] = None, scheduler: Optional[RequestScheduler] = None,
+                 account: Optional[str] = None, profile: str = 'default', measure_transfer: bool = False,
+                 driver_factory: Optional[DriverFactory] = None, max_pages: Optional[int] = None,
+                 max_rss_mb: Optional[float] = None):
 
         """
         Args:
             headless: if runs Chrome in headless mode.
             turn_off_image: if turn off showing images
-            package: specify from which package the interactive engine is called.
+            backend: either 'selenium' or 'http'
+            retry_policy: timeouts and retries of the page loads. The policy shared by all connectors if not given
+            scheduler: rate limiter of the requests. The scheduler shared by all connectors if not given
+            account: the account the browser is logged in with, rate limited on its own
+            profile: Chrome profile, 'default' or 'crawl'. 'crawl' blocks images, media, fonts and analytics domains,
+                turns off GPU and extensions, uses a small window and a small cache, but keeps JavaScript on
+            measure_transfer: if count the bytes transferred per page. Always on for the 'crawl' profile
+            driver_factory: launches the browsers. The factory shared by all connectors if not given
+            max_pages: recycle the browser after this many pages, None to keep it for the life of the connector
+            max_rss_mb: recycle the browser once its processes use more resident memory, in MB. None to not measure
+                it, needs /proc
         """
 
-        self.__headless = headless
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got {backend}")
+        if profile not in PROFILES:
+            raise ValueError(f"profile must be one of {tuple(PROFILES)}, got {profile}")
+
+        self.backend = backend
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+        self.account = account
+        self.profile = profile
+        self.driver_spec = driver_spec(headless=headless, turn_off_image=turn_off_image, profile=profile,
+                                       measure_transfer=measure_transfer, account=account)
+        self.transfer_meter = TransferMeter(block=profile == 'crawl') if self.driver_spec.wire else None
+        self.page_transfers = deque(maxlen=1000)
         self.default_page_load_timeout = 5
-        self.__chrome_initialization(turn_off_image=turn_off_image)
-        self.__retry = 0
+        self.driver_factory = driver_factory or DEFAULT_DRIVER_FACTORY
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.n_recycled = 0
+        # one user agent for the life of the connector, a recycled browser must look like the same visitor
+        self.user_agent = generate_user_agent(os='mac', navigator='chrome')
+        self.__driver = None
+        self.__n_pages = 0
+        self.__prefetched = False
+        self.http = None
+        self.__page_source = None
+        if backend == 'selenium':
+            self.__driver = self.__start_driver()
+        else:
+            self.http = HttpClient(timeout=self.default_page_load_timeout)
 
-    def __chrome_initialization(self, turn_off_image: bool):
+    @property
+    def driver(self):
 
         """
-        Launch the interactive web crawling engine
+        The browser, None for the 'http' backend
+        """
+
+        return self.__driver
+
+    def __start_driver(self):
 
-        Args:
-            turn_off_image: if turn off showing images
+        """
+        Take a browser from the driver factory and set it up for this connector
         """
 
-        chrome_options = webdriver.ChromeOptions()
-        if self.__headless:
-            chrome_options.add_argument('--headless')
-        chrome_options.add_argument("--start-maximized")
-        chrome_options.add_argument("--window-size=1920,1080")
+        driver = self.driver_factory.acquire(self.driver_spec)
+        try:
+            driver.execute_cdp_cmd('Network.setUserAgentOverride', {'userAgent': self.user_agent})
+            if self.transfer_meter is not None:
+                self.transfer_meter.install(driver)
+            driver.set_page_load_timeout(self.default_page_load_timeout)
+        except WebDriverException:
+            self.driver_factory.release(driver, wait=False)
+            raise
 
-        # User a randomly generated user agent
-        user_agent = generate_user_agent(os='mac', navigator='chrome')  # USER_AGENT
+        self.__n_pages = 0
+        self.__prefetched = False
 
-        chrome_options.add_argument(f"--user-agent=%s" % user_agent)
-        chrome_options.add_experimental_option("excludeSwitches", ['enable-automation'])
+        return driver
 
-        # disable image and javascript loading
-        if turn_off_image:
-            prefs = {
-                'profile.default_content_setting_values': {
-                    'images': 2,
-                    'javascript': 2
-                }
-            }
-            chrome_options.add_experimental_option('prefs', prefs)
+    @property
+    def page_source(self) -> str:
 
-        self.driver = webdriver.Chrome(
-            ChromeDriverManager().install(),
-            options=chrome_options)
-        self.driver.set_page_load_timeout(self.default_page_load_timeout)  # set page load timeout to 60 seconds
+        """
+        Source code of the page visited last
+        """
 
-    def get_bs4_page_html(self) -> bs4.element.Tag:
+        if self.backend == 'http':
+            return self.__page_source
+        return self.driver.page_source
+
+    @timed('connector.parse')
+    def get_bs4_page_html(self, page_type: Optional[str] = None) -> bs4.element.Tag:
 
         """
         parsing html DOM with BeautifulSoup
 
+        Args:
+            page_type: 'ranking', 'profile' or 'post' to parse only the subtrees read from this page type, see
+                crawling.parsers.html. None for the whole page
         Returns:
             DOM derived from web page source code parsed by BeautifulSoup
         """
 
-        return BeautifulSoup(self.driver.page_source, "html.parser")
+        return html_parser.parse(self.page_source, page_type)
 
-    def patient_page_load(self, url: str):
+    @timed('connector.wait_for_turn')
+    def wait_for_turn(self, url: str, priority: int = PRIORITY_PAGE):
+
+        '''
+        Block until the scheduler lets a request to url go. Every navigation of the browser must call it first
+
+        Args:
+            url: the url to request
+            priority: see crawling.models.scheduler
+        '''
+
+        self.scheduler.acquire(url, account=self.account, priority=priority)
+
+    @timed('connector.page_load')
+    def patient_page_load(self, url: str, priority: int = PRIORITY_PAGE):
 
         '''
         Wait until the webpage is loaded successfully. A useful trick when your internet is slow as hell.
-        Here we assume that the page exists
+        Here we assume that the page exists. Timeouts and retries follow the retry policy
 
         Args:
             url: a web url
+            priority: see crawling.models.scheduler
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        if self.backend == 'http':
+            self.__page_source = self.fetch_page_source(url, priority=priority)
+            return
+
+        if self.__recycle_due():
+            self.recycle(priority=priority)
+
+        if self.transfer_meter is not None:
+            self.transfer_meter.reset()
+
+        self.__load(url, priority)
+
+        if self.transfer_meter is not None:
+            self.page_transfers.append(dict(self.transfer_meter.current, url=url))
+
+    def __load(self, url: str, priority: int):
+
+        def load(timeout):
+            self.__driver.set_page_load_timeout(timeout)
+            self.__driver.get(url)
+
+        self.retry_policy.call(load, url, retry_on=(WebDriverException,),
+                               before_attempt=lambda: self.wait_for_turn(url, priority))
+        self.__n_pages += 1
+
+    def __recycle_due(self) -> bool:
+
+        '''
+        Check the page count and the memory of the browser, and launch a spare browser when the recycling is near
+
+        Returns:
+            True if the browser is to be recycled before the next page
         '''
 
-        timeout = self.default_page_load_timeout
+        if self.max_pages is not None:
+            if self.__n_pages >= self.max_pages:
+                return True
+            if not self.__prefetched and self.__n_pages >= self.max_pages - self.PREFETCH_PAGES:
+                self.driver_factory.prefetch(self.driver_spec)
+                self.__prefetched = True
 
-        while True:
+        if self.max_rss_mb is not None and self.__n_pages > 0 and self.__n_pages % self.MEMORY_CHECK_PAGES == 0:
+            memory = browser_memory(self.__driver)
+            if memory is not None:
+                if memory > self.max_rss_mb * 2 ** 20:
+                    print(f"browser uses {memory / 2 ** 20:.0f} MB after {self.__n_pages} pages, recycle it")
+                    return True
+                if not self.__prefetched and memory > 0.8 * self.max_rss_mb * 2 ** 20:
+                    self.driver_factory.prefetch(self.driver_spec)
+                    self.__prefetched = True
+
+        return False
+
+    @timed('connector.recycle')
+    def recycle(self, priority: int = PRIORITY_PAGE):
+
+        '''
+        Replace the browser with a fresh one from the driver factory, e.g. to return the memory the browser piled up.
+        The cookies and the local storage of the visited site move to the new browser, so a logged-in session stays
+        logged in. The old browser quits in the background. If no new browser starts, the old one is kept
+
+        Args:
+            priority: of the request which opens the site in the new browser, see crawling.models.scheduler
+        '''
+
+        old_driver = self.__driver
+        session = None
+        url = urlsplit(old_driver.current_url)
+        if url.scheme in ('http', 'https'):
+            try:
+                session = session_cache.capture_session(old_driver)
+            except WebDriverException as e:
+                print(f"unable to read the session of {url.netloc}: {e}")
+
+        try:
+            self.__driver = self.__start_driver()
+        except WebDriverException as e:
+            print(f"unable to start a new browser, keep the old one: {e}")
+            self.__n_pages = 0
+            return
+        self.driver_factory.release(old_driver, wait=False)
+        self.n_recycled += 1
+
+        if session is not None:
+            # cookies can only be set for the visited domain
+            self.__load(f"{url.scheme}://{url.netloc}/robots.txt", priority)
+            session_cache.restore_session(self.__driver, session)
+
+    @timed('connector.fetch')
+    def fetch_page_source(self, url: str, priority: int = PRIORITY_PAGE) -> str:
+
+        '''
+        Download a server-rendered page with the 'http' backend, retrying as the retry policy says. Unlike
+        patient_page_load it does not change the state of the connector, so several threads may call it at once.
+
+        Args:
+            url: a web url
+            priority: see crawling.models.scheduler
+        Returns:
+            the html of the page
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+            PageNotAvailable: at once, if the server answers with a client error such as 404
+        '''
+
+        def load(timeout):
             try:
-                self.driver.get(url)
-                self.driver.set_page_load_timeout(self.default_page_load_timeout)
-                break
-            except TimeoutException as e:
-                print(f"{sys.exc_info()[-1].tb_lineno}: url - {e}")
-                timeout = timeout * 2
-                print(f'increase page load timeout to {timeout}')
-                self.driver.set_page_load_timeout(timeout)
+                return self.http.fetch(url, timeout=timeout)
+            except requests.HTTPError as e:
+                if e.response is not None and is_permanent_status(e.response.status_code):
+                    raise PageNotAvailable(f"{url}: {e}") from e
+                raise
+
+        return self.retry_policy.call(load, url, retry_on=(requests.RequestException,),
+                                      before_attempt=lambda: self.wait_for_turn(url, priority))
+
+    def transfer_summary(self) -> Optional[Dict]:
+
+        '''
+        Returns:
+            number of pages, requests, blocked requests and bytes since the browser started, and the bytes per page
+            of the recent pages. None if not measured
+        '''
+
+        if self.transfer_meter is None:
+            return None
+
+        recent_bytes = [page['bytes'] for page in self.page_transfers]
+
+        return dict(self.transfer_meter.total, profile=self.profile, pages=len(recent_bytes),
+                    bytes_per_page=sum(recent_bytes) / len(recent_bytes) if recent_bytes else 0.0)
+
+    def close(self):
+
+        '''
+        Release the browser or the HTTP connections
+        '''
+
+        if self.__driver is not None:
+            self.driver_factory.release(self.__driver)
+            self.__driver = None
+        if self.http is not None:
+            self.http.close()
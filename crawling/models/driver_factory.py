@@ -0,0 +1,503 @@
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from selenium import webdriver
+from user_agent import generate_user_agent
+from webdriver_manager.chrome import ChromeDriverManager
+
+from crawling.io.path_definition import get_file
+from crawling.models.browser_profile import PROFILES
+from crawling.models.metrics import DEFAULT_METRICS
+
+# files Chrome leaves in a profile directory while it runs, a killed Chrome leaves them behind
+SINGLETON_FILES = ('SingletonLock', 'SingletonSocket', 'SingletonCookie')
+
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+
+def chromedriver_path(cache_file: str = get_file('data/chromedriver.json'), max_age_days: float = 7.0) -> str:
+
+    """
+    Resolve the chromedriver binary once per process. ChromeDriverManager().install() asks the network for the
+    latest driver on every call, so its answer is cached on disk for max_age_days, and a stale answer is used while
+    the network is down. The environment variable CHROMEDRIVER_PATH overrides the lookup
+
+    Args:
+        cache_file: where the resolved path is cached
+        max_age_days: days after which the path is resolved again
+    Returns:
+        path to the chromedriver executable
+    """
+
+    global _chromedriver_path
+
+    with _chromedriver_lock:
+        if _chromedriver_path is not None:
+            return _chromedriver_path
+
+        if os.environ.get('CHROMEDRIVER_PATH'):
+            _chromedriver_path = os.environ['CHROMEDRIVER_PATH']
+            return _chromedriver_path
+
+        cached = {}
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Unable to read the chromedriver cache {cache_file}: {e}")
+        cached_path = cached.get('path')
+        if cached_path is None or not os.path.isfile(cached_path):
+            cached = {}
+
+        if cached and time.time() - cached['resolved_at'] < max_age_days * 24 * 3600:
+            _chromedriver_path = cached['path']
+            return _chromedriver_path
+
+        try:
+            path = ChromeDriverManager().install()
+        except Exception as e:
+            # webdriver_manager raises whatever its http client or the version lookup raise
+            if not cached:
+                raise
+            print(f"Unable to update chromedriver, use {cached['path']}: {e}")
+            _chromedriver_path = cached['path']
+            return _chromedriver_path
+
+        directory = os.path.dirname(cache_file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'path': path, 'resolved_at': time.time()}, f)
+        os.replace(tmp_file, cache_file)
+
+        _chromedriver_path = path
+        return _chromedriver_path
+
+
+class DriverSpec(NamedTuple):
+
+    """What a browser is launched with. Browsers of the same spec are interchangeable"""
+
+    # the account the browser is logged in with, None if anonymous. Browsers of different accounts never share a
+    # profile directory, the cookies and the storage of one account must not show up in the browser of another
+    account: Optional[str] = None
+    headless: bool = False
+    profile: str = 'default'
+    turn_off_image: bool = False
+    # selenium-wire driver, for the TransferMeter
+    wire: bool = False
+
+    @property
+    def name(self) -> str:
+
+        flags = {'headless': self.headless, 'noimage': self.turn_off_image, 'wire': self.wire}
+
+        return '-'.join([self.account or 'anonymous', self.profile] + [flag for flag, value in flags.items() if value])
+
+
+def driver_spec(headless: bool = False, turn_off_image: bool = False, profile: str = 'default',
+                measure_transfer: bool = False, account: Optional[str] = None) -> DriverSpec:
+
+    """
+    The spec of the browser of a Connector with these arguments, e.g. to warm browsers for it
+
+    Args:
+        see Connector
+    """
+
+    return DriverSpec(account=account, headless=headless, profile=profile, turn_off_image=turn_off_image,
+                      wire=measure_transfer or profile == 'crawl')
+
+
+def _memory(pid: int) -> int:
+
+    # Pss splits the pages the Chrome processes share among them, so that the sum counts them once
+    for file, field in ((f"/proc/{pid}/smaps_rollup", 'Pss:'), (f"/proc/{pid}/status", 'VmRSS:')):
+        try:
+            with open(file, 'r') as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+
+    return 0
+
+
+def process_tree_memory(pid: int) -> Optional[int]:
+
+    """
+    Resident memory of a process and all its descendants, read from /proc
+
+    Args:
+        pid: the root process, e.g. the chromedriver which launched a Chrome
+    Returns:
+        bytes, None where /proc is not available
+    """
+
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name in parentheses may contain spaces, the parent pid follows the state
+        parent = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+
+    tree = [pid]
+    for process in tree:
+        tree.extend(children.get(process, []))
+
+    return sum(_memory(process) for process in tree)
+
+
+def browser_memory(driver) -> Optional[int]:
+
+    """
+    Returns:
+        bytes of resident memory of a Chrome launched by chromedriver, None if they cannot be measured
+    """
+
+    try:
+        pid = driver.service.process.pid
+    except AttributeError:
+        return None
+
+    return process_tree_memory(pid)
+
+
+class ProfileInUse(Exception):
+
+    """A profile directory is held by a Chrome which may still run"""
+
+
+def _stale_lock(directory: str) -> Optional[str]:
+
+    """
+    Find the lock a killed Chrome left in a profile directory
+
+    Args:
+        directory: a profile directory
+    Returns:
+        the target of the SingletonLock if the Chrome it names ran on this host and is dead, None otherwise
+    Raises:
+        ProfileInUse: if the directory is locked by a running Chrome, by a Chrome of another host or by a lock which
+            cannot be read, which are all left alone
+    """
+
+    lock = os.path.join(directory, 'SingletonLock')
+    if not os.path.lexists(lock):
+        return None
+
+    # Chrome points SingletonLock to <hostname>-<pid> of the browser holding the profile
+    try:
+        target = os.readlink(lock)
+        host, _, pid = target.rpartition('-')
+        pid = int(pid)
+    except (OSError, ValueError):
+        raise ProfileInUse(f"{directory} has a lock which cannot be read")
+
+    if host != socket.gethostname():
+        raise ProfileInUse(f"{directory} is locked by {target} of another host")
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return target
+    except PermissionError:
+        pass
+
+    raise ProfileInUse(f"{directory} is locked by the running Chrome {pid}")
+
+
+class DriverFactory:
+
+    """Launches the Chrome instances of the connectors and keeps them warm.
+
+    The chromedriver binary is resolved once, see chromedriver_path. Browsers can be launched ahead of time in the
+    background (warm), so that a connector starting or recycling its browser takes a running one instead of waiting
+    for Chrome to start. Every browser runs in a profile directory of its own which is reused by the next browser
+    of the same spec, so that the disk cache of the crawled sites survives the recycling and the runs. A profile
+    directory still held by a running Chrome, e.g. of another crawler process, is never reused, and the lock files of
+    a profile are only removed once the Chrome which locked it on this host is dead. Browsers of different accounts
+    never share a profile directory, see DriverSpec.
+
+    Attributes:
+        profile_root: directory of the profile directories
+        max_warm: maximal number of browsers waiting per spec
+
+    Methods:
+        warm: launch browsers in the background
+        prefetch: launch one browser in the background, e.g. before a connector recycles its browser
+        acquire: a running browser
+        release: quit a browser and free its profile directory
+        report: number of browsers launched, taken warm, started cold and released
+        close: quit the waiting browsers
+    """
+
+    def __init__(self, profile_root: str = get_file('data/chrome_profile'), max_warm: int = 8,
+                 max_launching: int = 4):
+
+        """
+        Args:
+            profile_root: directory of the profile directories, created if missing
+            max_warm: maximal number of browsers waiting per spec
+            max_launching: number of browsers launched in the background at the same time
+        """
+
+        self.profile_root = profile_root
+        self.max_warm = max_warm
+        self.__max_launching = max_launching
+        self.__lock = threading.Lock()
+        # spec to the futures of the browsers launched for it and not acquired yet
+        self.__warm: Dict[DriverSpec, deque] = {}
+        # spec and profile directory of the running browsers, by id of the driver
+        self.__profiles: Dict[int, Tuple[DriverSpec, str]] = {}
+        self.__n_profiles: Dict[DriverSpec, int] = {}
+        self.__free_profiles: Dict[DriverSpec, List[str]] = {}
+        self.__executor = None
+        self.__stats = {'launched': 0, 'warm': 0, 'cold': 0, 'released': 0}
+        atexit.register(self.close)
+
+    def __launcher(self) -> ThreadPoolExecutor:
+
+        # created on first use, the module-level factory of a process that never warms a browser has no threads
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__max_launching, thread_name_prefix='chrome')
+        return self.__executor
+
+    def __take_profile(self, spec: DriverSpec) -> str:
+
+        with self.__lock:
+            free_profiles = self.__free_profiles.setdefault(spec, [])
+            while True:
+                if free_profiles:
+                    directory = free_profiles.pop()
+                else:
+                    self.__n_profiles[spec] = self.__n_profiles.get(spec, 0) + 1
+                    directory = os.path.join(self.profile_root, f"{spec.name}-{self.__n_profiles[spec]}")
+                try:
+                    stale_lock = _stale_lock(directory)
+                except ProfileInUse as e:
+                    print(f"skip the profile: {e}")
+                    continue
+                if stale_lock is None or self.__remove_stale_lock(directory, stale_lock):
+                    break
+
+        os.makedirs(directory, exist_ok=True)
+
+        return directory
+
+    @staticmethod
+    def __remove_stale_lock(directory: str, target: str) -> bool:
+
+        # another crawler process may have taken the profile since the lock was read, a lock pointing elsewhere now
+        # belongs to a live Chrome
+        try:
+            if os.readlink(os.path.join(directory, 'SingletonLock')) != target:
+                return False
+            for file in SINGLETON_FILES:
+                file = os.path.join(directory, file)
+                if os.path.lexists(file):
+                    os.remove(file)
+        except OSError as e:
+            print(f"unable to remove the stale lock of {directory}: {e}")
+            return False
+
+        return True
+
+    def __launch(self, spec: DriverSpec):
+
+        time_start = perf_counter()
+        profile_directory = self.__take_profile(spec)
+
+        chrome_options = webdriver.ChromeOptions()
+        if spec.headless:
+            chrome_options.add_argument('--headless')
+        for argument in PROFILES[spec.profile]['arguments']:
+            chrome_options.add_argument(argument)
+        chrome_options.add_argument(f"--user-data-dir={profile_directory}")
+
+        # User a randomly generated user agent, a Connector replaces it with its own
+        user_agent = generate_user_agent(os='mac', navigator='chrome')  # USER_AGENT
+
+        chrome_options.add_argument(f"--user-agent={user_agent}")
+        chrome_options.add_experimental_option("excludeSwitches", ['enable-automation'])
+
+        prefs = dict(PROFILES[spec.profile]['prefs'])
+        # disable image and javascript loading
+        if spec.turn_off_image:
+            prefs['profile.default_content_setting_values'] = {
+                'images': 2,
+                'javascript': 2
+            }
+        if prefs:
+            chrome_options.add_experimental_option('prefs', prefs)
+
+        try:
+            if not spec.wire:
+                driver = webdriver.Chrome(chromedriver_path(), options=chrome_options)
+            else:
+                # selenium-wire starts a local proxy, import it only when the traffic is intercepted
+                from seleniumwire import webdriver as wire_webdriver
+
+                # keep only a few captured requests, the meter counts them in the interceptors
+                driver = wire_webdriver.Chrome(
+                    chromedriver_path(),
+                    options=chrome_options,
+                    seleniumwire_options={'request_storage': 'memory', 'request_storage_max_size': 10})
+        except Exception:
+            self.__free_profile(spec, profile_directory)
+            raise
+
+        with self.__lock:
+            self.__profiles[id(driver)] = (spec, profile_directory)
+            self.__stats['launched'] += 1
+        DEFAULT_METRICS.record('driver_factory.launch', perf_counter() - time_start)
+
+        return driver
+
+    def __free_profile(self, spec: DriverSpec, directory: str):
+
+        with self.__lock:
+            self.__free_profiles.setdefault(spec, []).append(directory)
+
+    def warm(self, spec: DriverSpec, n: int = 1):
+
+        '''
+        Launch browsers in the background, acquire takes them
+
+        Args:
+            spec: what the browsers are launched with, see driver_spec
+            n: number of browsers, at most max_warm of a spec wait at the same time
+        '''
+
+        with self.__lock:
+            warm = self.__warm.setdefault(spec, deque())
+            n = min(n, self.max_warm - len(warm))
+            for _ in range(n):
+                warm.append(self.__launcher().submit(self.__launch, spec))
+
+    def prefetch(self, spec: DriverSpec):
+
+        '''
+        Launch one browser in the background, e.g. a few pages before a connector recycles its browser
+        '''
+
+        self.warm(spec, 1)
+
+    def acquire(self, spec: DriverSpec):
+
+        '''
+        A running browser: a warm one if there is one, launched now otherwise
+
+        Args:
+            spec: what the browser is launched with, see driver_spec
+        Returns:
+            a Selenium (or selenium-wire) Chrome webdriver, see release
+        '''
+
+        time_start = perf_counter()
+        driver = None
+        while driver is None:
+            with self.__lock:
+                warm = self.__warm.get(spec)
+                future: Optional[Future] = warm.popleft() if warm else None
+            if future is None:
+                driver = self.__launch(spec)
+                self.__count('cold')
+                break
+            try:
+                driver = future.result()
+                self.__count('warm')
+            except Exception as e:
+                print(f"a warm browser failed to start: {e}")
+
+        DEFAULT_METRICS.record('driver_factory.acquire', perf_counter() - time_start)
+
+        return driver
+
+    def release(self, driver, wait: bool = True):
+
+        '''
+        Quit a browser and give its profile directory to the next browser of its spec
+
+        Args:
+            driver: a browser returned by acquire
+            wait: if wait until Chrome exited. Otherwise it quits in the background
+        '''
+
+        def quit_driver():
+            try:
+                driver.quit()
+            except Exception as e:
+                print(f"unable to quit the browser: {e}")
+            with self.__lock:
+                profile = self.__profiles.pop(id(driver), None)
+                self.__stats['released'] += 1
+            if profile is not None:
+                self.__free_profile(*profile)
+
+        if wait:
+            quit_driver()
+        else:
+            self.__launcher().submit(quit_driver)
+
+    def __count(self, key: str):
+
+        with self.__lock:
+            self.__stats[key] += 1
+
+    def report(self) -> str:
+
+        '''
+        Returns:
+            number of browsers launched, acquired warm and started cold, and released
+        '''
+
+        with self.__lock:
+            stats = dict(self.__stats)
+
+        return (f"{stats['launched']} browsers launched, {stats['warm']} taken warm, {stats['cold']} started cold, "
+                f"{stats['released']} released")
+
+    def close(self):
+
+        '''
+        Quit the browsers nobody acquired and wait for the browsers quitting in the background
+        '''
+
+        with self.__lock:
+            futures = [future for warm in self.__warm.values() for future in warm]
+            self.__warm.clear()
+            executor, self.__executor = self.__executor, None
+
+        for future in futures:
+            try:
+                driver = future.result()
+            except Exception as e:
+                print(f"a warm browser failed to start: {e}")
+                continue
+            self.release(driver)
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+DEFAULT_DRIVER_FACTORY = DriverFactory()
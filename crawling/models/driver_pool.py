@@ -0,0 +1,163 @@
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class DriverPool:
+
+    """A pool of crawler sessions which are started once and then share a work queue.
+
+    Each session (e.g. a pair of logged-in Instagram instances) is owned by exactly one worker thread, so a
+    session is never used by two threads at the same time. The heavy lifting happens in the Chrome processes,
+    hence threads are sufficient to keep N browsers busy.
+
+    Attributes:
+        size: number of sessions
+        sessions: the started sessions
+
+    Methods:
+        map: hand items to the workers and merge their results
+        run: run a worker loop on every session, e.g. pulling from a WorkQueue
+        close: close all sessions
+    """
+
+    def __init__(self, size: int, factory: Callable[[], Any], closer: Optional[Callable[[Any], None]] = None):
+
+        """
+        Args:
+            size: number of sessions to start
+            factory: callable creating one session
+            closer: callable releasing one session
+        Raises:
+            the exception raised by factory, once the sessions started by then are closed
+        """
+
+        if size < 1:
+            raise ValueError(f"pool size must be positive, got {size}")
+
+        self.size = size
+        self.__closer = closer
+
+        # login of every session takes a while, start them all at the same time
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(factory) for _ in range(size)]
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        self.sessions: List[Any] = [future.result() for future in futures if future.exception() is None]
+        if errors:
+            # the pool is never entered, so the sessions which did start are closed here
+            try:
+                self.close()
+            except Exception as e:
+                print(f"unable to close the started sessions: {e}")
+            raise errors[0]
+
+    def map(self, func: Callable[[Any, Hashable], Any], items: Iterable[Hashable],
+            max_pending: Optional[int] = None) -> Dict[Hashable, Any]:
+
+        '''
+        Process all items with the sessions of the pool
+
+        The items are taken from the iterable as the workers get free, at most max_pending ahead of them. A
+        generator, e.g. the influencers of a ranking being discovered, is thereby consumed while the workers crawl,
+        and slowed down when they fall behind.
+
+        Args:
+            func: callable taking a session and an item
+            items: the work items, e.g. instagram ids
+            max_pending: maximal number of items waiting for a worker, twice the pool size by default
+        Returns:
+            a dict from item to the result of func. Items whose processing raised an exception map to None
+        Raises:
+            the exception raised by iterating over items, once the items taken before are processed
+        '''
+
+        # one end marker per worker follows the items
+        work = queue.Queue(maxsize=max_pending or 2 * self.size)
+        end = object()
+        producer_errors = []
+
+        def producer():
+            try:
+                for item in items:
+                    work.put(item)
+            except Exception as e:
+                producer_errors.append(e)
+            finally:
+                for _ in self.sessions:
+                    work.put(end)
+
+        results = {}
+        lock = threading.Lock()
+
+        def worker(session):
+            while True:
+                item = work.get()
+                if item is end:
+                    return
+                try:
+                    result = func(session, item)
+                except Exception as e:
+                    print(f"{sys.exc_info()[-1].tb_lineno}: {item} - {e}")
+                    result = None
+                with lock:
+                    results[item] = result
+
+        threads = [threading.Thread(target=producer, daemon=True)] + \
+                  [threading.Thread(target=worker, args=(session,), daemon=True) for session in self.sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if producer_errors:
+            raise producer_errors[0]
+
+        return results
+
+    def run(self, func: Callable[[Any], Any]) -> List[Any]:
+
+        '''
+        Run func once per session, each in its own thread, until all of them return
+
+        Args:
+            func: callable taking a session, e.g. a loop leasing items from a work queue
+        Returns:
+            the return values of func, in the order of the sessions. None where func raised an exception
+        '''
+
+        results: List[Any] = [None] * self.size
+
+        def worker(index, session):
+            try:
+                results[index] = func(session)
+            except Exception as e:
+                print(f"{sys.exc_info()[-1].tb_lineno}: session {index} - {e}")
+
+        threads = [threading.Thread(target=worker, args=(index, session), daemon=True)
+                   for index, session in enumerate(self.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def close(self):
+
+        '''
+        Release all sessions
+        '''
+
+        if self.__closer is None:
+            return
+        for session in self.sessions:
+            self.__closer(session)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,97 @@
+from typing import Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from user_agent import generate_user_agent
+
+
+class HttpClient:
+
+    """A keep-alive HTTP client for server-rendered pages which do not need a browser.
+
+    Connections are pooled per host by the underlying requests.Session, so consecutive page loads reuse the
+    same TCP/TLS connection. The session may be shared by several threads.
+
+    Attributes:
+        session: the pooled requests session
+        timeout: seconds to wait for a response
+
+    Methods:
+        fetch: download a page and return its html
+        stream: download a file chunk by chunk
+    """
+
+    def __init__(self, user_agent: Optional[str] = None, max_connections: int = 10, timeout: float = 10):
+
+        """
+        Args:
+            user_agent: user agent sent with every request. A randomly generated one is used if not given
+            max_connections: number of keep-alive connections kept per host
+            timeout: seconds to wait for a response
+        """
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': user_agent or generate_user_agent(os='mac', navigator='chrome'),
+                                     'Accept': 'text/html,application/xhtml+xml',
+                                     'Accept-Language': 'en-US,en;q=0.9'})
+
+    def fetch(self, url: str, timeout: Optional[float] = None) -> str:
+
+        '''
+        Download a page
+
+        Args:
+            url: a web url
+            timeout: seconds to wait for the response, self.timeout if not given
+        Returns:
+            the html of the page
+        '''
+
+        response = self.session.get(url, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def stream(self, url: str, offset: int = 0, timeout: Optional[float] = None,
+               chunk_size: int = 1 << 16) -> Tuple[int, Iterator[bytes]]:
+
+        '''
+        Download a file chunk by chunk, e.g. an image or a video, without holding it in memory
+
+        Args:
+            url: a web url
+            offset: number of bytes downloaded before, the rest is asked for with a Range request
+            timeout: seconds to wait for the response and between two chunks, self.timeout if not given
+            chunk_size: bytes per chunk
+        Returns:
+            the offset the chunks start at, 0 if the server sends the whole file, and the chunks. The connection goes
+            back to the pool once the chunks are consumed
+        '''
+
+        headers = {'Accept': '*/*'}
+        if offset > 0:
+            headers['Range'] = f"bytes={offset}-"
+
+        response = self.session.get(url, headers=headers, stream=True, timeout=timeout or self.timeout)
+        if offset > 0 and response.status_code == 416:
+            # nothing left after the offset
+            response.close()
+            return offset, iter(())
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+
+        def chunks():
+            with response:
+                yield from response.iter_content(chunk_size)
+
+        return offset if response.status_code == 206 else 0, chunks()
+
+    def close(self):
+
+        self.session.close()
@@ -1,4 +1,8 @@
-from typing import Dict, List
+import itertools
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
 import bs4
 from selenium.webdriver.support.ui import WebDriverWait
@@ -7,6 +11,9 @@ from selenium.webdriver.common.by import By
 from selenium.common.exceptions import TimeoutException
 
 from crawling.models.connector import Connector
+from crawling.models.metrics import stage, timed
+from crawling.parsers import html as html_parser
+from crawling.parsers import starngage
 
 
 class Influencer:
@@ -15,87 +22,167 @@ class Influencer:
 
     Attributes:
         main_url: a url to starngage.
-        wait: An object for implicit waiting until the appearance of certain element.
-        driver: google chrome web interacting object
+        wait: An object for implicit waiting until the appearance of certain element. None for the 'http' backend
+        driver: google chrome web interacting object. None for the 'http' backend
 
     Methods:
 
     """
 
-    def __init__(self, turn_off_image: bool = False):
-        self.connector = Connector(turn_off_image=turn_off_image)
-        self.main_url = "https://starngage.com/app/us/influencer/ranking"
+    def __init__(self, turn_off_image: bool = False, backend: str = 'selenium',
+                 main_url: str = "https://starngage.com/app/us/influencer/ranking", profile: str = 'default'):
+
+        """
+        Args:
+            turn_off_image: if turn off showing images
+            backend: 'selenium' or 'http'. The ranking pages are server-rendered, so 'http' needs no browser
+            main_url: a url to the ranking. Point it to a local fixture server to crawl without the network
+            profile: Chrome profile of the 'selenium' backend, 'default' or the lightweight 'crawl', see Connector
+        """
+
+        self.connector = Connector(turn_off_image=turn_off_image, backend=backend, profile=profile)
+        self.main_url = main_url
 
-        self.driver = self.connector.driver
-        self.wait = WebDriverWait(self.driver, 10)
         self.connector.patient_page_load(self.main_url)
         self.plp_html = None
 
-    def get_top_n_influencers(self, n: int) -> List:
+    @property
+    def driver(self):
+
+        # the connector replaces its browser when it recycles it
+        return self.connector.driver
+
+    @property
+    def wait(self) -> Optional[WebDriverWait]:
+
+        return WebDriverWait(self.driver, 10) if self.driver is not None else None
+
+    @timed('influencer.get_top_n_influencers')
+    def get_top_n_influencers(self, n: int, max_in_flight: int = 8) -> List:
 
         '''
         Get top n influencers shown on starngage
+
         Args:
             n: number of influencers you need
+            max_in_flight: maximal number of pages fetched at the same time ('http' backend only)
         Returns:
-            A list of dict containing influencer's info.
+            A list of dict containing influencer's info, in rank order.
         '''
 
-        all_influencer = []
-
-        while len(all_influencer) < n:
+        all_influencer = list(self.iter_top_n_influencers(n, max_in_flight=max_in_flight))
 
-            while True:
-                try:
-                    self.wait.until(EC.presence_of_element_located((By.XPATH, '//*[@id="content"]/div[2]/div/div/table')))
-                    break
-                except TimeoutException:
-                    pass
+        assert len(all_influencer) == n, 'number does not match'
 
-            plp_html = self.connector.get_bs4_page_html()
+        return all_influencer
 
-            table_html = plp_html.find('table', {'class': 'table table-hover table-responsive-sm'})
+    def iter_top_n_influencers(self, n: int, max_in_flight: int = 8) -> Iterator[Dict]:
 
-            rows_html = table_html.find('tbody').find_all('tr')
+        '''
+        Yield the top n influencers shown on starngage page by page, in rank order
 
-            for row_html in rows_html:
-                all_influencer.append(self.__extract_influencer_info(row_html))
+        The first page tells how many rows a page holds and how the page urls look like, so the remaining pages
+        are known up front. With the 'http' backend up to max_in_flight pages are fetched ahead of the consumer,
+        a consumer which falls behind holds the fetching back.
 
-            # after finishing crawler the current page, we move to the next page:
-            icons_html = plp_html.find('ul', {'class': 'pagination justify-content-center'}).find_all('li')
-            next_page_html = icons_html[-1]
-            next_page_url = next_page_html.find('a').get('href')
+        Args:
+            n: number of influencers you need
+            max_in_flight: maximal number of pages fetched at the same time ('http' backend only)
+        Yields:
+            a dict containing influencer's info
+        '''
 
+        self.__wait_for_table()
+        plp_html = self.connector.get_bs4_page_html('ranking')
+        page_influencer = self.__extract_page(plp_html)
+        next_page_url = starngage.next_page_url(plp_html)
+
+        page_url_template = starngage.page_url_template(next_page_url) if next_page_url is not None else None
+
+        if next_page_url is None:
+            # the ranking has a single page
+            pages = iter([])
+        elif page_url_template is None:
+            # unknown url pattern, fall back to following the "next" links
+            pages = self.__iter_next_pages(next_page_url)
+        else:
+            n_pages = math.ceil(n / len(page_influencer)) if page_influencer else 1
+            pages = self.__iter_pages([page_url_template.format(page=page) for page in range(2, n_pages + 1)],
+                                      max_in_flight)
+
+        n_yielded = 0
+        while n_yielded < n:
+            for influencer in page_influencer[:n - n_yielded]:
+                yield influencer
+                n_yielded += 1
+            if n_yielded < n:
+                page_influencer = next(pages, None)
+                if page_influencer is None:
+                    return
+
+    def __iter_next_pages(self, next_page_url: Optional[str]) -> Iterator[List[Dict]]:
+
+        while next_page_url is not None:
             self.connector.patient_page_load(next_page_url)
+            self.__wait_for_table()
+            plp_html = self.connector.get_bs4_page_html('ranking')
+            yield self.__extract_page(plp_html)
+            next_page_url = starngage.next_page_url(plp_html)
 
-        assert len(all_influencer) == n, 'number does not match'
-
-        return all_influencer
-
-    def __extract_influencer_info(self, row_html: bs4.element.Tag) -> Dict:
+    def __iter_pages(self, page_urls: List[str], max_in_flight: int) -> Iterator[List[Dict]]:
 
         '''
-        Private method
+        Fetch and parse ranking pages
 
         Args:
-            row_html: a row of influencer's info as an HTML object
+            page_urls: the page urls, in page order
+            max_in_flight: maximal number of pages fetched at the same time
+        Yields:
+            the influencers listed on each page, in page order
         '''
 
-        influencer_content = row_html.find('td', {'class': 'align-middle text-break'}).contents
-        influencer_name = influencer_content[0]
-        instagram_id = influencer_content[-1].text
-        topics_html = row_html.find_all('span', {'class': 'badge badge-pill badge-light samll text-muted'})
-        topics = ' '.join([topic_html.find('a').text for topic_html in topics_html])
-        # the last two are the number of followers and engagement rate
-        followers = row_html.find_all('td')[-2].text
-        engagement_rate = row_html.find_all('td')[-1].text
+        if self.connector.backend != 'http':
+            # a single browser can only show one page at a time
+            for url in page_urls:
+                self.connector.patient_page_load(url)
+                self.__wait_for_table()
+                yield self.__extract_page(self.connector.get_bs4_page_html('ranking'))
+            return
+
+        urls = iter(page_urls)
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = deque(executor.submit(self.__fetch_page, url) for url in itertools.islice(urls, max_in_flight))
+            while in_flight:
+                page_influencer = in_flight.popleft().result()
+                url = next(urls, None)
+                if url is not None:
+                    in_flight.append(executor.submit(self.__fetch_page, url))
+                yield page_influencer
+
+    def __fetch_page(self, url: str) -> List[Dict]:
 
-        # You can transform followers and engagement_rate from str to int and float, respectively, if you need.
+        page_source = self.connector.fetch_page_source(url)
+        with stage('connector.parse'):
+            plp_html = html_parser.parse(page_source, 'ranking')
+
+        return self.__extract_page(plp_html)
+
+    @timed('influencer.extract_page')
+    def __extract_page(self, plp_html: bs4.element.Tag) -> List[Dict]:
+
+        return starngage.ranking_influencers(plp_html)
+
+    @timed('influencer.wait_for_table')
+    def __wait_for_table(self):
+
+        '''
+        Wait until the ranking table is rendered. A page fetched over HTTP is complete already.
+        '''
 
-        influencer_dict = {'name': influencer_name,
-                           'instagram_id': instagram_id,
-                           'topics': topics,
-                           'followers_starngage': followers,
-                           'engagement_rate_starngage': engagement_rate}
+        if self.wait is None:
+            return
 
-        return influencer_dict
\ No newline at end of file
+        self.connector.retry_policy.call(
+            lambda timeout: WebDriverWait(self.driver, timeout).until(
+                EC.presence_of_element_located((By.XPATH, '//*[@id="content"]/div[2]/div/div/table'))),
+            self.driver.current_url, retry_on=(TimeoutException,))
@@ -1,17 +1,24 @@
-import time
-import re
 from time import perf_counter
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timezone
 
 import bs4
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException, \
+    WebDriverException
 
+from crawling.io import session_cache
 from crawling.models.connector import Connector
+from crawling.models.metrics import DEFAULT_METRICS, stage, timed
+from crawling.models.retry_policy import CircuitBreaker, PageLoadFailed
+from crawling.models.scheduler import PRIORITY_LOGIN, PRIORITY_POST, PRIORITY_PROFILE
+from crawling.parsers import embedded_json
+from crawling.parsers import html as html_parser
+from crawling.parsers import instagram as instagram_parser
+from crawling.parsers.numbers import parse_count
 from crawling.settings import INSTAGRAM
 
 
@@ -20,254 +27,809 @@ class Instagram:
     """ A class for Instagram crawling.
 
     Attributes:
+        base_url: a url to Instagram, or to a local fixture server.
         main_url: a url to Instagram login page.
         wait: An object for implicit waiting until the appearance of certain element.
         driver: google chrome web interacting object
+        login_timings: seconds spent in each login phase (cookie_banner, form_ready, submit, landed)
+        login_attempts: number of login attempts until Instagram accepted the login
+        session_file: where the cookies and the local storage of the logged-in session are cached
+        profile_data: the GraphQL user object embedded in the visited profile page, None if the page has none
+        media_sink: called with the shortcode and the media urls of every post read, e.g. MediaDownloader.submit.
+            None to skip the media
 
     Methods:
 
     """
 
-    def __init__(self, turn_off_image: bool = False):
-        self.connector = Connector(turn_off_image=turn_off_image)
-        self.main_url = "https://www.instagram.com/accounts/login/"
+    # GraphQL query of the posts of a profile timeline, paged by end_cursor
+    TIMELINE_QUERY_HASH = '003056d32c2554def87228bc3fd9668a'
+    # fetch a url from within the visited page, with its cookies
+    FETCH_SCRIPT = '''
+        var done = arguments[arguments.length - 1];
+        fetch(arguments[0], {credentials: 'include', headers: {'X-Requested-With': 'XMLHttpRequest'}})
+            .then(function (response) { return response.ok ? response.text() : Promise.reject('HTTP ' + response.status); })
+            .then(function (text) { done({text: text}); }, function (error) { done({error: String(error)}); });
+    '''
+    LAST_GRID_HREF_SCRIPT = '''
+        var links = document.querySelectorAll('div.Nnq7C.weEfm div.v1Nh3 a');
+        return links.length ? links[links.length - 1].getAttribute('href') : null;
+    '''
+    # pinned posts lead the timeline whatever their age
+    MAX_PINNED_POSTS = 3
+    # GraphQL query of the comments of a post, paged by end_cursor
+    COMMENT_QUERY_HASH = 'bc3296d1ce80a24b1b6e40b1e72903f5'
+    # drop the comments read so far from the page and ask for the next ones
+    LOAD_MORE_COMMENTS_SCRIPT = '''
+        document.querySelectorAll('ul.XQXOT > ul.Mr508').forEach(function (comment) { comment.remove(); });
+        var button = document.querySelector('ul.XQXOT button.dCJp8');
+        if (button === null) { return false; }
+        button.click();
+        return true;
+    '''
+    N_RENDERED_COMMENTS_SCRIPT = "return document.querySelectorAll('ul.XQXOT > ul.Mr508').length;"
+
+    def __init__(self, turn_off_image: bool = False, headless: bool = False,
+                 base_url: str = "https://www.instagram.com", login: bool = True, use_session_cache: bool = True,
+                 profile: str = 'default', measure_transfer: bool = False, max_pages: Optional[int] = None,
+                 max_rss_mb: Optional[float] = None):
+
+        """
+        Args:
+            turn_off_image: if turn off showing images
+            headless: if runs Chrome in headless mode
+            base_url: a url to Instagram. Point it to a local fixture server to crawl without the network
+            login: if log in. Pages of a fixture server do not need a login
+            use_session_cache: if restore the session saved by a previous login instead of logging in again
+            profile: Chrome profile, 'default' or the lightweight 'crawl', see Connector
+            measure_transfer: if count the bytes transferred per page
+            max_pages: recycle the browser after this many pages, see Connector
+            max_rss_mb: recycle the browser past this resident memory in MB, see Connector
+        """
+
+        self.connector = Connector(headless=headless, turn_off_image=turn_off_image,
+                                   account=INSTAGRAM['username'] if login else None, profile=profile,
+                                   measure_transfer=measure_transfer, max_pages=max_pages, max_rss_mb=max_rss_mb)
+        self.base_url = base_url
+        self.main_url = f"{base_url}/accounts/login/"
 
-        self.driver = self.connector.driver
-        self.wait = WebDriverWait(self.driver, 10)
         self.plp_html = None
-        self.number_extractor_regex = re.compile('[\d.]+')
+        self.instagram_page_html = None
+        self.profile_data = None
+        self.instagram_id = None
+        self.media_sink: Optional[Callable[[str, List[str]], None]] = None
+
+        # seconds spent in each login phase, summed over the login attempts
+        self.login_timings = {'cookie_banner': 0.0, 'form_ready': 0.0, 'submit': 0.0, 'landed': 0.0}
+        self.login_attempts = 0
+        self.session_file = None
+
+        if not login:
+            return
+
+        self.session_file = session_cache.get_session_file(INSTAGRAM['username'])
+
+        if use_session_cache:
+            if self.restore_session():
+                print("restored the cached session")
+                return
+            # start from a clean browser, otherwise stale consent cookies hide the cookie banner. Cookies and local
+            # storage belong to the visited site, without a cached session the browser still shows a blank page
+            if not self.driver.current_url.startswith(self.base_url):
+                self.connector.patient_page_load(f"{self.base_url}/robots.txt", priority=PRIORITY_LOGIN)
+            self.driver.delete_all_cookies()
+            self.driver.execute_script("window.localStorage.clear();")
 
         # access the login page:
 
-        self.driver.get(self.main_url)
+        self.connector.patient_page_load(self.main_url, priority=PRIORITY_LOGIN)
         self.click_cookie()
 
         while True:
             self.login()
-            time.sleep(3)
-            try:
-                self.driver.find_element_by_xpath('//p[@id="slfErrorAlert"]')
-                self.driver.refresh()
-                time.sleep(10)
-            except NoSuchElementException:
+            if self.wait_for_login_result():
                 break
+            if self.login_attempts >= self.connector.retry_policy.max_attempts:
+                raise PageLoadFailed(f"Instagram refused the login {self.login_attempts} times")
+            # Instagram refused the login, reload the form and try again
+            self.connector.wait_for_turn(self.main_url, priority=PRIORITY_LOGIN)
+            self.driver.refresh()
 
-    def click_cookie(self):
+        print(f"logged in after {self.login_attempts} attempt(s): " +
+              ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in self.login_timings.items()))
+
+        if use_session_cache:
+            session_cache.save_session(self.driver, self.session_file)
+
+    @property
+    def driver(self):
+
+        # the connector replaces its browser when it recycles it
+        return self.connector.driver
+
+    @property
+    def wait(self) -> WebDriverWait:
+
+        return WebDriverWait(self.driver, 10)
+
+    def __wait_until(self, condition: Callable, what: str, ignored_exceptions: Optional[Tuple] = None):
 
         '''
-        Click the cookie
+        Wait for a condition of the page with the timeouts of the retry policy, growing from attempt to attempt
+
+        Args:
+            condition: called with the driver until it returns a truthy value, see WebDriverWait.until
+            what: what is waited for, for the logs
+            ignored_exceptions: exceptions of the condition which do not stop the waiting, see WebDriverWait
+        Returns:
+            the value of the condition
+        Raises:
+            PageLoadFailed: if the condition is not met within the attempt budget of the retry policy
         '''
 
-        while True:
+        retry_policy = self.connector.retry_policy
+        for attempt in range(retry_policy.max_attempts):
+            timeout = retry_policy.timeout(attempt)
             try:
-                click_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, '/html/body/div[4]/div/div/button[1]')))
-                break
+                return WebDriverWait(self.driver, timeout, ignored_exceptions=ignored_exceptions).until(condition)
             except TimeoutException:
-                time.sleep(1)
+                print(f"{what}: not there after {timeout:.1f} s, attempt {attempt + 1}/{retry_policy.max_attempts}")
+
+        raise PageLoadFailed(f"{what}: not there after {retry_policy.max_attempts} attempts")
+
+    def __record_login_phase(self, phase: str, seconds: float):
+
+        self.login_timings[phase] += seconds
+        DEFAULT_METRICS.record(f"instagram.login.{phase}", seconds)
+
+    @timed('instagram.restore_session')
+    def restore_session(self) -> bool:
+
+        '''
+        Put the cached session into the browser and check if it is still logged in
+
+        Returns:
+            True if the cached session is valid
+        '''
+
+        session = session_cache.load_session(self.session_file)
+        if not session:
+            return False
+
+        # cookies can only be set for the visited domain
+        self.connector.patient_page_load(f"{self.base_url}/robots.txt", priority=PRIORITY_LOGIN)
+        session_cache.restore_session(self.driver, session)
+
+        return self.is_logged_in()
+
+    def is_logged_in(self) -> bool:
+
+        '''
+        Cheap login check: Instagram redirects logged-out visitors of the account settings to the login page
+        '''
+
+        self.connector.patient_page_load(f"{self.base_url}/accounts/edit/", priority=PRIORITY_LOGIN)
+
+        return '/accounts/login' not in self.driver.current_url
+
+    def click_cookie(self):
+
+        '''
+        Click the cookie banner and wait until it is gone
+
+        Raises:
+            PageLoadFailed: if the banner does not show up within the attempt budget of the retry policy
+        '''
+
+        time_start = perf_counter()
+
+        click_button = self.__wait_until(
+            EC.element_to_be_clickable((By.XPATH, '/html/body/div[4]/div/div/button[1]')), 'cookie banner')
         click_button.click()
+        self.wait.until(EC.invisibility_of_element(click_button))
+
+        self.__record_login_phase('cookie_banner', perf_counter() - time_start)
 
     def login(self):
 
         '''
-        Automatic account login
+        Automatic account login. Every step starts as soon as the element it needs is ready.
+
+        Raises:
+            PageLoadFailed: if the login form does not show up within the attempt budget of the retry policy
         '''
 
+        self.login_attempts += 1
+        time_start = perf_counter()
+
         self.wait.until(EC.presence_of_element_located((By.CLASS_NAME, "KPnG0")))  # util login page appear
-        time.sleep(3)
 
-        while True:
-            try:
-                user = self.wait.until(EC.element_to_be_clickable((By.NAME, "username")))
+        def click_username(driver):
+            user = EC.element_to_be_clickable((By.NAME, "username"))(driver)
+            if user:
                 user.click()
-                break
-            except (TimeoutException,  ElementClickInterceptedException) as e:
-                print(e)
+            return user
 
-        time.sleep(3)
-        user.send_keys(INSTAGRAM['username'])
+        user = self.__wait_until(click_username, 'username field',
+                                 ignored_exceptions=(NoSuchElementException, ElementClickInterceptedException))
+        passwd = self.__wait_until(EC.element_to_be_clickable((By.NAME, "password")), 'password field')
 
-        while True:
-            try:
-                passwd = self.wait.until(EC.presence_of_element_located((By.NAME, "password")))
-                break
-            except TimeoutException:
-                pass
+        time_form_ready = perf_counter()
+        self.__record_login_phase('form_ready', time_form_ready - time_start)
 
+        user.send_keys(INSTAGRAM['username'])
         passwd.click()
-        time.sleep(3)
         passwd.send_keys(INSTAGRAM['password'])
 
         login_button_ = self.wait.until(EC.element_to_be_clickable((By.XPATH, '//button[@type="submit"]')))
         login_button_.click()
 
+        self.__record_login_phase('submit', perf_counter() - time_form_ready)
+
+    def wait_for_login_result(self) -> bool:
+
+        '''
+        Wait until the browser leaves the login page or Instagram shows the login error alert
+
+        Returns:
+            True if logged in, False if Instagram refused the login
+        Raises:
+            PageLoadFailed: if there is no result within the attempt budget of the retry policy
+        '''
+
+        time_start = perf_counter()
+
+        def login_result(driver):
+            if driver.find_elements_by_xpath('//p[@id="slfErrorAlert"]'):
+                return 'refused'
+            if '/accounts/login' not in driver.current_url:
+                return 'landed'
+            return False
+
+        result = self.__wait_until(login_result, 'login result')
+
+        self.__record_login_phase('landed', perf_counter() - time_start)
+
+        return result == 'landed'
+
+    @timed('instagram.access_influencer_account')
     def access_influencer_account(self, instagram_id: str):
 
-        url = instagram_id.replace("@", "https://www.instagram.com/")
+        '''
+        Visit the front page of an influencer
 
-        while True:
-            try:
-                self.driver.get(url)
-                break
-            except TimeoutException:
-                print(f"Keep accessing {url}")
+        Args:
+            instagram_id: the influencer's id, e.g. @therock
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        url = instagram_id.replace("@", f"{self.base_url}/")
 
+        self.instagram_id = instagram_id
+        self.connector.patient_page_load(url, priority=PRIORITY_PROFILE)
+
+        # the page carries its data as json, which makes element waits unnecessary
+        self.instagram_page_html = None
+        self.profile_data = embedded_json.extract_profile(self.driver.page_source)
+
+    @timed('instagram.account_verification')
     def account_verification(self) -> Dict:
 
         '''
-        查看藍勾勾認證
+        查看藍勾勾認證. Reads the embedded json, or else the profile header once it is rendered, so an unverified
+        account costs no more than a verified one
         '''
 
-        time_start = perf_counter()
+        if self.profile_data is not None and 'is_verified' in self.profile_data:
+            return {'verified': int(self.profile_data['is_verified'])}
 
-        verified = 0
+        profile_html = self.get_profile_html()
+        if profile_html is None:
+            print("Unable to find the profile header.")
+            return {'verified': 0}
 
-        while True:
+        return {'verified': int(html_parser.select_one(profile_html, 'profile_verified') is not None)}
+
+    @timed('instagram.get_metadata')
+    def get_metadata(self) -> Optional[Dict]:
+
+        '''
+
+        Returns:
+            a tuple of number of posts, number of followers, and number of follows
+        '''
+
+        if self.profile_data is not None:
+            metadata = embedded_json.profile_metadata(self.profile_data)
+            if None not in metadata.values():
+                return metadata
+
+        profile_html = self.get_profile_html()
+        metadata = instagram_parser.profile_counts(profile_html) if profile_html is not None else None
+        if metadata is None:
+            print("Unable to find the metadata")
+
+        return metadata
+
+    @timed('instagram.wait_for_profile')
+    def get_profile_html(self) -> Optional[bs4.element.Tag]:
+
+        '''
+        Wait once until the profile header is rendered, then parse header and post grid of the visited profile page.
+        The parsed page is kept until the next profile is visited
+
+        Returns:
+            the parsed page, None if the header does not show up within the wait timeout
+        '''
+
+        if self.instagram_page_html is None:
             try:
-                self.wait.until(EC.presence_of_element_located(
-                    (By.XPATH, '//span[@title="Verified"]')))
-                verified = 1
-                break
+                self.wait.until(EC.presence_of_element_located((By.XPATH, '//main//header')))
             except TimeoutException:
-                print("Unable to find the verified symbol yet")
-                time_end = perf_counter()
-                if (time_end - time_start) > 10:
-                    print("Unable to find the verified symbol.")
-                    break
+                return None
+            self.instagram_page_html = self.connector.get_bs4_page_html('profile')
 
-        return {'verified': verified}
+        return self.instagram_page_html
 
-    def get_metadata(self) -> Optional[Dict]:
+    def get_article_section(self) -> Optional[bs4.element.Tag]:
+
+        profile_html = self.get_profile_html()
+        article_section_html = profile_html.find('article') if profile_html is not None else None
+
+        return article_section_html
+
+    @timed('instagram.get_post_hrefs')
+    def get_post_hrefs(self) -> List[str]:
 
         '''
+        Get the hrefs of the posts shown on the visited profile page, newest first
 
         Returns:
-            a tuple of number of posts, number of followers, and number of follows
+            a list of post hrefs, e.g. /p/CXixCI9Ll0E/
         '''
 
-        time_start = perf_counter()
+        if self.profile_data is not None and 'edge_owner_to_timeline_media' in self.profile_data:
+            edges = self.profile_data['edge_owner_to_timeline_media'].get('edges', [])
+            return [f"/p/{edge['node']['shortcode']}/" for edge in edges]
+
+        article_section_html = self.get_article_section()
+        if article_section_html is None:
+            return []
+
+        return [link.get('href') for link in html_parser.select(article_section_html, 'profile_grid_links')]
+
+    @timed('instagram.get_post_data')
+    def get_post_data(self, post_href: str) -> Dict:
+
+        '''
+        Get likes, post time, media type and tagging of a post. The number of comments is included when the post
+        page carries its data as json.
+
+        Args:
+            post_href: href of the post, e.g. /p/CXixCI9Ll0E/
+        '''
+
+        return self.__get_post_data(post_href)
+
+    @timed('instagram.get_top_posts')
+    def get_top_posts(self, n: int, post_connector: Optional['Instagram'] = None,
+                      circuit_breaker: Optional[CircuitBreaker] = None,
+                      previous_posts: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+
+        '''
+        Get likes, comments, post time, media type and tagging of the first n posts of the visited profile page.
+        n may go beyond the first grid, the posts are streamed as by iter_post_shortcodes.
+
+        The fields are read from the timeline json, or else from the hover overlay of the grid. A post page is
+        opened only for the fields neither of them has.
+
+        Args:
+            n: number of posts
+            post_connector: Instagram session used to open post pages. This session if not given, which leaves the
+                profile page
+            circuit_breaker: counts the post pages which fail to load. Without it the first failure is raised
+            previous_posts: posts crawled before, by shortcode. Those among the first n are not read again but
+                taken over in their place of the timeline
+        Returns:
+            a list of dict per post, newest first
+        Raises:
+            CrawlFailed: if the circuit breaker gives up on the influencer
+        '''
+
+        post_connector = post_connector or self
+        post_fields = ('number_of_likes', 'number_of_comments', 'post_time_weekday', 'post_time_hour', 'is_video',
+                       'if_tracking_others')
+
+        previous_posts = previous_posts or {}
+
+        posts = []
+        # the posts read now, their missing fields are completed from the post pages
+        read_posts = []
+        for href, node in self.__iter_timeline(n):
+            shortcode = href.strip('/').split('/')[-1]
+            if shortcode in previous_posts:
+                posts.append(dict(previous_posts[shortcode], href=href))
+                continue
+            if node is not None:
+                posts.append(dict(embedded_json.post_data(node), href=href))
+                # the timeline has the urls of single images, videos and carousels are read from their post page
+                if self.media_sink is not None and embedded_json.media_urls(node):
+                    self.media_sink(shortcode, embedded_json.media_urls(node))
+            else:
+                # the grid element is rendered while the timeline stands at it
+                posts.append(dict(self.__read_grid_counts(href), href=href))
+            read_posts.append(posts[-1])
+
+        for post in read_posts:
+            missing = [field for field in post_fields if post.get(field) is None]
+            if not missing:
+                continue
+            try:
+                post_data = post_connector.get_post_data(post['href'])
+            except PageLoadFailed as e:
+                if circuit_breaker is None:
+                    raise
+                # leave the fields empty, unless the influencer failed too often
+                circuit_breaker.record_failure(self.instagram_id, e)
+                continue
+            for field in missing:
+                post[field] = post_data.get(field)
+
+        return posts
+
+    def iter_post_shortcodes(self, max_posts: Optional[int] = None, since: Optional[datetime] = None,
+                             page_size: int = 12) -> Iterator[str]:
+
+        '''
+        Stream the posts of the visited profile page beyond its first grid, newest first. Further pages of the
+        timeline are fetched from within the page as the caller consumes the shortcodes, or else the grid is scrolled.
+        Only one timeline page and a compact key per seen shortcode are held, so that hundreds of posts take no more
+        memory than a dozen, and posts dropped from and added again to a virtualized grid are not repeated.
+
+        Args:
+            max_posts: stop after this many posts, None for the whole timeline
+            since: stop at the posts older than this, naive times are UTC. Only applies where the timeline json
+                carries the post times, a scrolled grid has none
+            page_size: number of posts per timeline page
+        Yields:
+            shortcodes, e.g. CXixCI9Ll0E
+        '''
+
+        for href, _ in self.__iter_timeline(max_posts, since, page_size):
+            yield href.strip('/').split('/')[-1]
+
+    def __iter_timeline(self, max_posts: Optional[int] = None, since: Optional[datetime] = None,
+                        page_size: int = 12) -> Iterator[Tuple[str, Optional[Dict]]]:
+
+        '''
+        Yields:
+            the href of a post and its timeline node, None if the post was read from the grid
+        '''
+
+        if max_posts is not None and max_posts <= 0:
+            return
+
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        cutoff = since.timestamp() if since is not None else None
+
+        seen = set()
+        n_posts = 0
+        n_older = 0
+
+        for href, node in self.__iter_timeline_sources(page_size):
+            key = instagram_parser.shortcode_key(href.strip('/').split('/')[-1])
+            if key in seen:
+                continue
+            seen.add(key)
+
+            if cutoff is not None and node is not None and node.get('taken_at_timestamp', cutoff) < cutoff:
+                n_older += 1
+                if n_older > self.MAX_PINNED_POSTS:
+                    return
+                continue
+
+            yield href, node
+            n_posts += 1
+            if max_posts is not None and n_posts >= max_posts:
+                return
+
+    def __iter_timeline_sources(self, page_size: int) -> Iterator[Tuple[str, Optional[Dict]]]:
+
+        if self.profile_data is not None and 'edge_owner_to_timeline_media' in self.profile_data:
+            try:
+                yield from self.__iter_timeline_pages(page_size)
+                return
+            except PageLoadFailed as e:
+                # the posts yielded so far are skipped by the seen-set
+                print(f"{self.instagram_id}: the timeline json stopped, scrolling the grid instead: {e}")
+
+        for href in self.__iter_grid_hrefs():
+            yield href, None
+
+    def __iter_timeline_pages(self, page_size: int) -> Iterator[Tuple[str, Dict]]:
+
+        media = self.profile_data['edge_owner_to_timeline_media']
+        user_id = self.profile_data.get('id')
+
         while True:
+            for edge in media.get('edges', []):
+                yield f"/p/{edge['node']['shortcode']}/", edge['node']
+
+            variables = embedded_json.next_timeline_variables(media, user_id, page_size)
+            if variables is None:
+                return
+
+            media = self.__fetch_graphql(self.TIMELINE_QUERY_HASH, variables, embedded_json.timeline_page,
+                                         'timeline', PRIORITY_PROFILE)
+
+    def __fetch_graphql(self, query_hash: str, variables: Dict, parse, name: str, priority: int) -> Dict:
+
+        '''
+        Fetch a page of a GraphQL query from within the visited page, with the cookies of the session
+
+        Args:
+            query_hash: the query
+            variables: its variables, e.g. the cursor of the page
+            parse: function reading the page from the response text, None if the response does not carry it
+            name: the kind of page, for the metrics and the logs
+            priority: see crawling.models.scheduler
+        Raises:
+            PageLoadFailed: if the page cannot be loaded within the attempt budget of the retry policy
+        '''
+
+        url = embedded_json.graphql_url(self.base_url, query_hash, variables)
+
+        def load(timeout):
+            self.driver.set_script_timeout(timeout)
+            response = self.driver.execute_async_script(self.FETCH_SCRIPT, url)
+            if 'error' in response:
+                raise WebDriverException(response['error'])
+            page = parse(response['text'])
+            if page is None:
+                raise WebDriverException(f"the response carries no {name}")
+            return page
+
+        with stage(f'instagram.{name}_page'):
+            return self.connector.retry_policy.call(
+                load, url, retry_on=(WebDriverException,),
+                before_attempt=lambda: self.connector.wait_for_turn(url, priority=priority))
+
+    def __iter_grid_hrefs(self) -> Iterator[str]:
+
+        '''
+        Scroll the grid of the visited profile page down to its end. Rows scrolled past may be dropped by the page,
+        the hrefs are yielded while their rows are rendered
+        '''
+
+        if self.get_profile_html() is None:
+            return
+        self.driver.execute_script("window.scrollTo(0, 0);")
+
+        while True:
+            with stage('instagram.scroll_grid'):
+                article_section_html = self.connector.get_bs4_page_html('profile').find('article')
+            if article_section_html is None:
+                return
+            hrefs = [link.get('href') for link in html_parser.select(article_section_html, 'profile_grid_links')]
+            if not hrefs:
+                return
+
+            yield from hrefs
+
+            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
             try:
-                self.wait.until(EC.presence_of_all_elements_located((By.CLASS_NAME, 'k9GMp')))
-                break
+                WebDriverWait(self.driver, self.connector.retry_policy.timeout()).until(
+                    lambda driver: driver.execute_script(self.LAST_GRID_HREF_SCRIPT) not in (None, hrefs[-1]))
             except TimeoutException:
-                print("Unable to find the metadata yet")
-                time_end = perf_counter()
-                if (time_end - time_start) > 10:
-                    print("Unable to find the metadata")
-                    return None
+                # the end of the timeline
+                return
 
-        self.instagram_page_html = self.connector.get_bs4_page_html()
-        influencer_metadata = self.instagram_page_html.find_all('li', {'class': 'Y8-fY'})
+    def iter_comments(self, post_href: str, end_cursor: Optional[str] = None,
+                      page_size: int = 50) -> Iterator[Tuple[List[Dict], Optional[str]]]:
 
-        number_of_post = influencer_metadata[0].find('span', {'class': 'g47SY'}).text
-        number_of_follower = influencer_metadata[1].find('span', {'class': 'g47SY'}).text
-        number_of_follows = influencer_metadata[2].find('span', {'class': 'g47SY'}).text
+        '''
+        Stream the comments of a post page by page. The pages following the comments embedded in the post are
+        fetched from within the post page as the caller consumes them. A post without embedded json has its comments
+        expanded with the "load more" button instead, batch by batch, each batch being removed from the page once
+        read, so that neither the page nor the caller holds more than one page of comments.
+
+        Args:
+            post_href: href of the post, e.g. /p/CXixCI9Ll0E/
+            end_cursor: resume after the page this cursor ends, as yielded before. Rendered comments restart from
+                the first
+            page_size: number of comments per page
+        Yields:
+            id, author, text and unix time of the comments of a page (see COMMENT_DTYPES), and the cursor to resume
+            after the page: None after the last page, '' for rendered comments
+        Raises:
+            PageLoadFailed: if the post or a page of comments cannot be loaded within the attempt budget of the
+                retry policy
+        '''
 
-        # process number of post:
-        number_of_post = int(number_of_post.replace(",", ""))
-        # process number of follower:
-        number_of_follower = number_of_follower.replace(",", "")
-        basic_num = float(self.number_extractor_regex.findall(number_of_follower)[0])
+        self.connector.patient_page_load(f"{self.base_url}{post_href}", priority=PRIORITY_POST)
 
-        if 'k' in number_of_follower:
-            basic_num = basic_num * 1000
-        if 'm' in number_of_follower:
-            basic_num = basic_num * 1000000
+        media = embedded_json.extract_post(self.driver.page_source)
+        comments = None
+        if media is not None:
+            comments = media.get('edge_media_to_parent_comment') or media.get('edge_media_to_comment')
+        if comments is None or 'edges' not in comments:
+            yield from self.__iter_rendered_comments()
+            return
 
-        number_of_follower = int(basic_num)
-        # process number of follows:
-        number_of_follows = int(number_of_follows.replace(",", ""))
+        variables = {'shortcode': post_href.strip('/').split('/')[-1], 'first': page_size}
+        if end_cursor:
+            # the comments before the cursor were read before
+            comments = self.__fetch_graphql(self.COMMENT_QUERY_HASH, dict(variables, after=end_cursor),
+                                            embedded_json.comment_page, 'comment', PRIORITY_POST)
 
-        return {'number_of_post': number_of_post, 'number_of_follower': number_of_follower,
-                'number_of_follows': number_of_follows}
+        while True:
+            page_info = comments.get('page_info') or {}
+            end_cursor = page_info.get('end_cursor') if page_info.get('has_next_page') else None
 
-    def get_article_section(self) -> bs4.element.Tag:
+            yield [embedded_json.comment_fields(edge['node']) for edge in comments.get('edges', [])], end_cursor
 
-        article_section_html = self.instagram_page_html.find('main').find('article')
+            if end_cursor is None:
+                return
+            comments = self.__fetch_graphql(self.COMMENT_QUERY_HASH, dict(variables, after=end_cursor),
+                                            embedded_json.comment_page, 'comment', PRIORITY_POST)
 
-        return article_section_html
+    def __iter_rendered_comments(self) -> Iterator[Tuple[List[Dict], Optional[str]]]:
 
-    def get_post_data(self, post_index: int, post_href: str):
-
-        self.connector.patient_page_load(f"https://www.instagram.com{post_href}")
+        try:
+            self.wait.until(EC.presence_of_element_located((By.XPATH, '//article[@role="presentation"]//time')))
+        except TimeoutException:
+            print("Unable to find the post")
+            return
 
         while True:
+            with stage('instagram.comment_batch'):
+                comments = instagram_parser.post_comments(self.connector.get_bs4_page_html('post'))
+
+            has_more = self.driver.execute_script(self.LOAD_MORE_COMMENTS_SCRIPT)
+            if has_more:
+                try:
+                    WebDriverWait(self.driver, self.connector.retry_policy.timeout()).until(
+                        lambda driver: driver.execute_script(self.N_RENDERED_COMMENTS_SCRIPT) > 0)
+                except TimeoutException:
+                    # the button was the last one
+                    has_more = False
+
+            yield comments, '' if has_more else None
+
+            if not has_more:
+                return
+
+    def __get_post_data(self, post_href: str) -> Dict:
+
+        self.connector.patient_page_load(f"{self.base_url}{post_href}", priority=PRIORITY_POST)
+
+        page_source = self.driver.page_source
+        media = embedded_json.extract_post(page_source)
+        post_data = embedded_json.post_data(media) if media is not None else {}
+        if post_data.get('number_of_comments') is None:
+            post_data.pop('number_of_comments', None)
+
+        if not post_data or None in post_data.values():
+            post_data = self.__get_post_data_from_dom()
+            page_source = self.driver.page_source
+
+        if self.media_sink is not None:
+            self.media_sink(post_href.strip('/').split('/')[-1], instagram_parser.post_media_urls(page_source))
+
+        return post_data
+
+    @timed('instagram.hover')
+    def __read_grid_counts(self, href: str) -> Dict:
+
+        '''
+        Hover over a post of the profile grid and read likes and comments from the overlay
+        '''
+
+        post_elem = self.driver.find_element_by_xpath('//a[@href="' + str(href) + '"]')
+        ActionChains(self.driver).move_to_element(post_elem).perform()
+
+        counts = [elem.text for elem in post_elem.find_elements_by_class_name('-V_eO')]
+        if len(counts) < 2:
+            return {'number_of_likes': None, 'number_of_comments': None}
+
+        return {'number_of_likes': parse_count(counts[0]), 'number_of_comments': parse_count(counts[1])}
+
+    @timed('instagram.post_data_from_dom')
+    def __get_post_data_from_dom(self) -> Dict:
+
+        def wait_for_post(timeout):
             try:
-                self.wait.until(EC.presence_of_element_located((By.XPATH, '//article[@role="presentation"]')))
-                break
+                # the post time is rendered together with media, likes and caption
+                WebDriverWait(self.driver, timeout).until(
+                    EC.presence_of_element_located((By.XPATH, '//article[@role="presentation"]//time')))
             except TimeoutException:
                 print("Unable to find the post yet")
-
+                self.connector.wait_for_turn(self.driver.current_url, priority=PRIORITY_POST)
                 self.driver.refresh()
+                raise
+
+        self.connector.retry_policy.call(wait_for_post, self.driver.current_url, retry_on=(WebDriverException,))
 
-        post_html = self.connector.get_bs4_page_html()
+        post_html = self.connector.get_bs4_page_html('post')
 
-        # like
+        # the page is ready, all flags are read from the parsed post at once
         # there are two possibility: video or image
-        is_video = self.is_video_check()
+        is_video = self.is_video_check(post_html)
 
         try:
             number_of_likes = self.driver.find_element_by_xpath('//a[@class="zV_Nj"]').find_element_by_tag_name('span').text
         except NoSuchElementException:
             print('No number of likes element')
-            while True:
-                try:
-                    button = self.wait.until(EC.element_to_be_clickable((By.XPATH, '//span[@class="vcOH2"]')))
-                    button.click()
-                    ele = self.driver.find_element_by_xpath('//div[@class="vJRqr"]')
-                    number_of_likes = ele.find_element_by_tag_name('span').text
-                    break
-                except TimeoutException:
-                    print('button cannot be clicked yet')
+
+            def read_video_likes(driver):
+                # a video shows its views, its likes show up after a click on them
+                button = EC.element_to_be_clickable((By.XPATH, '//span[@class="vcOH2"]'))(driver)
+                if not button:
+                    return False
+                button.click()
+                return driver.find_element_by_xpath('//div[@class="vJRqr"]').find_element_by_tag_name('span').text
+
+            number_of_likes = self.__wait_until(read_video_likes, 'likes of the video')
 
         # number_of_likes: str -> int
-        try:
-            number_of_likes = int(number_of_likes.replace(",", ""))
-        except ValueError:
-            number_of_likes = 0
+        number_of_likes = parse_count(number_of_likes) or 0
 
-        # comments: skip because another method is required.
+        # comments: streamed page by page by iter_comments
 
         # time
-        time_string = post_html.find('time', {'class': '_1o9PC Nzb55'}).get('datetime')
+        time_string = html_parser.select_one(post_html, 'post_time').get('datetime')
         time_string = datetime.strptime(time_string[:-5], "%Y-%m-%dT%H:%M:%S")
         weekday = time_string.weekday()
         hour = time_string.hour
 
         # if tracking_others:
-        if_tracking_others = self.if_tracking_others()
-
-        return {f'number_of_likes_{post_index}': number_of_likes, f'post_time_weekday_{post_index}': weekday,
-                f'is_video_{post_index}': is_video, f'post_time_hour_{post_index}': hour,
-                f'if_tracking_others_{post_index}': if_tracking_others}
+        if_tracking_others = self.if_tracking_others(post_html)
 
-    def is_video_check(self) -> int:
+        return {'number_of_likes': number_of_likes, 'post_time_weekday': weekday, 'is_video': is_video,
+                'post_time_hour': hour, 'if_tracking_others': if_tracking_others}
 
-        time_start = perf_counter()
+    @timed('instagram.is_video_check')
+    def is_video_check(self, post_html: Optional[bs4.element.Tag] = None) -> Optional[int]:
 
-        try:
-            self.wait.until(EC.presence_of_element_located((By.XPATH, '//video[@class="tWeCl"]')))
-            print("This is a video post")
-            return 1
-        except TimeoutException:
-            pass
+        '''
+        Check the media type of the visited post page, without waiting
 
-        try:
-            self.wait.until(EC.presence_of_element_located((By.XPATH, '//img[@class="FFVAD"]')))
-            print("This is an image post")
-            return 0
-        except TimeoutException:
-            pass
+        Args:
+            post_html: the parsed post, the current page is parsed if not given
+        Returns:
+            1 for a video, 0 for an image, None if the post shows neither
+        '''
 
-    def if_tracking_others(self):
+        if post_html is None:
+            post_html = self.connector.get_bs4_page_html('post')
 
-        try:
-            self.driver.find_element_by_xpath('//a[@class="notranslate"]')
+        if html_parser.select_one(post_html, 'post_video') is not None:
             return 1
-        except:
+        if html_parser.select_one(post_html, 'post_image') is not None:
             return 0
 
-    def number_of_comments(self, post_index: int, href: str):
+        print("Unable to find the media of the post")
+        return None
+
+    @timed('instagram.if_tracking_others')
+    def if_tracking_others(self, post_html: Optional[bs4.element.Tag] = None) -> int:
+
+        '''
+        Check if the visited post tags other accounts, without waiting
+
+        Args:
+            post_html: the parsed post, the current page is parsed if not given
+        '''
+
+        if post_html is None:
+            post_html = self.connector.get_bs4_page_html('post')
+
+        return int(html_parser.select_one(post_html, 'post_tagged_user') is not None)
+
+    @timed('instagram.hover')
+    def number_of_comments(self, href: str) -> Dict:
 
         post_elem = self.driver.find_element_by_xpath('//a[@href="' + str(href) + '"]')
         action = ActionChains(self.driver)
@@ -276,16 +838,9 @@ class Instagram:
 
         try:
             n_like_elem = self.driver.find_elements_by_class_name('-V_eO')
-            number_of_comments = n_like_elem[1].text.replace(",", "")
+            number_of_comments = n_like_elem[1].text
         except IndexError:
             print("comments cannot be found")
-            return {f'number_of_comments_{post_index}': 0}
-
-        basic_num = float(self.number_extractor_regex.findall(number_of_comments)[0])
-
-        if 'k' in number_of_comments:
-            basic_num = basic_num * 1000
-        if 'm' in number_of_comments:
-            basic_num = basic_num * 1000000
+            return {'number_of_comments': 0}
 
-        return {f'number_of_comments_{post_index}': int(basic_num)}
+        return {'number_of_comments': parse_count(number_of_comments) or 0}
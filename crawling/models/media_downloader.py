@@ -0,0 +1,221 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import requests
+
+from crawling.io.media_store import MediaStore
+from crawling.models.http_client import HttpClient
+from crawling.models.retry_policy import PageLoadFailed, PageNotAvailable, RetryPolicy, is_permanent_status
+from crawling.models.scheduler import DEFAULT_SCHEDULER, PRIORITY_MEDIA, RequestScheduler
+
+
+class MediaDownloader:
+
+    """Optional media stage of the crawl: downloads the images and videos of the visited posts into a MediaStore.
+
+    Downloads run outside the browser on a pool of threads sharing one keep-alive HttpClient, and are streamed to
+    disk chunk by chunk. submit blocks while max_pending posts wait, so that a fast crawl does not pile up work.
+    An interrupted download continues from its .part file with a Range request.
+
+    Attributes:
+        store: where the media go
+        max_workers: number of downloads at the same time
+        retry_policy: timeouts and retries of the downloads
+        scheduler: rate limiter of the requests
+
+    Methods:
+        submit: download the media of a post in the background
+        download: download one url into the store
+        report: number of posts, files and bytes downloaded, and the throughput
+        close: wait for the pending downloads and release the connections, or use with
+    """
+
+    def __init__(self, store: MediaStore, max_workers: int = 8, max_pending: Optional[int] = None,
+                 http_client: Optional[HttpClient] = None, retry_policy: Optional[RetryPolicy] = None,
+                 scheduler: Optional[RequestScheduler] = None, chunk_size: int = 1 << 16):
+
+        """
+        Args:
+            store: where the media go
+            max_workers: number of downloads at the same time
+            max_pending: number of posts submitted but not downloaded yet after which submit blocks, 4 * max_workers
+                by default
+            http_client: the pooled client, one with max_workers connections per host if not given
+            retry_policy: timeouts and retries. A policy of its own if not given, so that the long downloads do not
+                stretch the page load timeouts
+            scheduler: rate limiter of the requests. The scheduler shared by all connectors if not given
+            chunk_size: bytes written at once
+        """
+
+        self.store = store
+        self.max_workers = max_workers
+        self.retry_policy = retry_policy or RetryPolicy(min_timeout=30.0)
+        self.scheduler = scheduler or DEFAULT_SCHEDULER
+        self.__http = http_client or HttpClient(max_connections=max_workers)
+        self.__chunk_size = chunk_size
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media')
+        self.__pending = threading.BoundedSemaphore(max_pending or 4 * max_workers)
+        # urls being downloaded, a url is downloaded by one thread at a time
+        self.__condition = threading.Condition()
+        self.__in_flight = set()
+        self.__stats = {'posts': 0, 'files': 0, 'bytes': 0, 'deduplicated': 0, 'failed': 0}
+        self.__time_start = perf_counter()
+
+    def submit(self, shortcode: str, urls: List[str]):
+
+        '''
+        Download the media of a post in the background and record them in the index of the store. Posts recorded
+        before are skipped
+
+        Args:
+            shortcode: the post, e.g. CXixCI9Ll0E
+            urls: its images and videos, in carousel order, see crawling.parsers.instagram.post_media_urls
+        '''
+
+        if not urls:
+            return
+
+        self.__pending.acquire()
+        try:
+            self.__executor.submit(self.__download_post, shortcode, list(urls))
+        except RuntimeError:
+            # closed
+            self.__pending.release()
+            raise
+
+    def __download_post(self, shortcode: str, urls: List[str]):
+
+        try:
+            if self.store.post_media(shortcode):
+                return
+            digests = []
+            for url in urls:
+                try:
+                    digests.append(self.download(url))
+                except PageLoadFailed as e:
+                    # the post is not recorded, a later crawl tries again
+                    print(f"{shortcode}: {e}")
+                    self.__count('failed')
+                    return
+            self.store.add_post(shortcode, digests)
+            self.__count('posts')
+        except Exception as e:
+            print(f"{shortcode}: media download failed: {e}")
+            self.__count('failed')
+        finally:
+            self.__pending.release()
+
+    def download(self, url: str) -> str:
+
+        '''
+        Download one url into the store, unless it was downloaded before
+
+        Args:
+            url: an image or video url
+        Returns:
+            the sha256 of the content, see MediaStore.path
+        Raises:
+            PageLoadFailed: if the download does not finish within the attempt budget of the retry policy
+            PageNotAvailable: at once, if the server answers with a client error, e.g. 403 for an expired signed url
+        '''
+
+        def load(timeout):
+            try:
+                return self.__stream_to(url, part_file, timeout)
+            except requests.HTTPError as e:
+                if e.response is not None and is_permanent_status(e.response.status_code):
+                    raise PageNotAvailable(f"{url}: {e}") from e
+                raise
+
+        part_file = self.store.part_file(url)
+
+        with self.__condition:
+            while part_file in self.__in_flight:
+                self.__condition.wait()
+            self.__in_flight.add(part_file)
+
+        try:
+            digest = self.store.known_hash(url)
+            if digest is not None:
+                self.__count('deduplicated')
+                return digest
+
+            digest, n_bytes = self.retry_policy.call(
+                load, url, retry_on=(requests.RequestException, OSError),
+                before_attempt=lambda: self.scheduler.acquire(url, priority=PRIORITY_MEDIA))
+            self.__count('bytes', n_bytes)
+            self.__count('files' if self.store.commit(url, part_file, digest) else 'deduplicated')
+
+            return digest
+        finally:
+            with self.__condition:
+                self.__in_flight.discard(part_file)
+                self.__condition.notify_all()
+
+    def __stream_to(self, url: str, part_file: str, timeout: float) -> Tuple[str, int]:
+
+        '''
+        Download a url into its .part file, continuing after the bytes the file has
+
+        Returns:
+            the sha256 of the whole file and the number of bytes downloaded now
+        '''
+
+        offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        start, chunks = self.__http.stream(url, offset=offset, timeout=timeout, chunk_size=self.__chunk_size)
+
+        digest = hashlib.sha256()
+        if start > 0:
+            with open(part_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.__chunk_size), b''):
+                    digest.update(chunk)
+
+        n_bytes = 0
+        # a server ignoring the Range request sends the whole file again
+        with open(part_file, 'ab' if start > 0 else 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                n_bytes += len(chunk)
+
+        return digest.hexdigest(), n_bytes
+
+    def __count(self, key: str, n: int = 1):
+
+        with self.__condition:
+            self.__stats[key] += n
+
+    def report(self) -> str:
+
+        '''
+        Returns:
+            number of posts, files and bytes downloaded, the throughput, and the downloads saved by deduplication
+        '''
+
+        with self.__condition:
+            stats = dict(self.__stats)
+        elapsed = perf_counter() - self.__time_start
+        megabytes = stats['bytes'] / 1e6
+
+        return (f"{stats['posts']} posts, {stats['files']} new files, {megabytes:.1f} MB "
+                f"({megabytes / elapsed if elapsed > 0 else 0:.2f} MB/s), {stats['deduplicated']} deduplicated, "
+                f"{stats['failed']} failed")
+
+    def close(self):
+
+        '''
+        Wait for the pending downloads and release the connections
+        '''
+
+        self.__executor.shutdown(wait=True)
+        self.__http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
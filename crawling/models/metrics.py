@@ -0,0 +1,303 @@
+import functools
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional
+
+# upper bounds in seconds of the histogram buckets, the last bucket takes everything slower
+BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30)
+# the percentiles are read from finer buckets growing by this factor, i.e. to within 5 percent
+PERCENTILE_BUCKET_GROWTH = 1.1
+
+
+class _NullStage:
+
+    """Stage context used while the metrics are turned off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    def __init__(self, metrics: 'CrawlMetrics', name: str):
+
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.metrics.record(self.name, time.perf_counter() - self.start,
+                            error=exc_type.__name__ if exc_type is not None else None)
+        return False
+
+
+class _Histogram:
+
+    """Durations of one stage in fixed buckets, so that a stage takes the same memory after a million records as
+    after ten. Not thread-safe, CrawlMetrics guards it with its lock."""
+
+    def __init__(self):
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # counts per bucket of BUCKETS, for the report
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        # counts per power of PERCENTILE_BUCKET_GROWTH, for the percentiles
+        self.__fine = defaultdict(int)
+
+    def add(self, seconds: float):
+
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[next((i for i, bound in enumerate(BUCKETS) if seconds < bound), len(BUCKETS))] += 1
+        self.__fine[math.ceil(math.log(max(seconds, 1e-6), PERCENTILE_BUCKET_GROWTH))] += 1
+
+    def percentile(self, q: float) -> float:
+
+        '''
+        Returns:
+            the upper bound of the bucket holding the q-th percentile, at most the slowest duration. 0 if empty
+        '''
+
+        rank = max(1, math.ceil(q / 100 * self.count))
+        n = 0
+        for exponent in sorted(self.__fine):
+            n += self.__fine[exponent]
+            if n >= rank:
+                return min(PERCENTILE_BUCKET_GROWTH ** exponent, self.max)
+
+        return 0.0
+
+
+class CrawlMetrics:
+
+    """Wall-clock time spent in each stage of the crawl, e.g. page loads, element waits, hovers or parsing.
+
+    Stages nest, a stage's time includes the time of the stages it calls. Durations are counted in histograms of
+    fixed buckets per stage, so a long crawl takes no more memory than a short one, and summed per influencer, the
+    influencer being the one crawled by the current thread, see influencer(). Turned off by default, a stage then
+    costs a single attribute check.
+
+    Attributes:
+        enabled: if stages are recorded
+        trace_file: json lines file getting one line per recorded stage, None for no trace
+
+    Methods:
+        enable / disable: turn the recording on and off
+        stage: context manager timing a block
+        timed: decorator timing a function
+        influencer: context manager attributing the stages of the current thread to an influencer
+        summary: a report of the histograms per stage and of the slowest influencers
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.trace_file = None
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__trace = None
+        self.__stages = defaultdict(_Histogram)
+        self.__influencers = defaultdict(lambda: defaultdict(float))
+
+    def enable(self, trace_file: Optional[str] = None):
+
+        '''
+        Args:
+            trace_file: write every recorded stage as a json line to this file
+        '''
+
+        with self.__lock:
+            if trace_file is not None and self.__trace is None:
+                self.__trace = open(trace_file, 'a')
+            self.trace_file = trace_file
+            self.enabled = True
+
+    def disable(self):
+
+        with self.__lock:
+            self.enabled = False
+            if self.__trace is not None:
+                self.__trace.close()
+                self.__trace = None
+
+    def stage(self, name: str):
+
+        '''
+        Time the enclosed block as stage name, e.g. with metrics.stage('instagram.hover'): ...
+        '''
+
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def timed(self, name: str) -> Callable:
+
+        '''
+        Decorator timing every call of the function as stage name
+        '''
+
+        def decorator(function):
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Stage(self, name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def influencer(self, instagram_id: str):
+
+        '''
+        Context manager attributing the stages recorded by the current thread to the influencer, and timing the
+        whole block as stage 'influencer'
+        '''
+
+        return _InfluencerScope(self, instagram_id)
+
+    @property
+    def current_influencer(self) -> Optional[str]:
+
+        return getattr(self.__local, 'influencer', None)
+
+    @current_influencer.setter
+    def current_influencer(self, instagram_id: Optional[str]):
+
+        self.__local.influencer = instagram_id
+
+    def record(self, name: str, seconds: float, error: Optional[str] = None):
+
+        '''
+        Record a duration measured elsewhere, e.g. a login phase
+
+        Args:
+            name: the stage
+            seconds: the duration
+            error: name of the exception which ended the stage, if any
+        '''
+
+        if not self.enabled:
+            return
+
+        influencer = self.current_influencer
+
+        with self.__lock:
+            self.__stages[name].add(seconds)
+            if influencer is not None:
+                self.__influencers[influencer][name] += seconds
+            if self.__trace is not None:
+                self.__trace.write(json.dumps({'time': time.time(), 'thread': threading.current_thread().name,
+                                               'influencer': influencer, 'stage': name, 'seconds': seconds,
+                                               'error': error}) + "\n")
+
+    def stage_histograms(self) -> Dict[str, Dict]:
+
+        '''
+        Returns:
+            per stage the count, total, p50, p95 and max in seconds, and the counts per bucket of BUCKETS
+        '''
+
+        with self.__lock:
+            return {name: {'count': histogram.count, 'total': histogram.total, 'p50': histogram.percentile(50),
+                           'p95': histogram.percentile(95), 'max': histogram.max, 'buckets': list(histogram.buckets)}
+                    for name, histogram in self.__stages.items()}
+
+    def influencer_durations(self) -> Dict[str, Dict[str, float]]:
+
+        '''
+        Returns:
+            seconds spent per influencer and stage
+        '''
+
+        with self.__lock:
+            return {influencer: dict(stages) for influencer, stages in self.__influencers.items()}
+
+    def reset(self):
+
+        with self.__lock:
+            self.__stages.clear()
+            self.__influencers.clear()
+
+    def summary(self, n_slowest: int = 5) -> str:
+
+        '''
+        Args:
+            n_slowest: number of slowest influencers listed with the stages they spent most time in
+        Returns:
+            one line per stage with count, total, p50, p95, max and the histogram counts of BUCKETS
+        '''
+
+        stages = self.stage_histograms()
+        influencers = self.influencer_durations()
+
+        bucket_names = [f"<{bound:g}s" for bound in BUCKETS] + [f">{BUCKETS[-1]:g}s"]
+        lines = [f"{'stage':<40}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}  " +
+                 " ".join(f"{name:>6}" for name in bucket_names)]
+
+        for name, histogram in sorted(stages.items(), key=lambda item: -item[1]['total']):
+            lines.append(f"{name:<40}{histogram['count']:>7}{histogram['total']:>10.2f}"
+                         f"{histogram['p50'] * 1000:>10.1f}{histogram['p95'] * 1000:>10.1f}"
+                         f"{histogram['max'] * 1000:>10.1f}  " +
+                         " ".join(f"{count:>6}" for count in histogram['buckets']))
+
+        slowest = sorted(influencers.items(), key=lambda item: -item[1].get('influencer', 0.0))[:n_slowest]
+        if slowest:
+            lines.append("slowest influencers:")
+        for influencer, durations in slowest:
+            top_stages = sorted(((name, seconds) for name, seconds in durations.items() if name != 'influencer'),
+                                key=lambda item: -item[1])[:3]
+            lines.append(f"  {influencer}: {durations.get('influencer', 0.0):.2f} s, " +
+                         ", ".join(f"{name} {seconds:.2f} s" for name, seconds in top_stages))
+
+        return "\n".join(lines)
+
+
+class _InfluencerScope:
+
+    def __init__(self, metrics: CrawlMetrics, instagram_id: str):
+
+        self.metrics = metrics
+        self.instagram_id = instagram_id
+        self.previous = None
+        self.stage = None
+
+    def __enter__(self):
+
+        self.previous = self.metrics.current_influencer
+        self.metrics.current_influencer = self.instagram_id
+        self.stage = self.metrics.stage('influencer')
+        self.stage.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.stage.__exit__(exc_type, exc_value, traceback)
+        self.metrics.current_influencer = self.previous
+        return False
+
+
+# shared by all connectors and crawlers
+DEFAULT_METRICS = CrawlMetrics()
+stage = DEFAULT_METRICS.stage
+timed = DEFAULT_METRICS.timed
@@ -0,0 +1,242 @@
+import asyncio
+import math
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
+
+
+class PageLoadFailed(Exception):
+
+    """Raised when a page cannot be loaded within the attempt budget of the retry policy"""
+
+
+class PageNotAvailable(PageLoadFailed):
+
+    """Raised at once, without retries, when the server refuses a page for good, e.g. with HTTP 404"""
+
+
+def is_permanent_status(status: int) -> bool:
+
+    """
+    Decide if an HTTP status refuses a page for good: a client error other than a timeout or a rate limit, which a
+    retry would only repeat. Timeouts, connection errors and server errors are retried
+
+    Args:
+        status: the HTTP status code
+    """
+
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class CrawlFailed(Exception):
+
+    """Raised when the circuit breaker gives up on an influencer"""
+
+
+class RetryPolicy:
+
+    """Retry policy shared by all page loads of a crawl.
+
+    Failed page loads are retried with capped exponential backoff and full jitter, up to max_attempts per url. The
+    page load timeout adapts to the observed load times: a high percentile of the recent successful loads times a
+    safety factor, clamped to [min_timeout, max_timeout] and doubled on every retry. One slow page therefore cannot
+    stall a worker for good, and on a fast connection hanging loads are cut early.
+
+    The policy is thread-safe, so the sessions of a DriverPool learn the load times together.
+
+    Attributes:
+        max_attempts: attempt budget per url
+
+    Methods:
+        call: run a page load under the policy
+        call_async: run a page load coroutine under the policy
+        timeout: the current page load timeout
+        backoff: the delay before a retry
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 min_timeout: float = 5.0, max_timeout: float = 60.0, timeout_percentile: float = 95,
+                 timeout_factor: float = 2.0, window: int = 200, rng: Optional[random.Random] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+
+        """
+        Args:
+            max_attempts: attempt budget per url
+            base_delay: backoff delay of the first retry in seconds
+            max_delay: cap of the backoff delay in seconds
+            min_timeout: lower bound of the page load timeout in seconds
+            max_timeout: upper bound of the page load timeout in seconds
+            timeout_percentile: percentile of the observed load times the timeout is based on
+            timeout_factor: safety factor applied to the percentile
+            window: number of recent load times kept
+            rng: random generator of the jitter
+            sleep: function used to wait, replaceable for testing
+        """
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_factor = timeout_factor
+        self.__rng = rng or random.Random()
+        self.__sleep = sleep
+        self.__load_times = deque(maxlen=window)
+        self.__lock = threading.Lock()
+
+    def record(self, seconds: float):
+
+        '''
+        Record the duration of a successful page load
+        '''
+
+        with self.__lock:
+            self.__load_times.append(seconds)
+
+    def timeout(self, attempt: int = 0) -> float:
+
+        '''
+        Args:
+            attempt: number of failed attempts so far
+        Returns:
+            the page load timeout in seconds
+        '''
+
+        with self.__lock:
+            load_times = sorted(self.__load_times)
+
+        if load_times:
+            # nearest-rank percentile
+            rank = max(1, math.ceil(self.timeout_percentile / 100 * len(load_times)))
+            timeout = load_times[rank - 1] * self.timeout_factor
+        else:
+            timeout = self.min_timeout
+
+        timeout = max(self.min_timeout, timeout) * 2 ** attempt
+
+        return min(self.max_timeout, timeout)
+
+    def backoff(self, attempt: int) -> float:
+
+        '''
+        Args:
+            attempt: number of failed attempts so far, starting at 1
+        Returns:
+            seconds to wait before the next attempt
+        '''
+
+        return self.__rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, load: Callable[[float], object], url: str,
+             retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+             before_attempt: Optional[Callable[[], None]] = None):
+
+        '''
+        Load a page under the policy
+
+        Args:
+            load: function loading the page, called with the timeout in seconds
+            url: the url, for logging
+            retry_on: exceptions which count as a failed attempt
+            before_attempt: called before every attempt, outside the measured load time and the timeout, e.g. to
+                wait for the turn of the request in the scheduler
+        Returns:
+            the return value of load
+        Raises:
+            PageLoadFailed: if the attempt budget is used up
+        '''
+
+        for attempt in range(self.max_attempts):
+            if before_attempt is not None:
+                before_attempt()
+            timeout = self.timeout(attempt)
+            time_start = time.perf_counter()
+            try:
+                result = load(timeout)
+            except retry_on as e:
+                print(f"{sys.exc_info()[-1].tb_lineno}: {url} - attempt {attempt + 1}/{self.max_attempts} with "
+                      f"timeout {timeout:.1f} s failed: {e}")
+                if attempt + 1 < self.max_attempts:
+                    self.__sleep(self.backoff(attempt + 1))
+                continue
+            self.record(time.perf_counter() - time_start)
+            return result
+
+        raise PageLoadFailed(f"{url} failed {self.max_attempts} times")
+
+    async def call_async(self, load: Callable[[float], Awaitable], url: str,
+                         retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                         before_attempt: Optional[Callable[[], Awaitable]] = None):
+
+        '''
+        Like call, for coroutine functions load and before_attempt. The backoff does not block the event loop
+        '''
+
+        for attempt in range(self.max_attempts):
+            if before_attempt is not None:
+                await before_attempt()
+            timeout = self.timeout(attempt)
+            time_start = time.perf_counter()
+            try:
+                result = await load(timeout)
+            except retry_on as e:
+                print(f"{url} - attempt {attempt + 1}/{self.max_attempts} with timeout {timeout:.1f} s failed: {e}")
+                if attempt + 1 < self.max_attempts:
+                    await asyncio.sleep(self.backoff(attempt + 1))
+                continue
+            self.record(time.perf_counter() - time_start)
+            return result
+
+        raise PageLoadFailed(f"{url} failed {self.max_attempts} times")
+
+
+class CircuitBreaker:
+
+    """Give up on an influencer after too many failed page loads, so that the worker moves on.
+
+    Methods:
+        record_failure: count a failure, raise CrawlFailed once the circuit opens
+        reset: forget the failures of a key
+    """
+
+    def __init__(self, max_failures: int = 3):
+
+        """
+        Args:
+            max_failures: failures after which the circuit opens
+        """
+
+        self.max_failures = max_failures
+        self.__failures: Dict[str, int] = {}
+        self.__lock = threading.Lock()
+
+    def record_failure(self, key: str, error: Exception):
+
+        '''
+        Args:
+            key: e.g. the instagram id
+            error: the failure
+        Raises:
+            CrawlFailed: if the key failed max_failures times
+        '''
+
+        with self.__lock:
+            self.__failures[key] = self.__failures.get(key, 0) + 1
+            failures = self.__failures[key]
+
+        if failures >= self.max_failures:
+            self.reset(key)
+            raise CrawlFailed(f"{key} failed {failures} times, last error: {error}") from error
+
+    def reset(self, key: str):
+
+        with self.__lock:
+            self.__failures.pop(key, None)
+
+
+# shared by all connectors unless they are given their own policy
+DEFAULT_RETRY_POLICY = RetryPolicy()
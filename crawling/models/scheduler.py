@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+# lower value, higher priority
+PRIORITY_LOGIN = 0
+PRIORITY_PROFILE = 1
+PRIORITY_PAGE = 1
+PRIORITY_POST = 2
+PRIORITY_MEDIA = 3
+
+
+class TokenBucket:
+
+    """Token bucket allowing bursts of up to burst requests and rate requests per second in the long run.
+
+    Not thread-safe, RequestScheduler guards it with its lock.
+    """
+
+    def __init__(self, rate: float, burst: int):
+
+        """
+        Args:
+            rate: sustained requests per second
+            burst: maximal number of requests sent at once
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+
+    def __refill(self, now: float):
+
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def wait_time(self, now: float) -> float:
+
+        '''
+        Returns:
+            seconds until a token is available
+        '''
+
+        self.__refill(now)
+        return max(0.0, (1 - self.__tokens) / self.rate)
+
+    def consume(self, now: float):
+
+        self.__refill(now)
+        self.__tokens -= 1
+
+
+class RequestScheduler:
+
+    """Central rate limiter and scheduler of the requests of all crawler sessions.
+
+    Every request takes a token from the bucket of its host and, if it is sent by a logged-in session, from the
+    bucket of the account. Waiting requests of a host are served in priority order, e.g. profile pages before post
+    pages, except that a request waiting only for the bucket of its account lets the requests of other accounts go
+    ahead, so one busy account does not hold the host below its rate. A waiting request blocks until exactly the
+    moment its tokens are available, so the crawl runs at the allowed rate without idle sleeps.
+
+    Attributes:
+        host_rates: domain to (sustained requests per second, burst). Hosts ending with the domain share its bucket.
+            Requests to other hosts are not limited
+        account_rate: (sustained requests per second, burst) of every account, None for no limit
+
+    Methods:
+        acquire: block until a request may be sent
+        acquire_async: wait until a request may be sent, without blocking the event loop
+        queue_depth: number of waiting requests
+        achieved_rps: requests per second sent recently
+        report: a summary of the two
+    """
+
+    def __init__(self, host_rates: Optional[Dict[str, Tuple[float, int]]] = None,
+                 account_rate: Optional[Tuple[float, int]] = None, window: float = 60.0):
+
+        """
+        Args:
+            host_rates: domain to (sustained requests per second, burst)
+            account_rate: (sustained requests per second, burst) of every account
+            window: seconds over which the achieved request rate is measured
+        """
+
+        self.host_rates = host_rates or {}
+        self.account_rate = account_rate
+        self.__window = window
+        self.__condition = threading.Condition()
+        self.__host_buckets: Dict[str, TokenBucket] = {}
+        self.__account_buckets: Dict[str, TokenBucket] = {}
+        self.__queues: Dict[str, list] = {}
+        # ticket to the bucket of its account, None if the request is not limited per account
+        self.__ticket_accounts: Dict[Tuple[int, int], Optional[TokenBucket]] = {}
+        self.__counter = itertools.count()
+        self.__sent = deque()
+        self.__n_sent = 0
+        self.__time_start = time.monotonic()
+
+    def __domain(self, url: str) -> str:
+
+        host = urlsplit(url).hostname or ''
+        for domain in self.host_rates:
+            if host == domain or host.endswith(f".{domain}"):
+                return domain
+        return host
+
+    def __buckets(self, domain: str, account: Optional[str]):
+
+        buckets = []
+        if domain in self.host_rates:
+            if domain not in self.__host_buckets:
+                self.__host_buckets[domain] = TokenBucket(*self.host_rates[domain])
+            buckets.append(self.__host_buckets[domain])
+        if account is not None and self.account_rate is not None:
+            if account not in self.__account_buckets:
+                self.__account_buckets[account] = TokenBucket(*self.account_rate)
+            buckets.append(self.__account_buckets[account])
+        return buckets
+
+    def acquire(self, url: str, account: Optional[str] = None, priority: int = PRIORITY_PAGE):
+
+        '''
+        Block until the request may be sent
+
+        Args:
+            url: the url to request
+            account: the account the request is sent with, None if anonymous
+            priority: PRIORITY_LOGIN, PRIORITY_PROFILE, PRIORITY_PAGE, PRIORITY_POST or PRIORITY_MEDIA
+        '''
+
+        with self.__condition:
+            queue, ticket, buckets = self.__enqueue(url, account, priority)
+
+            while True:
+                wait_time = self.__take(queue, ticket, buckets)
+                if wait_time == 0:
+                    return
+                # sleep exactly until the tokens are there, or until a request of higher priority arrives
+                self.__condition.wait(timeout=None if wait_time == math.inf else wait_time)
+
+    async def acquire_async(self, url: str, account: Optional[str] = None, priority: int = PRIORITY_PAGE,
+                            poll_seconds: float = 0.05):
+
+        '''
+        Like acquire, for coroutines. The request waits in the same queues as those of the threads, but polls for its
+        turn with asyncio.sleep instead of blocking a thread. A cancelled request leaves the queue
+
+        Args:
+            url: the url to request
+            account: the account the request is sent with, None if anonymous
+            priority: see acquire
+            poll_seconds: longest sleep between two looks at the queue
+        '''
+
+        with self.__condition:
+            queue, ticket, buckets = self.__enqueue(url, account, priority)
+
+        try:
+            while True:
+                with self.__condition:
+                    wait_time = self.__take(queue, ticket, buckets)
+                if wait_time == 0:
+                    return
+                await asyncio.sleep(min(wait_time, poll_seconds))
+        except asyncio.CancelledError:
+            with self.__condition:
+                if ticket in queue:
+                    self.__leave(queue, ticket)
+                    self.__condition.notify_all()
+            raise
+
+    def __enqueue(self, url: str, account: Optional[str], priority: int) -> Tuple[list, Tuple[int, int], list]:
+
+        # called with the condition held
+        domain = self.__domain(url)
+        ticket = (priority, next(self.__counter))
+        queue = self.__queues.setdefault(domain, [])
+        heapq.heappush(queue, ticket)
+        buckets = self.__buckets(domain, account)
+        self.__ticket_accounts[ticket] = self.__account_buckets.get(account) if self.account_rate is not None else None
+        # the ticket may have taken the head of the queue
+        self.__condition.notify_all()
+
+        return queue, ticket, buckets
+
+    def __take(self, queue: list, ticket: Tuple[int, int], buckets: list) -> float:
+
+        # called with the condition held. 0 once the ticket took its tokens and left the queue, else the seconds
+        # until the tokens are there, inf while requests of higher priority wait before it. A request before the
+        # ticket is passed only if it is of another account and that account has no token
+        now = time.monotonic()
+        account_bucket = self.__ticket_accounts[ticket]
+        if queue[0] != ticket:
+            for other in sorted(queue):
+                if other == ticket:
+                    break
+                other_account_bucket = self.__ticket_accounts[other]
+                if (other_account_bucket is None or other_account_bucket is account_bucket
+                        or other_account_bucket.wait_time(now) == 0):
+                    return math.inf
+
+        wait_time = max([bucket.wait_time(now) for bucket in buckets] + [0.0])
+        if wait_time == 0:
+            for bucket in buckets:
+                bucket.consume(now)
+            self.__leave(queue, ticket)
+            self.__record(now)
+            self.__condition.notify_all()
+
+        return wait_time
+
+    def __leave(self, queue: list, ticket: Tuple[int, int]):
+
+        if queue[0] == ticket:
+            heapq.heappop(queue)
+        else:
+            queue.remove(ticket)
+            heapq.heapify(queue)
+        del self.__ticket_accounts[ticket]
+
+    def __record(self, now: float):
+
+        self.__n_sent += 1
+        self.__sent.append(now)
+        while self.__sent and self.__sent[0] < now - self.__window:
+            self.__sent.popleft()
+
+    def queue_depth(self) -> int:
+
+        '''
+        Returns:
+            number of requests waiting for their turn
+        '''
+
+        with self.__condition:
+            return sum(len(queue) for queue in self.__queues.values())
+
+    def achieved_rps(self) -> float:
+
+        '''
+        Returns:
+            requests per second sent within the measuring window
+        '''
+
+        with self.__condition:
+            now = time.monotonic()
+            while self.__sent and self.__sent[0] < now - self.__window:
+                self.__sent.popleft()
+            elapsed = min(self.__window, now - self.__time_start)
+            return len(self.__sent) / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> str:
+
+        return (f"{self.__n_sent} requests sent, {self.achieved_rps():.2f} requests/s over the last "
+                f"{self.__window:.0f} s, {self.queue_depth()} waiting")
+
+
+# shared by all connectors unless they are given their own scheduler
+DEFAULT_SCHEDULER = RequestScheduler(host_rates={'instagram.com': (0.5, 5), 'starngage.com': (5.0, 10)},
+                                     account_rate=(0.3, 3))
@@ -0,0 +1,252 @@
+import json
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+# Instagram ships the data a page is rendered from as inline scripts:
+#   window._sharedData = {...};
+#   window.__additionalDataLoaded('/p/<shortcode>/', {...});
+SHARED_DATA_REGEX = re.compile(r'window\._sharedData\s*=\s*(\{.*?\});?\s*</script>', re.S)
+ADDITIONAL_DATA_REGEX = re.compile(r"window\.__additionalDataLoaded\(\s*'[^']*'\s*,\s*(\{.*?\})\s*\);?\s*</script>", re.S)
+MENTION_REGEX = re.compile(r'@[\w.]+')
+
+
+def _load_json(regex, page_source: str) -> Optional[Dict]:
+
+    match = regex.search(page_source)
+    if match is None:
+        return None
+
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def _count(node: Dict, *edges: str) -> Optional[int]:
+
+    """
+    Read the count of the first of the given edges present in a GraphQL node
+    """
+
+    for edge in edges:
+        if edge in node and node[edge] is not None:
+            return int(node[edge]['count'])
+
+    return None
+
+
+def extract_profile(page_source: str) -> Optional[Dict]:
+
+    """
+    Get the GraphQL user object embedded in a profile page
+
+    Args:
+        page_source: html of an Instagram profile page
+    Returns:
+        the user object, or None if the page does not carry it
+    """
+
+    shared_data = _load_json(SHARED_DATA_REGEX, page_source)
+    try:
+        return shared_data['entry_data']['ProfilePage'][0]['graphql']['user']
+    except (KeyError, IndexError, TypeError):
+        pass
+
+    additional_data = _load_json(ADDITIONAL_DATA_REGEX, page_source)
+    try:
+        return additional_data['graphql']['user']
+    except (KeyError, TypeError):
+        return None
+
+
+def extract_post(page_source: str) -> Optional[Dict]:
+
+    """
+    Get the GraphQL media object embedded in a post page
+
+    Args:
+        page_source: html of an Instagram post page
+    Returns:
+        the media object, or None if the page does not carry it
+    """
+
+    additional_data = _load_json(ADDITIONAL_DATA_REGEX, page_source)
+    try:
+        return additional_data['graphql']['shortcode_media']
+    except (KeyError, TypeError):
+        pass
+
+    shared_data = _load_json(SHARED_DATA_REGEX, page_source)
+    try:
+        return shared_data['entry_data']['PostPage'][0]['graphql']['shortcode_media']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def timeline_page(response_text: str) -> Optional[Dict]:
+
+    """
+    Get the timeline media of a page of the profile timeline query
+
+    Args:
+        response_text: body of the response to /graphql/query/ for edge_owner_to_timeline_media
+    Returns:
+        the media connection with its edges and page_info, or None if the response does not carry it
+    """
+
+    try:
+        return json.loads(response_text)['data']['user']['edge_owner_to_timeline_media']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def next_timeline_variables(media: Dict, user_id: Optional[str], page_size: int = 12) -> Optional[Dict]:
+
+    """
+    Get the variables of the timeline query for the page after a page of the profile timeline
+
+    Args:
+        media: the media connection of a timeline page, see timeline_page
+        user_id: id of the profile
+        page_size: number of posts per page
+    Returns:
+        the variables, or None if the page is the last one or the profile id is unknown
+    """
+
+    page_info = media.get('page_info') or {}
+    if not page_info.get('has_next_page') or not page_info.get('end_cursor') or user_id is None:
+        return None
+
+    return {'id': user_id, 'first': page_size, 'after': page_info['end_cursor']}
+
+
+def graphql_url(base_url: str, query_hash: str, variables: Dict) -> str:
+
+    """
+    Args:
+        base_url: a url to Instagram, or to a local fixture server
+        query_hash: the query
+        variables: its variables, e.g. from next_timeline_variables
+    Returns:
+        the url of the GraphQL query
+    """
+
+    variables = json.dumps(variables, separators=(',', ':'))
+
+    return f"{base_url}/graphql/query/?query_hash={query_hash}&variables={quote(variables)}"
+
+
+def comment_page(response_text: str) -> Optional[Dict]:
+
+    """
+    Get the comments of a page of the comment query
+
+    Args:
+        response_text: body of the response to /graphql/query/ for edge_media_to_parent_comment
+    Returns:
+        the comment connection with its edges and page_info, or None if the response does not carry it
+    """
+
+    try:
+        return json.loads(response_text)['data']['shortcode_media']['edge_media_to_parent_comment']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def comment_fields(comment: Dict) -> Dict:
+
+    """
+    Args:
+        comment: a GraphQL comment node
+    Returns:
+        id, author, text and unix time of the comment
+    """
+
+    return {'comment_id': comment.get('id'), 'username': (comment.get('owner') or {}).get('username'),
+            'text': comment.get('text'), 'created_at': comment.get('created_at')}
+
+
+def profile_metadata(user: Dict) -> Dict:
+
+    """
+    Args:
+        user: a GraphQL user object
+    Returns:
+        number of posts, number of followers and number of follows, as Instagram.get_metadata
+    """
+
+    return {'number_of_post': _count(user, 'edge_owner_to_timeline_media'),
+            'number_of_follower': _count(user, 'edge_followed_by'),
+            'number_of_follows': _count(user, 'edge_follow')}
+
+
+def post_data(media: Dict) -> Dict:
+
+    """
+    Args:
+        media: a GraphQL media object, either of a post page or of a node of the profile timeline
+    Returns:
+        likes, comments, post time, media type and tagging of the post. Fields missing in the object are None
+    """
+
+    number_of_likes = _count(media, 'edge_media_preview_like', 'edge_liked_by')
+    number_of_comments = _count(media, 'edge_media_to_parent_comment', 'edge_media_to_comment')
+
+    if media.get('taken_at_timestamp') is not None:
+        post_time = datetime.utcfromtimestamp(media['taken_at_timestamp'])
+        weekday, hour = post_time.weekday(), post_time.hour
+    else:
+        weekday, hour = None, None
+
+    is_video = int(media['is_video']) if 'is_video' in media else None
+
+    return {'number_of_likes': number_of_likes, 'number_of_comments': number_of_comments,
+            'post_time_weekday': weekday, 'post_time_hour': hour, 'is_video': is_video,
+            'if_tracking_others': _if_tracking_others(media)}
+
+
+def media_urls(media: Dict) -> List[str]:
+
+    """
+    Args:
+        media: a GraphQL media object, either of a post page or of a node of the profile timeline
+    Returns:
+        the urls of the full-size images and videos of the post, one per carousel item. Empty if the object does not
+        have them all, as the timeline nodes of videos and carousels, whose post page has them
+    """
+
+    if media.get('__typename') == 'GraphSidecar' and 'edge_sidecar_to_children' not in media:
+        return []
+
+    children = (media.get('edge_sidecar_to_children') or {}).get('edges')
+    items = [edge['node'] for edge in children] if children else [media]
+
+    urls = []
+    for item in items:
+        url = item.get('video_url') if item.get('is_video') else item.get('display_url')
+        if not url:
+            return []
+        urls.append(url)
+
+    return urls
+
+
+def _if_tracking_others(media: Dict) -> Optional[int]:
+
+    """
+    A post tracks others if it tags users or mentions them in the caption
+    """
+
+    if 'edge_media_to_tagged_user' not in media and 'edge_media_to_caption' not in media:
+        return None
+
+    if media.get('edge_media_to_tagged_user', {}).get('edges'):
+        return 1
+
+    for edge in media.get('edge_media_to_caption', {}).get('edges', []):
+        if MENTION_REGEX.search(edge['node'].get('text', '')):
+            return 1
+
+    return 0
@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Tag
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+# Only the subtrees the extractors read are built, the rest of the page is skipped by the tokenizer.
+PAGE_STRAINERS = {
+    'ranking': SoupStrainer(['table', 'ul']),
+    'profile': SoupStrainer(['header', 'article']),
+    'post': SoupStrainer('article'),
+}
+
+# Selectors are compiled once and reused for every page.
+SELECTORS = {
+    'ranking_rows': soupsieve.compile('table.table.table-hover.table-responsive-sm > tbody > tr'),
+    'ranking_next_page': soupsieve.compile('ul.pagination.justify-content-center > li:last-child a'),
+    'profile_counts': soupsieve.compile('li.Y8-fY span.g47SY'),
+    'profile_grid_links': soupsieve.compile('div.Nnq7C.weEfm div.v1Nh3 a'),
+    'profile_verified': soupsieve.compile('header span[title="Verified"]'),
+    'post_time': soupsieve.compile('time._1o9PC.Nzb55'),
+    'post_likes': soupsieve.compile('a.zV_Nj > span'),
+    'post_video': soupsieve.compile('video.tWeCl'),
+    'post_image': soupsieve.compile('img.FFVAD'),
+    'post_tagged_user': soupsieve.compile('a.notranslate'),
+    'post_comments': soupsieve.compile('ul.XQXOT > ul.Mr508 div.C4VMK'),
+    'comment_author': soupsieve.compile('h3 a'),
+    'comment_text': soupsieve.compile('div.C4VMK > span'),
+    'comment_link': soupsieve.compile('a.gU-I7'),
+    'comment_time': soupsieve.compile('time'),
+}
+
+
+def parse(html: str, page_type: Optional[str] = None) -> BeautifulSoup:
+
+    """
+    Parse a page with the fastest available backend
+
+    Args:
+        html: page source code
+        page_type: 'ranking', 'profile' or 'post' to build only the subtrees the extractors of the page type read,
+            None for the whole page
+    Returns:
+        the DOM
+    """
+
+    return BeautifulSoup(html, PARSER, parse_only=PAGE_STRAINERS[page_type] if page_type else None)
+
+
+def select(html: Tag, selector: str) -> List[Tag]:
+
+    """
+    Args:
+        html: a DOM
+        selector: name of a compiled selector in SELECTORS
+    Returns:
+        all matching elements
+    """
+
+    return SELECTORS[selector].select(html)
+
+
+def select_one(html: Tag, selector: str) -> Optional[Tag]:
+
+    """
+    Args:
+        html: a DOM
+        selector: name of a compiled selector in SELECTORS
+    Returns:
+        the first matching element, None if there is none
+    """
+
+    return SELECTORS[selector].select_one(html)
@@ -0,0 +1,209 @@
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+import bs4
+
+from crawling.parsers import embedded_json
+from crawling.parsers import html as html_parser
+from crawling.parsers.numbers import parse_count
+
+# shortcodes are the media ids written in this url-safe base64 alphabet
+SHORTCODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+SHORTCODE_VALUES = {char: value for value, char in enumerate(SHORTCODE_ALPHABET)}
+# the permalink of a comment, e.g. /p/CXixCI9Ll0E/c/17900000000000000/
+COMMENT_ID_REGEX = re.compile(r'/c/(\d+)')
+
+
+def profile_counts(profile_html: bs4.element.Tag) -> Optional[Dict]:
+
+    """
+    Read the counters of a rendered profile page
+
+    Args:
+        profile_html: the profile page parsed with page type 'profile'
+    Returns:
+        number of posts, number of followers, and number of follows, None if the counters are missing
+    """
+
+    influencer_metadata = html_parser.select(profile_html, 'profile_counts')
+    if len(influencer_metadata) < 3:
+        return None
+
+    # the follower count is abbreviated, e.g. 12.3m, its title holds the exact number
+    number_of_post, number_of_follower, number_of_follows = [
+        parse_count(count_html.get('title') or count_html.text) for count_html in influencer_metadata[:3]]
+    if None in (number_of_post, number_of_follower, number_of_follows):
+        return None
+
+    return {'number_of_post': number_of_post, 'number_of_follower': number_of_follower,
+            'number_of_follows': number_of_follows}
+
+
+def profile_fields(page_source: str) -> Optional[Dict]:
+
+    """
+    Read verification and counters of a profile page, from its embedded json or else from its markup
+
+    Args:
+        page_source: source code of the loaded profile page
+    Returns:
+        verified, number of posts, number of followers, and number of follows, None if the counters are missing
+    """
+
+    user = embedded_json.extract_profile(page_source)
+    if user is not None:
+        metadata = embedded_json.profile_metadata(user)
+        if None not in metadata.values() and 'is_verified' in user:
+            return dict(metadata, verified=int(user['is_verified']))
+
+    profile_html = html_parser.parse(page_source, 'profile')
+    counts = profile_counts(profile_html)
+    if counts is None:
+        return None
+
+    return dict(counts, verified=int(html_parser.select_one(profile_html, 'profile_verified') is not None))
+
+
+def profile_post_hrefs(page_source: str) -> List[str]:
+
+    """
+    Args:
+        page_source: source code of the loaded profile page
+    Returns:
+        the hrefs of the posts shown on the profile page, newest first
+    """
+
+    user = embedded_json.extract_profile(page_source)
+    if user is not None and 'edge_owner_to_timeline_media' in user:
+        return [f"/p/{edge['node']['shortcode']}/" for edge in user['edge_owner_to_timeline_media'].get('edges', [])]
+
+    article_section_html = html_parser.parse(page_source, 'profile').find('article')
+    if article_section_html is None:
+        return []
+
+    return [link.get('href') for link in html_parser.select(article_section_html, 'profile_grid_links')]
+
+
+def post_fields(page_source: str) -> Optional[Dict]:
+
+    """
+    Read likes, post time, media type and tagging of a post page, from its embedded json or else from its markup.
+    The number of comments is included when the page carries its data as json.
+
+    Args:
+        page_source: source code of the loaded post page
+    Returns:
+        the post fields, None if the post is not rendered
+    """
+
+    media = embedded_json.extract_post(page_source)
+    post_data = embedded_json.post_data(media) if media is not None else {}
+    if post_data.get('number_of_comments') is None:
+        post_data.pop('number_of_comments', None)
+    if post_data and None not in post_data.values():
+        return post_data
+
+    post_html = html_parser.parse(page_source, 'post')
+    time_html = html_parser.select_one(post_html, 'post_time')
+    if time_html is None:
+        return None
+
+    likes_html = html_parser.select_one(post_html, 'post_likes')
+    post_time = datetime.strptime(time_html.get('datetime')[:-5], "%Y-%m-%dT%H:%M:%S")
+
+    if html_parser.select_one(post_html, 'post_video') is not None:
+        is_video = 1
+    elif html_parser.select_one(post_html, 'post_image') is not None:
+        is_video = 0
+    else:
+        is_video = None
+
+    return {'number_of_likes': parse_count(likes_html.text) if likes_html is not None else None,
+            'post_time_weekday': post_time.weekday(), 'is_video': is_video, 'post_time_hour': post_time.hour,
+            'if_tracking_others': int(html_parser.select_one(post_html, 'post_tagged_user') is not None)}
+
+
+def post_media_urls(page_source: str) -> List[str]:
+
+    """
+    Read the urls of the images and videos of a post page, from its embedded json or else from its markup
+
+    Args:
+        page_source: source code of the loaded post page
+    Returns:
+        one url per carousel item, the largest size of the rendered images. Media without a downloadable url, e.g.
+        the streamed videos of the markup, are left out
+    """
+
+    media = embedded_json.extract_post(page_source)
+    if media is not None:
+        urls = embedded_json.media_urls(media)
+        if urls:
+            return urls
+
+    post_html = html_parser.parse(page_source, 'post')
+
+    urls = []
+    for media_html in html_parser.select(post_html, 'post_video') + html_parser.select(post_html, 'post_image'):
+        url = media_html.get('src')
+        if media_html.get('srcset'):
+            # "url 640w,url 1080w", the widest last
+            url = media_html.get('srcset').split(',')[-1].split()[0]
+        if url and url.startswith('http'):
+            urls.append(url)
+
+    return urls
+
+
+def post_comments(post_html: bs4.element.Tag) -> List[Dict]:
+
+    """
+    Read the comments rendered on a post page
+
+    Args:
+        post_html: the post page parsed with page type 'post'
+    Returns:
+        id, author, text and unix time of each comment, in page order
+    """
+
+    comments = []
+    for comment_html in html_parser.select(post_html, 'post_comments'):
+        author_html = html_parser.select_one(comment_html, 'comment_author')
+        text_html = html_parser.select_one(comment_html, 'comment_text')
+        link_html = html_parser.select_one(comment_html, 'comment_link')
+        time_html = html_parser.select_one(comment_html, 'comment_time')
+
+        comment_id = COMMENT_ID_REGEX.search(link_html.get('href', '')) if link_html is not None else None
+        created_at = None
+        if time_html is not None and time_html.get('datetime'):
+            created_at = int(datetime.strptime(time_html.get('datetime')[:-5], "%Y-%m-%dT%H:%M:%S")
+                             .replace(tzinfo=timezone.utc).timestamp())
+
+        comments.append({'comment_id': comment_id.group(1) if comment_id is not None else None,
+                         'username': author_html.text if author_html is not None else None,
+                         'text': text_html.text if text_html is not None else None, 'created_at': created_at})
+
+    return comments
+
+
+def shortcode_key(shortcode: str) -> Union[int, str]:
+
+    """
+    Compact key of a shortcode for the seen-sets of long timelines: an int of 36 bytes instead of a str of 60
+
+    Args:
+        shortcode: e.g. CXixCI9Ll0E
+    Returns:
+        the shortcode decoded to an int, led by a 1 bit so that leading 'A's (zeros) count. The shortcode itself if
+        it is not in the shortcode alphabet
+    """
+
+    key = 1
+    for char in shortcode:
+        value = SHORTCODE_VALUES.get(char)
+        if value is None:
+            return shortcode
+        key = key << 6 | value
+
+    return key
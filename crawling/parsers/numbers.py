@@ -0,0 +1,71 @@
+import re
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# "1.2m", "345.6k", "12,345", "3.4%", "1.5 b". The separators are removed before matching.
+NUMBER_REGEX = re.compile(r'^(?P<number>\d+(?:\.\d*)?|\.\d+)(?P<suffix>[kmb%]?)$')
+
+MULTIPLIERS = {'': 1.0, 'k': 1e3, 'm': 1e6, 'b': 1e9, '%': 1.0}
+
+
+def parse_number(text: Optional[str]) -> Optional[float]:
+
+    """
+    Turn an abbreviated number shown by Instagram or starngage into a number. A percentage keeps its unit, "3.4%"
+    gives 3.4
+
+    Args:
+        text: e.g. "1.2m", "345.6k", "12,345" or "3.4%"
+    Returns:
+        the number, None if the text is not a number
+    """
+
+    if text is None:
+        return None
+
+    match = NUMBER_REGEX.match(str(text).strip().lower().replace(',', '').replace(' ', ''))
+    if match is None:
+        return None
+
+    return float(match.group('number')) * MULTIPLIERS[match.group('suffix')]
+
+
+def parse_count(text: Optional[str]) -> Optional[int]:
+
+    """
+    Like parse_number, rounded to a whole count, e.g. "12.3m" gives 12300000
+    """
+
+    number = parse_number(text)
+
+    return int(round(number)) if number is not None else None
+
+
+def parse_numbers(values: Union[pd.Series, np.ndarray, list]) -> Union[pd.Series, np.ndarray]:
+
+    """
+    Vectorized parse_number
+
+    Args:
+        values: strings as accepted by parse_number. Values which are numbers already are kept
+    Returns:
+        float64 values, NaN where a value is not a number. A Series keeps its index, anything else gives an array
+    """
+
+    series = values if isinstance(values, pd.Series) else pd.Series(np.asarray(values, dtype=object))
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        # nothing to parse, e.g. a column read back from a typed file
+        parsed = series.astype('float64')
+    else:
+        text = series.astype('string').str.strip().str.lower().str.replace(r'[,\s]', '', regex=True)
+        parts = text.str.extract(NUMBER_REGEX.pattern)
+        parsed = (pd.to_numeric(parts['number'], errors='coerce') *
+                  parts['suffix'].map(MULTIPLIERS)).astype('float64')
+
+    if isinstance(values, pd.Series):
+        return parsed.rename(values.name)
+
+    return parsed.to_numpy(dtype='float64', na_value=np.nan)
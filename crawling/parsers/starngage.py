@@ -0,0 +1,75 @@
+import re
+from typing import Dict, List, Optional
+
+import bs4
+
+from crawling.parsers import html as html_parser
+from crawling.parsers.numbers import parse_count, parse_number
+
+
+def ranking_influencers(plp_html: bs4.element.Tag) -> List[Dict]:
+
+    """
+    Args:
+        plp_html: a parsed ranking page
+    Returns:
+        the influencers listed on the page, in rank order
+    """
+
+    return [influencer_info(row_html) for row_html in html_parser.select(plp_html, 'ranking_rows')]
+
+
+def influencer_info(row_html: bs4.element.Tag) -> Dict:
+
+    """
+    Args:
+        row_html: a row of influencer's info as an HTML object
+    """
+
+    influencer_content = row_html.find('td', {'class': 'align-middle text-break'}).contents
+    influencer_name = influencer_content[0]
+    instagram_id = influencer_content[-1].text
+    topics_html = row_html.find_all('span', {'class': 'badge badge-pill badge-light samll text-muted'})
+    topics = ' '.join([topic_html.find('a').text for topic_html in topics_html])
+    # the last two are the number of followers, e.g. 12.3m, and the engagement rate in percent, e.g. 3.4%
+    followers = parse_count(row_html.find_all('td')[-2].text)
+    engagement_rate = parse_number(row_html.find_all('td')[-1].text)
+
+    influencer_dict = {'name': influencer_name,
+                       'instagram_id': instagram_id,
+                       'topics': topics,
+                       'followers_starngage': followers,
+                       'engagement_rate_starngage': engagement_rate}
+
+    return influencer_dict
+
+
+def next_page_url(plp_html: bs4.element.Tag) -> Optional[str]:
+
+    """
+    Args:
+        plp_html: a parsed ranking page
+    Returns:
+        the url of the next ranking page, None on the last page
+    """
+
+    next_link = html_parser.select_one(plp_html, 'ranking_next_page')
+    if next_link is None:
+        return None
+
+    return next_link.get('href')
+
+
+def page_url_template(next_page_url: str) -> Optional[str]:
+
+    """
+    Turn the url of the second page into a template for all pages, e.g. ...ranking?page=2 -> ...ranking?page={page}
+
+    Returns:
+        the template, or None if the url does not carry the page number
+    """
+
+    if not re.search(r'page=2(?!\d)', next_page_url):
+        return None
+
+    return re.sub(r'page=2(?!\d)', 'page={page}', next_page_url.replace('{', '{{').replace('}', '}}'))
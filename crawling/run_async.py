@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+from crawling.io import session_cache
+from crawling.io.fixture_server import FixtureServer, fixture_instagram_ids
+from crawling.io.path_definition import get_file
+from crawling.io.result_store import ResultStore
+from crawling.models.async_connector import AsyncConnector
+from crawling.models.async_instagram import AsyncInstagram
+from crawling.models.retry_policy import CrawlFailed
+from crawling.settings import INSTAGRAM
+
+
+async def crawl_all(crawler: AsyncInstagram, store: ResultStore, instagram_ids, max_influencers: int) -> int:
+
+    """
+    Crawl influencers concurrently and store their results
+
+    Args:
+        crawler: the asyncio crawler
+        store: where the results go
+        instagram_ids: the influencers
+        max_influencers: maximal number of influencers crawled at the same time, each of them opens its posts
+            concurrently as well
+    Returns:
+        number of stored influencers
+    """
+
+    in_flight = asyncio.Semaphore(max_influencers)
+
+    async def crawl_and_save(instagram_id):
+        async with in_flight:
+            try:
+                result = await crawler.crawl_influencer(instagram_id)
+            except CrawlFailed as e:
+                print(f"give up {instagram_id}: {e}")
+                store.mark_failed(instagram_id, str(e))
+                return False
+        if result is None:
+            return False
+        store.save(instagram_id, *result)
+        return True
+
+    return sum(await asyncio.gather(*[crawl_and_save(instagram_id) for instagram_id in instagram_ids]))
+
+
+async def main(args):
+
+    fixture_server = None
+    base_url = "https://www.instagram.com"
+    storage_state = None
+    account = None
+
+    if args.fixture:
+        fixture_server = FixtureServer(latency=args.fixture_latency)
+        base_url = fixture_server.start()
+        store_file = args.store or os.path.join(tempfile.mkdtemp(prefix='fixture_influencer_'), 'influencer.sqlite')
+        instagram_ids = fixture_instagram_ids(args.limit or 100)
+    else:
+        # the session is logged in by run.py, which caches it
+        session = session_cache.load_session(session_cache.get_session_file(INSTAGRAM['username']))
+        if not session:
+            raise SystemExit("no cached Instagram session, log in once with run.py first")
+        storage_state = session_cache.storage_state(session, origin=base_url)
+        account = INSTAGRAM['username']
+        store_file = args.store or get_file('data/influencer.sqlite')
+        instagram_ids = list(pd.read_csv(args.influencers, sep=';', index_col=0)['instagram_id'].values[:args.limit])
+
+    with ResultStore(store_file) as store:
+        completed_ids = store.completed_ids()
+        instagram_ids = [instagram_id for instagram_id in instagram_ids if instagram_id not in completed_ids]
+
+        async with AsyncConnector(headless=not args.show, profile=args.profile, max_tabs=args.tabs, account=account,
+                                  storage_state=storage_state) as connector:
+            time_start = perf_counter()
+            n_done = await crawl_all(AsyncInstagram(connector, base_url=base_url), store, instagram_ids,
+                                     max_influencers=max(1, args.tabs // 4))
+            elapsed = perf_counter() - time_start
+
+    print(f"crawled {n_done}/{len(instagram_ids)} influencers with {args.tabs} tabs in {elapsed:.1f} s "
+          f"({n_done / elapsed if elapsed > 0 else 0:.2f} influencers/s), results in {store_file}")
+
+    if fixture_server is not None:
+        fixture_server.stop()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Crawl the Instagram pages of the influencers with many tabs of a "
+                                                 "single browser, driven from one event loop")
+    parser.add_argument('--tabs', type=int, default=16, help='maximal number of tabs loading at the same time')
+    parser.add_argument('--influencers', default='data/influencer_dataframe.csv',
+                        help='csv file created by crawling.get_influencer_list_as_dataframe')
+    parser.add_argument('--store', default=None, help='SQLite file of the results, data/influencer.sqlite by default')
+    parser.add_argument('--show', action='store_true', help='show the browser window')
+    parser.add_argument('--profile', choices=['default', 'crawl'], default='crawl',
+                        help="Chrome profile, 'crawl' blocks images, media, fonts and trackers")
+    parser.add_argument('--fixture', action='store_true',
+                        help='crawl the saved pages of a local fixture server instead of Instagram')
+    parser.add_argument('--fixture-latency', type=float, default=0.0,
+                        help='seconds the fixture server waits before answering each request')
+    parser.add_argument('--limit', type=int, default=None, help='crawl only the first n influencers')
+
+    asyncio.run(main(parser.parse_args()))
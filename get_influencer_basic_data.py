@@ -13,4 +13,4 @@ if __name__ == "__main__":
 
     print(info)
 
-    crawler.driver.close()
\ No newline at end of file
+    crawler.connector.close()
\ No newline at end of file
@@ -4,8 +4,8 @@ if __name__ == "__main__":
 
     crawler = Instagram()
 
-    info = crawler.get_post_data(post_index=1, post_href='/p/CXixCI9Ll0E/')
+    info = crawler.get_post_data(post_href='/p/CXixCI9Ll0E/')
 
     print(info)
 
-    crawler.driver.close()
\ No newline at end of file
+    crawler.connector.close()
\ No newline at end of file
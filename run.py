@@ -1,68 +1,235 @@
+import argparse
 import os
-from collections import deque
+import socket
+import tempfile
+import time
+from time import perf_counter
 
 import pandas as pd
-import numpy as np
 
+from crawling.crawl import crawl_from_queue, crawl_influencer
+from crawling.io.fixture_server import FixtureServer, fixture_instagram_ids
+from crawling.io.media_store import MediaStore
+from crawling.io.path_definition import get_file
+from crawling.io.result_store import ResultStore
+from crawling.io.work_queue import WorkQueue
+from crawling.models.driver_factory import DEFAULT_DRIVER_FACTORY, driver_spec
+from crawling.models.driver_pool import DriverPool
+from crawling.models.influencer import Influencer
 from crawling.models.instagram import Instagram
+from crawling.models.media_downloader import MediaDownloader
+from crawling.models.metrics import DEFAULT_METRICS
+from crawling.models.retry_policy import CircuitBreaker, CrawlFailed
+from crawling.models.scheduler import DEFAULT_SCHEDULER
+from crawling.settings import INSTAGRAM
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Crawl the Instagram pages of the influencers")
+    parser.add_argument('--n-drivers', type=int, default=1,
+                        help='number of parallel sessions, each with its own pair of Chrome instances')
+    parser.add_argument('--influencers', default='data/influencer_dataframe.csv',
+                        help='csv file created by crawling.get_influencer_list_as_dataframe')
+    parser.add_argument('--store', default=None, help='SQLite file of the results, data/influencer.sqlite by default')
+    parser.add_argument('--headless', action='store_true', help='run Chrome in headless mode')
+    parser.add_argument('--profile', choices=['default', 'crawl'], default='default',
+                        help="Chrome profile, 'crawl' blocks images, media, fonts and trackers")
+    parser.add_argument('--measure-transfer', action='store_true',
+                        help='count the bytes transferred per page (always on for the crawl profile)')
+    parser.add_argument('--fixture', action='store_true',
+                        help='crawl the saved pages of a local fixture server instead of Instagram')
+    parser.add_argument('--fixture-latency', type=float, default=0.0,
+                        help='seconds the fixture server waits before answering each request')
+    parser.add_argument('--fixture-stall-probability', type=float, default=0.0,
+                        help='probability that the fixture server stalls a request for 30 seconds')
+    parser.add_argument('--fixture-error-rate', type=float, default=0.0,
+                        help='probability that the fixture server answers a request with 503')
+    parser.add_argument('--limit', type=int, default=None, help='crawl only the first n influencers')
+    parser.add_argument('--n-posts', type=int, default=10,
+                        help='number of posts per influencer, those beyond the first grid are paged from the timeline')
+    parser.add_argument('--stream', type=int, default=None, metavar='N',
+                        help='discover the top N influencers on starngage while crawling them, instead of reading '
+                             '--influencers')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='influencers discovered ahead of the crawl (--stream), twice --n-drivers by default')
+    parser.add_argument('--incremental', action='store_true',
+                        help='refresh stored influencers too: those crawled within --ttl-days are only re-crawled if '
+                             'their profile changed, and then only their new posts')
+    parser.add_argument('--ttl-days', type=float, default=7.0,
+                        help='stored influencers crawled in full longer ago are crawled in full again (--incremental)')
+    parser.add_argument('--queue', default=None,
+                        help='run as a worker of crawling.coordinator: crawl the influencers leased from this work '
+                             'queue file and submit the results to it')
+    parser.add_argument('--worker-id', default=None, help='id of the worker, <host>-<pid> by default')
+    parser.add_argument('--lease-seconds', type=float, default=120.0,
+                        help='how long a lease of the work queue lasts without heartbeat')
+    parser.add_argument('--media', default=None, metavar='DIR',
+                        help='download the images and videos of the posts read into a content-addressed store in DIR')
+    parser.add_argument('--media-workers', type=int, default=8, help='number of media downloads at the same time')
+    parser.add_argument('--recycle-pages', type=int, default=500,
+                        help='replace a Chrome instance by a fresh one after this many pages, 0 to keep it')
+    parser.add_argument('--recycle-rss-mb', type=float, default=2048.0,
+                        help='replace a Chrome instance using more resident memory than this, 0 to not measure it')
+    parser.add_argument('--metrics', action='store_true',
+                        help='time every crawl stage and print a report per stage and of the slowest influencers')
+    parser.add_argument('--trace', default=None,
+                        help='json lines file getting one line per timed stage, turns on --metrics')
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
 
-    # load influencer data
-
-    df = pd.read_csv("data/influencer_dataframe.csv", sep=';', index_col=0)
-
-    # initiate webbot for access influencer's front page
-
-    saved_folder = 'data/influencer'
-
-    connector_front = Instagram()
-    connector_post = Instagram()
-
-    for instagram_id in df['instagram_id'].values:
-
-        if os.path.isfile(f"{saved_folder}/{instagram_id}.csv"):
-            continue
-
-        connector_front.access_influencer_account(instagram_id)
-        info = {}
-        info.update(connector_front.account_verification())
-        metadata = connector_front.get_metadata()
-        if not metadata:
-            continue
+    args = parse_args()
+
+    if args.metrics or args.trace:
+        DEFAULT_METRICS.enable(trace_file=args.trace)
+
+    # the browsers of all sessions start in the background while the influencers are loaded
+    browser_spec = driver_spec(headless=args.headless, profile=args.profile, measure_transfer=args.measure_transfer,
+                               account=INSTAGRAM['username'] if not args.fixture else None)
+    DEFAULT_DRIVER_FACTORY.warm(browser_spec, 2 * args.n_drivers)
+
+    fixture_server = None
+    base_url = "https://www.instagram.com"
+
+    if args.fixture:
+        fixture_server = FixtureServer(latency=args.fixture_latency, stall_probability=args.fixture_stall_probability,
+                                       error_rate=args.fixture_error_rate)
+        base_url = fixture_server.start()
+
+    work_queue = None
+    store = None
+    instagram_ids = []
+    completed_ids = set()
+    refresh_ids = {}
+    unchanged_ids = []
+
+    if args.queue:
+        # the coordinator decides what to crawl and stores the results
+        work_queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds)
+        worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        store_file = args.queue
+    elif args.fixture:
+        store_file = args.store or os.path.join(tempfile.mkdtemp(prefix='fixture_influencer_'), 'influencer.sqlite')
+        if not args.stream:
+            instagram_ids = fixture_instagram_ids(args.limit or 100)
+    elif args.stream:
+        # filled while the ranking is streamed
+        store_file = args.store or get_file('data/influencer.sqlite')
+    else:
+        # load influencer data
+        df = pd.read_csv(args.influencers, sep=';', index_col=0)
+        store_file = args.store or get_file('data/influencer.sqlite')
+        instagram_ids = list(df['instagram_id'].values[:args.limit])
+
+    if work_queue is None:
+        store = ResultStore(store_file)
+
+        # instagram id to the time of its last full crawl, for the influencers refreshed incrementally
+        if args.incremental:
+            stale_before = time.time() - args.ttl_days * 24 * 3600
+            refresh_ids = {instagram_id: crawled_at for instagram_id, (crawled_at, _) in store.crawl_states().items()
+                           if crawled_at >= stale_before}
         else:
-            info.update(metadata)
-
-        article_section_html = connector_front.get_article_section()
-
-        article_section_rows_html = article_section_html.find_all('div', {'class': 'Nnq7C weEfm'})
-
-        like_list = []
-        comment_list = []
-
-        # 資料結構 FAANG 技術考試必考題。
-        queue = deque()
-
-        # 抓取目前所有href
-        for row in article_section_rows_html:
-            all_post_front_html = row.find_all('div', {'class': 'v1Nh3'})
-            for post_front_html in all_post_front_html:
-                href = post_front_html.find('a').get('href')
-                queue.append(href)
-
-        n_of_articles = 0
-        while (n_of_articles < 10) and queue:
-            href = queue.popleft()
-            info.update(connector_post.get_post_data(post_index=n_of_articles, post_href=href))
-            info.update(connector_front.number_of_comments(post_index=n_of_articles, href=href))
-
-            comment_list.append(info[f'number_of_comments_{n_of_articles}'])
-            like_list.append(info[f'number_of_likes_{n_of_articles}'])
-
-            n_of_articles += 1
-
-        info.update({'average_likes': np.mean(like_list),
-                     'average_comments': np.mean(comment_list)})
-        influencer_df = pd.DataFrame.from_dict({f'{instagram_id}': info})
-        influencer_df.to_csv(f"{saved_folder}/{instagram_id}.csv", sep=';')
+            completed_ids = store.completed_ids()
+            instagram_ids = [instagram_id for instagram_id in instagram_ids if instagram_id not in completed_ids]
+
+    def stream_instagram_ids():
+        # the ranking is fetched page by page as the crawl takes the influencers
+        ranking_url = f"{fixture_server.base_url}/app/us/influencer/ranking" if args.fixture \
+            else "https://starngage.com/app/us/influencer/ranking"
+        crawler = Influencer(backend='http', main_url=ranking_url)
+        try:
+            for row in crawler.iter_top_n_influencers(args.stream):
+                if args.incremental or row['instagram_id'] not in completed_ids:
+                    instagram_ids.append(row['instagram_id'])
+                    yield row['instagram_id']
+        finally:
+            crawler.connector.close()
+
+    circuit_breaker = CircuitBreaker()
+
+    media_downloader = MediaDownloader(MediaStore(args.media), max_workers=args.media_workers) if args.media else None
+
+    # initiate webbots for access influencer's front page and posts
+
+    def start_session():
+        connector_front, connector_post = [
+            Instagram(headless=args.headless, base_url=base_url, login=not args.fixture, profile=args.profile,
+                      measure_transfer=args.measure_transfer, max_pages=args.recycle_pages or None,
+                      max_rss_mb=args.recycle_rss_mb or None) for _ in range(2)]
+        if media_downloader is not None:
+            connector_front.media_sink = connector_post.media_sink = media_downloader.submit
+        return connector_front, connector_post
+
+    def close_session(session):
+        for connector in session:
+            connector.connector.close()
+
+    def crawl_and_save(session, instagram_id):
+        previous = store.load_influencer(instagram_id) if instagram_id in refresh_ids else None
+        try:
+            result = crawl_influencer(*session, instagram_id, n_posts=args.n_posts, circuit_breaker=circuit_breaker,
+                                      previous=previous)
+        except CrawlFailed as e:
+            print(f"give up {instagram_id}: {e}")
+            store.mark_failed(instagram_id, str(e))
+            return None
+        if result is None:
+            return None
+        if result is previous:
+            unchanged_ids.append(instagram_id)
+            return True
+        # an incremental refresh keeps the time of the last full crawl, so that the ttl applies to the older posts
+        store.save(instagram_id, *result, crawled_at=refresh_ids.get(instagram_id))
+        # the result is in the store, keep the memory of the pool flat
+        return True
+
+    with DriverPool(args.n_drivers, start_session, close_session) as pool:
+        time_start = perf_counter()
+        if work_queue is None:
+            results = pool.map(crawl_and_save, stream_instagram_ids() if args.stream else instagram_ids,
+                               max_pending=args.max_pending)
+            n_done = sum(result is not None for result in results.values())
+        else:
+            with work_queue.keep_alive(worker_id):
+                n_done = sum(filter(None, pool.run(
+                    lambda session: crawl_from_queue(work_queue, worker_id, session, circuit_breaker,
+                                                     n_posts=args.n_posts))))
+        time_end = perf_counter()
+        n_recycled = 0
+        for session in pool.sessions:
+            for connector in session:
+                n_recycled += connector.connector.n_recycled
+                transfer_summary = connector.connector.transfer_summary()
+                if transfer_summary is not None:
+                    print(f"transfer: {transfer_summary}")
+
+    elapsed = time_end - time_start
+    n_items = len(instagram_ids) if work_queue is None else n_done
+    print(f"crawled {n_done}/{n_items} influencers with {args.n_drivers} sessions in {elapsed:.1f} s "
+          f"({n_done / elapsed if elapsed > 0 else 0:.2f} influencers/s), results in {store_file}")
+    if args.incremental:
+        n_checked = len(set(refresh_ids) & set(instagram_ids))
+        print(f"{len(unchanged_ids)} unchanged of {n_checked} checked incrementally, "
+              f"{len(instagram_ids) - n_checked} crawled in full")
+    if media_downloader is not None:
+        media_downloader.close()
+        print(f"media: {media_downloader.report()}, stored in {args.media}")
+        media_downloader.store.close()
+    print(f"scheduler: {DEFAULT_SCHEDULER.report()}")
+    DEFAULT_DRIVER_FACTORY.close()
+    print(f"browsers: {DEFAULT_DRIVER_FACTORY.report()}, {n_recycled} recycled")
+    if DEFAULT_METRICS.enabled:
+        print(DEFAULT_METRICS.summary())
+        DEFAULT_METRICS.disable()
+
+    if store is not None:
+        store.close()
+    if work_queue is not None:
+        work_queue.close()
+
+    if fixture_server is not None:
+        fixture_server.stop()